@@ -1,27 +1,29 @@
-import binascii
-import hashlib
+import logging
 import os
 from pathlib import Path
 
 import config
+from exceptions.authentication import PasswdFileInvalidException
 from utils.singleton import Singleton
-from .user import User
+from .store import Credential, CredentialStore
+
+
+log = logging.getLogger(__name__)
 
 
 class Auth(metaclass=Singleton):
     """Class for authentication process
 
-    Raises:
-        AuthExceptions.UserNotExistException: When user does not exist
-        AuthExceptions.PasswordIncorrectException: When password is incorrect
-
-    Returns:
-        bool: True if user is authenticated
+    Users are authenticated against the credentials of the passwd file, every password hashed
+    with its own salt by a key derivation function. The file is loaded once and read again only when it changes,
+    manage it with python -m authentication.passwd.
     """
 
     def __init__(self):
         self.passwd_file_path = Path(config.PASSWD_FILE_PATH).expanduser()
-        self.__salt = self._generate_salt()
+        self.store = CredentialStore(self.passwd_file_path)
+        # Verified against for unknown users, so that they take as long as known ones
+        self._unknown_user: Credential | None = None
 
     def __str__(self) -> str:
         return f"""
@@ -30,111 +32,76 @@ class Auth(metaclass=Singleton):
             Passwd file path: {self.passwd_file_path}\n
             """
 
-    def authenticate(self, username: str, password: str) -> bool:
-        """Authenticate user
+    def load(self) -> None:
+        """Load the passwd file, it is created from config.USERS only if it does not exist yet
 
-        Args:
-            username (str): string with username
-            password (str): string with password
+        A file of the previous format is rebuilt from config.USERS, its hashes can not be verified.
 
         Raises:
-            AuthExceptions.UserNotExistException: when user does not exist
-            AuthExceptions.PasswordIncorrectException: when password is incorrect
-
-        Returns:
-            bool: True if user is authenticated
+            PasswdFileInvalidException: when the file holds no valid credentials
         """
 
-        if not self._user_exists(username):
-            return False
-
-        if not self._is_password_correct(username, password):
-            return False
-
-        return True
+        if not self.passwd_file_path.exists():
+            self.create_passwd_file()
+            log.info(f'Created {self.passwd_file_path} with {len(self.store)} users')
+            return
 
-    def _user_exists(self, username: str) -> bool:
-        """Check if user exist in passwd file
+        self.store.load()
+        if self.store.legacy_users:
+            self._upgrade_legacy_users()
 
-        Args:
-            username (str): string with username
-
-        Returns:
-            bool: True if user exist
-        """
+        if not len(self.store):
+            raise PasswdFileInvalidException(
+                f'{self.passwd_file_path} holds no valid credentials, '
+                f'add users with python -m authentication.passwd add USER'
+            )
 
-        for user in self._get_users():
-            if user.username == username:
-                return True
+        log.info(f'Loaded {len(self.store)} users from {self.passwd_file_path}')
 
-        return False
-    
-    def _is_password_correct(self, username: str, password: str) -> bool:
-        """Check if password is correct
+    def authenticate(self, username: str, password: str) -> bool:
+        """Authenticate user, takes as long as deriving a key, so it is best run in a thread
 
         Args:
             username (str): string with username
             password (str): string with password
 
         Returns:
-            bool: True if password is correct
-        """
-
-        for user in self._get_users():
-            if user.username == username and user.password == self._hash_password(password):
-                return True
-
-        return False
-
-    def _hash_password(self, password: str) -> str:
-        """Hash password with sha256
-
-        Args:
-            password (str): string with password
-
-        Returns:
-            str: hashed password
+            bool: True if user is authenticated
         """
 
-        return hashlib.sha256((password + self.__salt).encode('utf-8')).hexdigest()
+        self.store.reload_if_changed()
 
-    def _generate_salt(self) -> str:
-        """Generate salt for password hashing
+        credential = self.store.get(username)
+        if credential is None:
+            if self._unknown_user is None:
+                self._unknown_user = Credential.create(os.urandom(16).hex(), config.PASSWORD_KDF,
+                                                       config.PASSWORD_KDF_PARAMS)
+            self._unknown_user.verify(password)
+            return False
 
-        Returns:
-            str: salt
-        """
+        return credential.verify(password)
 
-        return binascii.hexlify(os.urandom(16)).decode('utf-8')
-    
-    def _get_users(self) -> list[User]:
-        """Get users from passwd file
+    def _upgrade_legacy_users(self) -> None:
+        """Replaces the credentials of the previous format with the passwords of config.USERS"""
 
-        Returns:
-            list[tuple[str, str]]: list of users
-        """
+        passwords = {user.username: user.password for user in config.USERS}
+        for username in self.store.legacy_users:
+            password = passwords.get(username)
+            if password is None:
+                log.error(f'User {username} of {self.passwd_file_path} has a password of the previous format '
+                          f'and is not in config.USERS, set it with python -m authentication.passwd update')
+                continue
 
-        users = []
+            self.store.set(username, Credential.create(password, config.PASSWORD_KDF, config.PASSWORD_KDF_PARAMS))
 
-        with open(self.passwd_file_path) as passwd_file:
-            for line in passwd_file:
-                username, password = line.strip().split(':')
-                users.append(User(username, password))
+        self.store.save()
+        log.warning(f'Rebuilt {self.passwd_file_path} from the previous format with the users of config.USERS')
 
-        return users
-    
     def create_passwd_file(self) -> None:
-        """Create passwd file if not exist"""
-
-        path = Path(config.PASSWD_FILE_PATH).expanduser()
+        """Create the passwd file with the users of config.USERS"""
 
-        # If file exists, clear it - else, create it
-        if path.stat().st_size > 0:
-            open(path, 'w').close()
-        else:
-            path.touch()
+        for user in config.USERS:
+            self.store.set(user.username, Credential.create(user.password, config.PASSWORD_KDF,
+                                                            config.PASSWORD_KDF_PARAMS))
 
-        # Write users to file
-        with open(path, 'w') as passwd_file:
-            for user in config.USERS:
-                passwd_file.write(f"{user.username}:{self._hash_password(user.password)}\n")
+        self.store.save()
@@ -0,0 +1,106 @@
+"""
+Manages the users of the passwd file the broker authenticates clients with.
+
+Every change rewrites the file atomically, without hashing the passwords of the other users again.
+A running broker picks the changes up at the next CONNECT. Passwords are asked for on the terminal,
+or read from the first line of the standard input with --password-stdin.
+
+Usage:
+    python -m authentication.passwd add USER [--kdf pbkdf2_sha256|scrypt] [--param NAME=VALUE ...]
+    python -m authentication.passwd update USER [--kdf pbkdf2_sha256|scrypt] [--param NAME=VALUE ...]
+    python -m authentication.passwd remove USER
+    python -m authentication.passwd list
+    python -m authentication.passwd verify USER
+"""
+import argparse
+import getpass
+import sys
+from pathlib import Path
+
+import config
+from .store import DEFAULT_PARAMS, Credential, CredentialStore
+
+
+def read_password(args: argparse.Namespace, confirm: bool) -> str:
+    if args.password_stdin:
+        return sys.stdin.readline().rstrip('\n')
+
+    password = getpass.getpass('Password: ')
+    if confirm and getpass.getpass('Repeat the password: ') != password:
+        sys.exit('The passwords do not match')
+
+    return password
+
+
+def parse_params(kdf: str, params: list[str]) -> dict[str, int]:
+    """Gets the parameters given on the command line, on top of the configured ones if kdf is PASSWORD_KDF."""
+
+    parsed = dict(config.PASSWORD_KDF_PARAMS) if kdf == config.PASSWORD_KDF else dict()
+    for param in params:
+        name, separator, value = param.partition('=')
+        if not separator or not value.isdigit():
+            sys.exit(f'Invalid parameter {param}, expected NAME=VALUE with an integer value')
+        parsed[name] = int(value)
+
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=config.PASSWD_FILE_PATH, help='passwd file, PASSWD_FILE_PATH by default')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for command in ('add', 'update'):
+        subparser = commands.add_parser(command)
+        subparser.add_argument('user')
+        subparser.add_argument('--kdf', choices=list(DEFAULT_PARAMS), default=config.PASSWORD_KDF)
+        subparser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                               help='parameter of the key derivation function, e.g. iterations=600000 or n=16384')
+        subparser.add_argument('--password-stdin', action='store_true')
+
+    commands.add_parser('remove').add_argument('user')
+    commands.add_parser('list')
+    verify = commands.add_parser('verify')
+    verify.add_argument('user')
+    verify.add_argument('--password-stdin', action='store_true')
+
+    args = parser.parse_args()
+
+    store = CredentialStore(Path(args.file).expanduser())
+    if store.path.exists():
+        store.load()
+
+    if args.command == 'list':
+        for username in store.usernames():
+            credential = store.get(username)
+            params = ', '.join(f'{name}={value}' for name, value in credential.params.items())
+            print(f'{username}: {credential.kdf} ({params})')
+        return
+
+    exists = args.user in store
+    if args.command in ('update', 'remove', 'verify') and not exists:
+        sys.exit(f'No user {args.user} in {store.path}')
+
+    if args.command == 'verify':
+        verified = store.get(args.user).verify(read_password(args, confirm=False))
+        print('Password verified' if verified else 'Wrong password')
+        sys.exit(0 if verified else 1)
+
+    if args.command == 'remove':
+        store.remove(args.user)
+    else:
+        if args.command == 'add' and exists:
+            sys.exit(f'User {args.user} already exists in {store.path}, use update')
+
+        params = parse_params(args.kdf, args.param)
+        try:
+            store.set(args.user, Credential.create(read_password(args, confirm=True), args.kdf, params))
+        except ValueError as e:
+            sys.exit(str(e))
+
+    store.save()
+    print(f'{ {"add": "Added", "update": "Updated", "remove": "Removed"}[args.command]} user {args.user}')
+
+
+if __name__ == '__main__':
+    main()
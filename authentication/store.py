@@ -0,0 +1,225 @@
+import hashlib
+import hmac
+import logging
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+log = logging.getLogger(__name__)
+
+PBKDF2_SHA256 = 'pbkdf2_sha256'
+SCRYPT = 'scrypt'
+
+# Parameters of every key derivation function, used for the ones a record or the configuration leaves out
+DEFAULT_PARAMS: dict[str, dict[str, int]] = {
+    PBKDF2_SHA256: {'iterations': 600_000},
+    SCRYPT: {'n': 2 ** 14, 'r': 8, 'p': 1}
+}
+
+SALT_SIZE = 16
+# Hex digests of the previous format, which regenerated the file on every start with a salt that was not kept
+LEGACY_KEY_LENGTH = 64
+
+
+def derive(kdf: str, password: str, salt: bytes, params: dict[str, int]) -> bytes:
+    """
+    Derives the key of a password with a key derivation function.
+    :param kdf: PBKDF2_SHA256 or SCRYPT
+    :param params: iterations for PBKDF2_SHA256, n, r and p for SCRYPT
+    """
+
+    if kdf == PBKDF2_SHA256:
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['iterations'])
+    if kdf == SCRYPT:
+        n, r, p = params['n'], params['r'], params['p']
+        # The memory scrypt needs is 128 * n * r bytes, OpenSSL's default cap of 32 MiB is raised to allow it
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+    raise ValueError(f'Unknown key derivation function: {kdf}')
+
+
+@dataclass
+class Credential:
+    """Password of a user as stored: the key derived from it with its own salt, and how it was derived."""
+
+    kdf: str
+    params: dict[str, int]
+    salt: bytes
+    key: bytes = field(repr=False)
+
+    @classmethod
+    def create(cls, password: str, kdf: str, params: dict[str, int] | None = None) -> 'Credential':
+        """Derives the credential of a password with a new random salt."""
+
+        if kdf not in DEFAULT_PARAMS:
+            raise ValueError(f'Unknown key derivation function: {kdf}')
+
+        unknown = set(params or ()) - set(DEFAULT_PARAMS[kdf])
+        if unknown:
+            raise ValueError(f'Unknown parameters of {kdf}: {", ".join(sorted(unknown))}')
+
+        params = {**DEFAULT_PARAMS[kdf], **(params or {})}
+        salt = os.urandom(SALT_SIZE)
+
+        return cls(kdf, params, salt, derive(kdf, password, salt, params))
+
+    @classmethod
+    def parse(cls, text: str) -> 'Credential':
+        """
+        Parses a credential formatted as <kdf>$<name>=<value>,...$<salt>$<key>, salt and key in hex.
+        :raises ValueError: when the text is not a valid credential
+        """
+
+        parts = text.split('$')
+        if len(parts) != 4:
+            raise ValueError('Expected <kdf>$<parameters>$<salt>$<key>')
+
+        kdf, params, salt, key = parts
+        if kdf not in DEFAULT_PARAMS:
+            raise ValueError(f'Unknown key derivation function: {kdf}')
+
+        parsed = dict()
+        for param in params.split(','):
+            name, _, value = param.partition('=')
+            parsed[name] = int(value)
+
+        if set(parsed) != set(DEFAULT_PARAMS[kdf]):
+            raise ValueError(f'Parameters of {kdf} have to be {", ".join(DEFAULT_PARAMS[kdf])}')
+
+        return cls(kdf, parsed, bytes.fromhex(salt), bytes.fromhex(key))
+
+    def verify(self, password: str) -> bool:
+        return hmac.compare_digest(derive(self.kdf, password, self.salt, self.params), self.key)
+
+    def __str__(self) -> str:
+        params = ','.join(f'{name}={value}' for name, value in self.params.items())
+
+        return f'{self.kdf}${params}${self.salt.hex()}${self.key.hex()}'
+
+
+def _is_legacy(credential: str) -> bool:
+    """Checks if a credential is a hex digest of the previous format."""
+
+    if len(credential) != LEGACY_KEY_LENGTH:
+        return False
+
+    try:
+        bytes.fromhex(credential)
+    except ValueError:
+        return False
+
+    return True
+
+
+class CredentialStore:
+    """
+    Credentials by user name, kept in a passwd file with a line <user name>:<credential> per user. \\
+    The file is only read by the broker, and read again when it changed, so it can be managed by other tools.
+    Changes are written to a temporary file that replaces the passwd file, readers never see a partial file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._credentials: dict[str, Credential] = dict()
+        # Modification time and size of the file when it was loaded, None before it was loaded
+        self._loaded: tuple[int, int] | None = None
+        # Users of the loaded file with a credential of the previous format, which can not be verified
+        self.legacy_users: list[str] = []
+
+    def load(self):
+        """
+        Reads the credentials from the passwd file. Lines that are not valid credentials are skipped,
+        the users of lines of the previous format, hashed with a salt that was not kept, are listed in legacy_users.
+        """
+
+        stat = self.path.stat()
+        credentials = dict()
+        legacy_users = []
+        with open(self.path) as passwd_file:
+            for number, line in enumerate(passwd_file, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                username, _, credential = line.rpartition(':')
+                if _is_legacy(credential):
+                    legacy_users.append(username)
+                    continue
+
+                try:
+                    credentials[username] = Credential.parse(credential)
+                except ValueError as e:
+                    log.warning(f'Skipping line {number} of {self.path}, it is not a valid credential: {e}')
+
+        if legacy_users:
+            log.warning(f'{len(legacy_users)} users of {self.path} have a password hash of the previous format, '
+                        f'which can not be verified')
+
+        self._credentials = credentials
+        self.legacy_users = legacy_users
+        self._loaded = (stat.st_mtime_ns, stat.st_size)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reads the passwd file again if it changed since it was loaded.
+        :return: True if it was read again
+        """
+
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+
+        if (stat.st_mtime_ns, stat.st_size) == self._loaded:
+            return False
+
+        self.load()
+        log.info(f'Reloaded {len(self._credentials)} credentials from {self.path}')
+        return True
+
+    def get(self, username: str) -> Credential | None:
+        return self._credentials.get(username)
+
+    def set(self, username: str, credential: Credential):
+        """Adds or replaces the credential of a user, save writes it to the passwd file."""
+
+        if ':' in username or '\n' in username:
+            raise ValueError('User names can not contain colons or line breaks')
+
+        self._credentials[username] = credential
+
+    def remove(self, username: str) -> bool:
+        """
+        Removes the credential of a user, save writes the change to the passwd file.
+        :return: True if the user had a credential
+        """
+
+        return self._credentials.pop(username, None) is not None
+
+    def usernames(self) -> list[str]:
+        return list(self._credentials)
+
+    def save(self):
+        """Writes the credentials to the passwd file, readable by its owner only. Comments are not kept."""
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self.path.parent, prefix=f'.{self.path.name}.')
+        try:
+            with os.fdopen(descriptor, 'w') as passwd_file:
+                for username, credential in self._credentials.items():
+                    passwd_file.write(f'{username}:{credential}\n')
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        stat = self.path.stat()
+        self._loaded = (stat.st_mtime_ns, stat.st_size)
+
+    def __len__(self) -> int:
+        return len(self._credentials)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._credentials
@@ -1,9 +1,27 @@
 from dataclasses import dataclass
 
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    Token bucket limits of the PUBLISH messages a client or user may send, None for no limit.
+    A burst defaults to one second worth of its rate.
+    """
+
+    messages_per_second: float | None = None
+    bytes_per_second: float | None = None
+    message_burst: float | None = None
+    byte_burst: float | None = None
+    # Disconnect a client exceeding the limit instead of delaying its reads
+    disconnect: bool = False
+
+
 @dataclass
 class User:
     username: str
     password: str
+    # Shared by all connections of the user
+    rate_limit: RateLimit | None = None
 
     def __str__(self):
         return f"{self.username}:{self.password}"
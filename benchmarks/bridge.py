@@ -0,0 +1,187 @@
+"""
+Cross-node benchmark of two brokers bridged to each other.
+
+Starts two servers in separate processes, each with a bridge subscribing to bench/# on the other one.
+Measures the latency of a PUBLISH sent to the first node until it is delivered by the second one,
+then the throughput of a burst of messages. A subscriber on the first node counts what it receives,
+a message looping back over the bridges would be delivered to it twice.
+
+Usage: python -m benchmarks.bridge [--iterations N] [--messages N] [--payload BYTES] [--qos 0|1]
+"""
+import argparse
+import logging
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.transport import connect, frame, receive_frame, string
+
+PORTS = (18831, 18832)
+
+
+def subscribe(sock: socket.socket, topic_filter: str, qos: int):
+    sock.sendall(frame(0x82, (1).to_bytes(2, 'big') + string(topic_filter) + bytes([qos])))
+    receive_frame(sock)
+
+
+def publish_frame(topic: str, payload: bytes) -> bytes:
+    return frame(0x30, string(topic) + payload)
+
+
+def wait_for_bridges(publisher: socket.socket, subscriber: socket.socket, timeout: float = 10):
+    """Publishes probes on the first node until one arrives at the second, i.e. the bridge is subscribed."""
+
+    deadline = time.monotonic() + timeout
+    subscriber.settimeout(0.1)
+    try:
+        while time.monotonic() < deadline:
+            publisher.sendall(publish_frame('bench/probe', b''))
+            try:
+                receive_frame(subscriber)
+                break
+            except socket.timeout:
+                continue
+        else:
+            raise RuntimeError('The bridges did not connect')
+
+        # Probes still on their way
+        time.sleep(0.5)
+        while True:
+            try:
+                receive_frame(subscriber)
+            except socket.timeout:
+                break
+    finally:
+        subscriber.settimeout(None)
+
+
+def latencies(publisher: socket.socket, subscriber: socket.socket, iterations: int, payload: bytes) -> list[float]:
+    publish = publish_frame('bench/latency', payload)
+
+    results = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        publisher.sendall(publish)
+        receive_frame(subscriber)
+        results.append((time.perf_counter_ns() - start) / 1000)
+
+    return results
+
+
+def throughput(publisher: socket.socket, subscriber: socket.socket, messages: int, payload: bytes) -> float:
+    """Sends a burst of messages to the first node, returns the messages per second received from the second."""
+
+    burst = publish_frame('bench/throughput', payload) * messages
+    sender = threading.Thread(target=publisher.sendall, args=(burst,))
+
+    start = time.perf_counter()
+    sender.start()
+    for _ in range(messages):
+        receive_frame(subscriber)
+    duration = time.perf_counter() - start
+    sender.join()
+
+    return messages / duration
+
+
+def count_received(sock: socket.socket, timeout: float = 1.0) -> int:
+    sock.settimeout(timeout)
+    received = 0
+    try:
+        while True:
+            receive_frame(sock)
+            received += 1
+    except socket.timeout:
+        return received
+
+
+def serve(name: str, port: int, peer_port: int, qos: int):
+    """Runs a node bridged to the peer."""
+
+    from connection import Server
+    from connection.bridge import Bridge
+    from connection.listener import Listener
+
+    server = Server(
+        auth=False,
+        listeners=[Listener(port=port)],
+        bridges=[Bridge(name, port=peer_port, filters={'bench/#': qos}, reconnect_delay=0.1)]
+    )
+    logging.getLogger().setLevel(logging.WARNING)
+    server.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5_000)
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--payload', type=int, default=64)
+    parser.add_argument('--qos', type=int, choices=(0, 1), default=0)
+    parser.add_argument('--serve', nargs=3, metavar=('NAME', 'PORT', 'PEER_PORT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        name, port, peer_port = args.serve
+        serve(name, int(port), int(peer_port), args.qos)
+        return
+
+    nodes = [
+        subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.bridge', '--qos', str(args.qos),
+             '--serve', f'node-{index}', str(port), str(peer_port)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        for index, (port, peer_port) in enumerate((PORTS, PORTS[::-1]))
+    ]
+
+    try:
+        sockets = []
+        deadline = time.monotonic() + 10
+        for port in PORTS:
+            while True:
+                try:
+                    sockets.append(socket.create_connection(('localhost', port)))
+                    break
+                except ConnectionRefusedError:
+                    if time.monotonic() > deadline or any(node.poll() is not None for node in nodes):
+                        raise RuntimeError('The servers did not start')
+                    time.sleep(0.05)
+
+        publisher, subscriber = sockets
+        local_subscriber = socket.create_connection(('localhost', PORTS[0]))
+        connect(publisher, 'bench-publisher')
+        connect(subscriber, 'bench-subscriber')
+        connect(local_subscriber, 'bench-local')
+        subscribe(subscriber, 'bench/#', 0)
+
+        wait_for_bridges(publisher, subscriber)
+        subscribe(local_subscriber, 'bench/throughput', 0)
+
+        payload = b'x' * args.payload
+        latencies(publisher, subscriber, 100, payload)
+        results = latencies(publisher, subscriber, args.iterations, payload)
+        rate = throughput(publisher, subscriber, args.messages, payload)
+        received_locally = count_received(local_subscriber)
+
+        for sock in sockets + [local_subscriber]:
+            sock.close()
+    finally:
+        for node in nodes:
+            node.terminate()
+            node.wait()
+
+    p99 = statistics.quantiles(results, n=100)[98]
+    print(f'Cross-node PUBLISH {args.payload} B, bridge QoS {args.qos}')
+    print(f'{"latency":<12}{"median us":>12}{"p99 us":>12}{"mean us":>12}')
+    print(f'{"":<12}{statistics.median(results):>12.1f}{p99:>12.1f}{statistics.mean(results):>12.1f}')
+    print(f'throughput  {rate:,.0f} messages/s')
+    print(f'publishing node delivered {received_locally} of {args.messages} messages locally '
+          f'({"no loop" if received_locally == args.messages else "LOOP OR LOSS"})')
+
+
+if __name__ == '__main__':
+    main()
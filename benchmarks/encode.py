@@ -0,0 +1,101 @@
+"""
+Encoding benchmark for every message the server sends.
+
+Reports the encode time per frame and the memory allocated per frame for pack(), which allocates a new
+buffer for each frame, and for pack_into() with buffers from the BufferPool.
+Python has no public allocation counter, so the memory is the peak traced by tracemalloc while packing a frame.
+
+Usage: python -m benchmarks.encode [--iterations N]
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable
+
+import connection  # noqa: F401 - resolves the import cycle between messages and connection
+from connection.constants import ConnectReturnCode, MessageType
+from messages import (
+    Header,
+    Message,
+    ConnAckMessage,
+    PublishMessage,
+    PubAckMessage,
+    PubRecMessage,
+    PubRelMessage,
+    PubCompMessage,
+    SubAckMessage,
+    UnsubAckMessage,
+    PingRespMessage
+)
+from messages.buffer_pool import BufferPool
+
+
+def sample_messages() -> dict[str, Message]:
+    return {
+        'CONNACK': ConnAckMessage(Header(MessageType.CONNACK), ConnectReturnCode.ACCEPTED),
+        'PUBLISH 16 B': PublishMessage(Header(MessageType.PUBLISH), b'sensors/room-1/temp', None, b'x' * 16),
+        'PUBLISH 1 KB QoS 1': PublishMessage(Header(MessageType.PUBLISH, qos=1), b'sensors/room-1/temp', 1, b'x' * 1024),
+        'PUBLISH 32 KB QoS 1': PublishMessage(Header(MessageType.PUBLISH, qos=1), b'sensors/room-1/img', 1, b'x' * 32768),
+        'PUBACK': PubAckMessage(Header(MessageType.PUBACK, qos=1), 1),
+        'PUBREC': PubRecMessage(Header(MessageType.PUBREC, qos=2), 1),
+        'PUBREL': PubRelMessage(Header(MessageType.PUBREL, qos=2), 1),
+        'PUBCOMP': PubCompMessage(Header(MessageType.PUBCOMP, qos=2), 1),
+        'SUBACK': SubAckMessage(Header(MessageType.SUBACK), 1, [0, 1, 2]),
+        'UNSUBACK': UnsubAckMessage(Header(MessageType.UNSUBACK), 1),
+        'PINGRESP': PingRespMessage(Header(MessageType.PINGRESP))
+    }
+
+
+def pack(message: Message, pool: BufferPool):
+    message.pack()
+
+
+def pack_into_pooled(message: Message, pool: BufferPool):
+    buffer = pool.acquire(message.frame_size())
+    message.pack_into(buffer)
+    pool.release(buffer)
+
+
+def ns_per_frame(encode: Callable, message: Message, pool: BufferPool, iterations: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        encode(message, pool)
+
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def bytes_per_frame(encode: Callable, message: Message, pool: BufferPool) -> int:
+    encode(message, pool)  # warm up the pool
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        encode(message, pool)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100_000)
+    args = parser.parse_args()
+
+    encoders = {'pack': pack, 'pack_into pooled': pack_into_pooled}
+
+    print(f'{"message":<22}' + ''.join(f'{name + " ns":>22}{name + " B":>22}' for name in encoders))
+    for name, message in sample_messages().items():
+        row = f'{name:<22}'
+        for encode in encoders.values():
+            pool = BufferPool()
+            row += f'{ns_per_frame(encode, message, pool, args.iterations):>22.0f}'
+            row += f'{bytes_per_frame(encode, message, pool):>22}'
+
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Memory used by the broker per idle connection.
+
+Starts a server in a separate process, opens warm-up connections, then opens N more connections that send a CONNECT
+and stay idle. Reports the growth of the resident memory of the server process divided by N, which includes the
+Python objects and buffers of every connection but not the kernel socket buffers. Linux only, it reads /proc.
+
+Usage: python -m benchmarks.idle [--connections N] [--reader-limit BYTES]
+"""
+import argparse
+import logging
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.transport import connect
+
+PORT = 18850
+WARM_UP = 200
+
+
+def raise_open_files_limit(needed: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+
+
+def resident_memory(pid: int) -> int:
+    """Gets the resident set size of a process in bytes."""
+
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+
+    raise RuntimeError(f'No resident set size for process {pid}')
+
+
+def open_idle(count: int, offset: int) -> list[socket.socket]:
+    sockets = []
+    for index in range(offset, offset + count):
+        sock = socket.create_connection(('localhost', PORT))
+        connect(sock, f'idle-{index}')
+        sockets.append(sock)
+
+    return sockets
+
+
+def settle(pid: int) -> int:
+    """Waits until the server handled the connections, returns its resident memory."""
+
+    time.sleep(1.0)
+    return resident_memory(pid)
+
+
+def serve(reader_limit: int):
+    from connection import Server
+    from connection.listener import Listener
+
+    server = Server(auth=False, listeners=[Listener(port=PORT, backlog=4096, reader_limit=reader_limit)])
+    logging.getLogger().setLevel(logging.WARNING)
+    server.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=10_000)
+    parser.add_argument('--reader-limit', type=int, default=64 * 1024, help='reader_limit of the listener')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    raise_open_files_limit(args.connections + WARM_UP + 100)
+
+    if args.serve:
+        serve(args.reader_limit)
+        return
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.idle', '--serve', '--connections', str(args.connections),
+         '--reader-limit', str(args.reader_limit)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    sockets = []
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('localhost', PORT)).close()
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError('The server did not start')
+                time.sleep(0.05)
+
+        # The first connections allocate memory that is shared by all the following ones
+        sockets += open_idle(WARM_UP, 0)
+        before = settle(server.pid)
+
+        start = time.perf_counter()
+        sockets += open_idle(args.connections, WARM_UP)
+        connect_time = time.perf_counter() - start
+        after = settle(server.pid)
+    finally:
+        for sock in sockets:
+            sock.close()
+        server.terminate()
+        server.wait()
+
+    print(f'{args.connections} idle connections opened in {connect_time:.2f} s, reader limit {args.reader_limit}')
+    print(f'resident memory {before / 2 ** 20:.1f} MiB -> {after / 2 ** 20:.1f} MiB')
+    print(f'per idle connection {(after - before) / args.connections:,.0f} bytes')
+
+
+if __name__ == '__main__':
+    main()
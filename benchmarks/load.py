@@ -0,0 +1,127 @@
+"""
+Load test of the broker with many simulated clients of the client package in a single process.
+
+Starts a server in a separate process, connects the publishers and the subscribers, then every publisher sends
+its messages with the given QoS, pipelined up to the in-flight window. Every subscriber receives all of them
+through a wildcard subscription. Reports the publish and delivery rates and the end-to-end latency.
+
+Usage: python -m benchmarks.load [--publishers N] [--subscribers N] [--messages N] [--qos 0|1|2] [--inflight N]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+PORT = 18840
+
+
+async def run(args: argparse.Namespace) -> dict[str, float]:
+    from client import MQTTClient, connect_many
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    latencies = []
+    expected = args.publishers * args.messages * args.subscribers
+    done = asyncio.get_running_loop().create_future()
+
+    def on_message(message):
+        latencies.append((time.perf_counter_ns() - int.from_bytes(message.payload[:8], 'big')) / 1000)
+        if len(latencies) == expected and not done.done():
+            done.set_result(None)
+
+    # The server may still be starting
+    deadline = time.monotonic() + 10
+    while True:
+        probe = MQTTClient('load-probe', port=PORT)
+        try:
+            await probe.connect()
+            await probe.disconnect()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError('The server did not start')
+            await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    subscribers = await connect_many(args.subscribers, 'load-sub', port=PORT, on_message=on_message)
+    publishers = await connect_many(args.publishers, 'load-pub', port=PORT, max_inflight=args.inflight)
+    connect_time = time.perf_counter() - start
+
+    await asyncio.gather(*(subscriber.subscribe('load/#', args.qos) for subscriber in subscribers))
+
+    padding = b'x' * max(args.payload - 8, 0)
+
+    async def publish(index: int, publisher: MQTTClient):
+        topic = f'load/{index}'
+        for _ in range(args.messages):
+            await publisher.publish(topic, time.perf_counter_ns().to_bytes(8, 'big') + padding, args.qos)
+        await publisher.flush()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(publish(index, publisher) for index, publisher in enumerate(publishers)))
+    publish_time = time.perf_counter() - start
+
+    try:
+        await asyncio.wait_for(done, 60)
+    except asyncio.TimeoutError:
+        print(f'Only {len(latencies)} of {expected} messages were delivered', file=sys.stderr)
+    delivery_time = time.perf_counter() - start
+
+    await asyncio.gather(*(client.disconnect() for client in subscribers + publishers))
+
+    return {
+        'connect_time': connect_time,
+        'publish_rate': args.publishers * args.messages / publish_time,
+        'delivery_rate': len(latencies) / delivery_time,
+        'latencies': latencies
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--publishers', type=int, default=1000)
+    parser.add_argument('--subscribers', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--payload', type=int, default=64)
+    parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=1)
+    parser.add_argument('--inflight', type=int, default=16)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        from connection import Server
+        from connection.listener import Listener
+
+        server = Server(auth=False, listeners=[Listener(port=PORT, backlog=1024)])
+        logging.getLogger().setLevel(logging.WARNING)
+        server.run()
+        return
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.load', '--serve'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = results['latencies']
+    print(f'{args.publishers} publishers, {args.subscribers} subscribers, {args.messages} messages each, '
+          f'QoS {args.qos}, in-flight window {args.inflight}')
+    print(f'connect       {results["connect_time"]:.2f} s')
+    print(f'publish       {results["publish_rate"]:,.0f} messages/s acknowledged')
+    print(f'delivery      {results["delivery_rate"]:,.0f} messages/s')
+    if len(latencies) > 1:
+        p99 = statistics.quantiles(latencies, n=100)[98]
+        print(f'latency       median {statistics.median(latencies) / 1000:.1f} ms, p99 {p99 / 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
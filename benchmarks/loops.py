@@ -0,0 +1,68 @@
+"""
+Load test of the broker served on one event loop and on several, see Server(loops=...).
+
+Runs the load test of benchmarks.load against a server started in a separate process for every number of loops,
+and reports the rates side by side. With the global interpreter lock the loops take turns on a single core,
+several loops only pay off on a free-threaded interpreter, e.g. python3.13t.
+
+Usage: python -m benchmarks.loops [--loops N ...] [--publishers N] [--subscribers N] [--messages N] [--qos 0|1|2]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import subprocess
+import sys
+
+from .load import PORT, run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loops', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--publishers', type=int, default=200)
+    parser.add_argument('--subscribers', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--payload', type=int, default=64)
+    parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=1)
+    parser.add_argument('--inflight', type=int, default=16)
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        from connection import Server
+        from connection.listener import Listener
+
+        server = Server(auth=False, loops=args.serve, listeners=[Listener(port=PORT, backlog=1024)])
+        logging.getLogger().setLevel(logging.WARNING)
+        server.run()
+        return
+
+    from connection.loops import is_free_threaded
+
+    print(f'{args.publishers} publishers, {args.subscribers} subscribers, {args.messages} messages each, '
+          f'QoS {args.qos}, {"without" if is_free_threaded() else "with"} the GIL')
+    print(f'{"loops":>5} {"publish/s":>12} {"delivery/s":>12} {"median ms":>10} {"p99 ms":>8}')
+
+    for loops in args.loops:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.loops', '--serve', str(loops)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        try:
+            results = asyncio.run(run(args))
+        finally:
+            server.terminate()
+            server.wait()
+
+        latencies = results['latencies']
+        median = statistics.median(latencies) / 1000 if latencies else 0
+        p99 = statistics.quantiles(latencies, n=100)[98] / 1000 if len(latencies) > 1 else 0
+        print(f'{loops:>5} {results["publish_rate"]:>12,.0f} {results["delivery_rate"]:>12,.0f} '
+              f'{median:>10.1f} {p99:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+"""
+Microbenchmarks of the hot paths: the codec, topic name validation and matching, the heavy hitters counters,
+and publish and subscribe against generated topic trees with a mix of exact and wildcard subscriptions.
+
+Every case is timed in loops long enough to be measured reliably, the fastest of several repeats is kept.
+Results can be saved as a JSON baseline, compare runs the suite again (or reads a second result file) and
+fails when a case got slower than the threshold, so it can gate changes in CI.
+
+Usage:
+    python -m benchmarks.micro run [--sizes 1000 100000 1000000] [--filter TEXT] [--save FILE]
+    python -m benchmarks.micro compare BASELINE [CURRENT] [--threshold 0.2] [--sizes ...] [--filter TEXT]
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable
+
+import connection  # noqa: F401, imported before messages because of the import cycle between them
+from connection.constants import MQTT5_PROTOCOL_VERSION, ConnectReturnCode, MessageType
+from connection.heavy_hitters import TrafficStats
+from messages import (
+    Header,
+    ConnectMessage,
+    ConnAckMessage,
+    SubscribeMessage,
+    SubAckMessage,
+    UnsubscribeMessage,
+    UnsubAckMessage,
+    PublishMessage,
+    PingReqMessage,
+    PingRespMessage,
+    DisconnectMessage,
+    PubAckMessage,
+    PubRecMessage,
+    PubRelMessage,
+    PubCompMessage
+)
+from messages.properties import PropertyId
+from messages.structs import pack_remaining_length, read_remaining_length, split_topic_name
+from messages.subscribe import RequestedTopic
+from processing import TopicManager
+from utils.singleton import Singleton
+
+DEFAULT_SIZES = (1_000, 100_000)
+# Run to run noise of the fastest cases is around 10%
+DEFAULT_THRESHOLD = 0.20
+# Seconds a timed loop has to run at least, and number of timed loops per case
+MIN_TIME = 0.05
+REPEAT = 5
+
+METRICS = ('temperature', 'humidity', 'status', 'power')
+
+
+@dataclass
+class Case:
+    name: str
+    # Called once per iteration, returns an awaitable for async cases
+    function: Callable
+    is_async: bool = False
+
+
+class NullSubscriber:
+    """Subscriber that drops every message, so only the routing is measured."""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.address = client_id
+
+    async def notify(self, message: PublishMessage):
+        pass
+
+    async def notify_many(self, messages: list[PublishMessage]):
+        pass
+
+
+def codec_cases() -> list[Case]:
+    messages = {
+        'connect': ConnectMessage(Header(MessageType.CONNECT), False, 0, True, 60, 'sensor-0042', 'user-1', 'user-1',
+                                  'status/sensor-0042', 'offline'),
+        'connack': ConnAckMessage(Header(MessageType.CONNACK), ConnectReturnCode.ACCEPTED),
+        'publish[64B]': PublishMessage(Header(MessageType.PUBLISH, qos=1), b'site1/area2/device3/temperature', 7,
+                                       b'x' * 64),
+        'publish[64KiB]': PublishMessage(Header(MessageType.PUBLISH, qos=1), b'site1/area2/device3/temperature', 7,
+                                         b'x' * 64 * 1024),
+        'puback': PubAckMessage(Header(MessageType.PUBACK), 7),
+        'pubrec': PubRecMessage(Header(MessageType.PUBREC), 7),
+        'pubrel': PubRelMessage(Header(MessageType.PUBREL, qos=1), 7),
+        'pubcomp': PubCompMessage(Header(MessageType.PUBCOMP), 7),
+        'subscribe': SubscribeMessage(Header(MessageType.SUBSCRIBE, qos=1), 7,
+                                      [RequestedTopic('site1/#', 1), RequestedTopic('+/+/+/status', 0)]),
+        'suback': SubAckMessage(Header(MessageType.SUBACK), 7, [1, 0]),
+        'unsubscribe': UnsubscribeMessage(Header(MessageType.UNSUBSCRIBE, qos=1), 7, ['site1/#', '+/+/+/status']),
+        'unsuback': UnsubAckMessage(Header(MessageType.UNSUBACK), 7),
+        'pingreq': PingReqMessage(Header(MessageType.PINGREQ)),
+        'pingresp': PingRespMessage(Header(MessageType.PINGRESP)),
+        'disconnect': DisconnectMessage(Header(MessageType.DISCONNECT))
+    }
+
+    header_byte = messages['publish[64B]'].pack()[:1]
+    header = Header(MessageType.PUBLISH, 0, 1, 0)
+    cases = [
+        Case('codec/Header.from_bytes', lambda: Header.from_bytes(header_byte)),
+        Case('codec/Header.pack', header.pack),
+        Case('codec/pack_remaining_length[2B]', lambda: pack_remaining_length(300)),
+        Case('codec/pack_remaining_length[4B]', lambda: pack_remaining_length(100_000_000)),
+        Case('codec/read_remaining_length[2B]', remaining_length_reader(300), is_async=True),
+        Case('codec/read_remaining_length[4B]', remaining_length_reader(100_000_000), is_async=True)
+    ]
+
+    for name, message in messages.items():
+        frame = message.pack()
+        # The body starts after the fixed header and the remaining length
+        body = frame[1 + len(pack_remaining_length(message.remaining_length())):]
+        message_class = type(message)
+        cases.append(Case(f'codec/{name}.from_data',
+                          lambda message_class=message_class, message=message, body=body:
+                          message_class.from_data(message.header, BytesIO(body))))
+        cases.append(Case(f'codec/{name}.pack', message.pack))
+
+    # MQTT 5 adds properties after the message id, a topic alias and a user property are typical
+    publish5 = PublishMessage(Header(MessageType.PUBLISH, qos=1), b'site1/area2/device3/temperature', 7, b'x' * 64,
+                              properties={PropertyId.TOPIC_ALIAS: 3, PropertyId.USER_PROPERTY: [('unit', 'C')]})
+    frame = publish5.pack()
+    body = frame[1 + len(pack_remaining_length(publish5.remaining_length())):]
+    cases.append(Case('codec/publish[64B,mqtt5].from_data',
+                      lambda: PublishMessage.from_data(publish5.header, BytesIO(body), MQTT5_PROTOCOL_VERSION)))
+    cases.append(Case('codec/publish[64B,mqtt5].pack', publish5.pack))
+
+    return cases
+
+
+def remaining_length_reader(remaining_length: int) -> Callable:
+    """Reads the remaining length from a reader that is refilled whenever it runs out of data."""
+
+    encoded = pack_remaining_length(remaining_length)
+    reader = None
+
+    def read():
+        nonlocal reader
+        if reader is None or not reader._buffer:
+            reader = asyncio.StreamReader()
+            reader.feed_data(encoded * 100_000)
+
+        return read_remaining_length(reader)
+
+    return read
+
+
+def topic_name_cases() -> list[Case]:
+    return [
+        Case('topics/_is_valid_topic_name', lambda: TopicManager._is_valid_topic_name('site1/area2/device3/status')),
+        Case('topics/_matches_name_with_structure[exact]',
+             lambda: TopicManager._matches_name_with_structure('site1/area2/device3/status',
+                                                               'site1/area2/device3/status')),
+        Case('topics/_matches_name_with_structure[+]',
+             lambda: TopicManager._matches_name_with_structure('site1/area2/device3/status', '+/+/+/status')),
+        Case('topics/_matches_name_with_structure[#]',
+             lambda: TopicManager._matches_name_with_structure('site1/area2/device3/status', 'site1/#'))
+    ]
+
+
+def heavy_hitters_cases() -> list[Case]:
+    """Counting a message in and out, with topics and clients skewed the way a few hot ones dominate traffic."""
+
+    stats = TrafficStats(60, 6, 32, 2048, 4)
+    names = topic_names(100_000)
+    generator = random.Random(0)
+    keys = [
+        (names[int(generator.paretovariate(1.2)) % len(names)], f'client-{int(generator.paretovariate(1.2)) % 10_000}')
+        for _ in range(65536)
+    ]
+    recorded = 0
+
+    def record_in():
+        nonlocal recorded
+        recorded += 1
+        topic, client_id = keys[recorded & 0xffff]
+        stats.record_in(topic, client_id, 64)
+
+    def record_out():
+        nonlocal recorded
+        recorded += 1
+        topic, client_id = keys[recorded & 0xffff]
+        stats.record_out(topic, client_id, 64)
+
+    return [
+        Case('heavy_hitters/record_in', record_in),
+        Case('heavy_hitters/record_out', record_out),
+        Case('heavy_hitters/report', stats.report)
+    ]
+
+
+def topic_names(size: int) -> list[bytes]:
+    """Topic names of a fleet: sites with areas with devices reporting a few metrics each."""
+
+    devices = size // len(METRICS)
+    return [
+        f'site{device % 10}/area{device // 10 % 100}/device{device}/{metric}'.encode()
+        for device in range(devices)
+        for metric in METRICS
+    ]
+
+
+def build_tree(size: int) -> tuple[TopicManager, list[bytes]]:
+    """
+    Creates a topic manager with the topics of topic_names, an exact subscription to 1% of them
+    and wildcard subscriptions per site, per metric and to everything.
+    """
+
+    # The topic manager is a singleton, every tree needs a new one
+    Singleton._instances.pop(TopicManager, None)
+    manager = TopicManager()
+    manager.memory = None
+
+    names = topic_names(size)
+    for name in names:
+        manager._create_topic(name, split_topic_name(name))
+
+    # Subscribed directly, subscribe_to_topic is measured on its own
+    for index, name in enumerate(names[::100]):
+        manager._topics[name].subscribed_clients[NullSubscriber(f'exact-{index}')] = 0
+
+    wildcards = [f'site{site}/#' for site in range(10)] + [f'+/+/+/{metric}' for metric in METRICS] + ['#']
+    loop = asyncio.new_event_loop()
+    for index, structure in enumerate(wildcards):
+        loop.run_until_complete(manager.subscribe_to_topic(structure, NullSubscriber(f'wildcard-{index}'), 0))
+    loop.close()
+
+    return manager, names
+
+
+def tree_cases(size: int) -> list[Case]:
+    manager, names = build_tree(size)
+    label = f'{size // 1000}k' if size < 1_000_000 else f'{size // 1_000_000}M'
+
+    # A spread of topics, so the route cache sees both hits and misses as it would with a large fleet
+    messages = [PublishMessage(Header(MessageType.PUBLISH), name, None, b'x' * 64) for name in names[::7]]
+    published = 0
+
+    def publish():
+        nonlocal published
+        published += 1
+        return manager.publish(messages[published % len(messages)])
+
+    subscriber = NullSubscriber('benchmark')
+    exact = names[len(names) // 2].decode()
+
+    return [
+        Case(f'tree[{label}]/publish', publish, is_async=True),
+        Case(f'tree[{label}]/subscribe_to_topic[exact]',
+             lambda: manager.subscribe_to_topic(exact, subscriber, 0), is_async=True),
+        Case(f'tree[{label}]/subscribe_to_topic[wildcard]',
+             lambda: manager.subscribe_to_topic('site3/+/+/status', subscriber, 0), is_async=True)
+    ]
+
+
+def time_loop(case: Case, number: int, loop: asyncio.AbstractEventLoop) -> float:
+    """Runs the case number times, returns the seconds it took."""
+
+    if case.is_async:
+        async def run():
+            start = time.perf_counter()
+            for _ in range(number):
+                await case.function()
+            return time.perf_counter() - start
+
+        return loop.run_until_complete(run())
+
+    function = case.function
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    return time.perf_counter() - start
+
+
+def measure(case: Case, loop: asyncio.AbstractEventLoop) -> dict[str, float]:
+    number = 1
+    while True:
+        elapsed = time_loop(case, number, loop)
+        if elapsed >= MIN_TIME:
+            break
+        number *= 10 if elapsed < MIN_TIME / 10 else 2
+
+    per_operation = [time_loop(case, number, loop) / number * 1e9 for _ in range(REPEAT)]
+
+    return {'ns_per_op': min(per_operation), 'median_ns': statistics.median(per_operation), 'loops': number}
+
+
+def run_suite(sizes: list[int], name_filter: str | None) -> dict[str, dict[str, float]]:
+    def selected(cases: list[Case]) -> list[Case]:
+        return [case for case in cases if name_filter is None or name_filter in case.name]
+
+    loop = asyncio.new_event_loop()
+    results = dict()
+
+    groups = [codec_cases, topic_name_cases, heavy_hitters_cases] + [lambda size=size: tree_cases(size) for size in sizes]
+    for group in groups:
+        for case in selected(group()):
+            results[case.name] = result = measure(case, loop)
+            print(f'{case.name:<52}{format_time(result["ns_per_op"]):>12}', file=sys.stderr)
+
+    loop.close()
+    return results
+
+
+def format_time(nanoseconds: float) -> str:
+    if nanoseconds < 1e3:
+        return f'{nanoseconds:.0f} ns'
+    if nanoseconds < 1e6:
+        return f'{nanoseconds / 1e3:.2f} us'
+    return f'{nanoseconds / 1e6:.2f} ms'
+
+
+def save(results: dict[str, dict[str, float]], path: str):
+    document = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results
+    }
+    with open(path, 'w') as file:
+        json.dump(document, file, indent=2)
+
+
+def load(path: str) -> dict[str, dict[str, float]]:
+    with open(path) as file:
+        return json.load(file)['results']
+
+
+def compare(baseline: dict[str, dict[str, float]], current: dict[str, dict[str, float]], threshold: float) -> bool:
+    """Prints the change of every case, returns False if any case got slower than the threshold."""
+
+    passed = True
+    print(f'{"case":<52}{"baseline":>12}{"current":>12}{"change":>9}')
+    for name in list(baseline) + [name for name in current if name not in baseline]:
+        if name not in baseline or name not in current:
+            print(f'{name:<52}{"only in " + ("current" if name in current else "baseline"):>33}')
+            continue
+
+        before, after = baseline[name]['ns_per_op'], current[name]['ns_per_op']
+        change = after / before - 1
+        regressed = change > threshold
+        passed &= not regressed
+
+        print(f'{name:<52}{format_time(before):>12}{format_time(after):>12}{change:>+9.1%}'
+              f'{"  REGRESSION" if regressed else ""}')
+
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the suite')
+    run_parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+
+    compare_parser = commands.add_parser('compare', help='compare with a baseline, exit with 1 on a regression')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current', nargs='?', help='results to compare, the suite is run if not given')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='largest accepted slowdown, 0.2 for 20%%')
+
+    for command_parser in (run_parser, compare_parser):
+        command_parser.add_argument('--sizes', type=int, nargs='*', default=list(DEFAULT_SIZES),
+                                    help='numbers of topics of the generated trees')
+        command_parser.add_argument('--filter', help='run only the cases whose name contains the text')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_suite(args.sizes, args.filter)
+        if args.save:
+            save(results, args.save)
+        return
+
+    baseline = load(args.baseline)
+    current = load(args.current) if args.current else run_suite(args.sizes, args.filter)
+    if args.filter:
+        baseline = {name: result for name, result in baseline.items() if args.filter in name}
+
+    if not compare(baseline, current, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Replays a traffic capture recorded with CAPTURE_PATH (or Server(capture_path=...)) against a broker.
+
+Every captured connection is opened again and sends its frames in their original order, at the original pace,
+N times faster, or as fast as possible. Connections run concurrently, so the mix of clients is kept as well.
+What the broker sends back is read and dropped. Reports how late the frames were sent against the schedule.
+
+Usage: python -m benchmarks.replay CAPTURE [--host HOST] [--port PORT | --path SOCKET] [--speed N | --max-speed]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+
+from connection.capture import CaptureRecord, RecordKind, read_capture
+
+# Seconds a replayed connection waits for the broker to close it after its last frame
+LINGER = 1.0
+
+
+async def discard(reader: asyncio.StreamReader):
+    while await reader.read(64 * 1024):
+        pass
+
+
+async def replay_connection(
+    records: list[CaptureRecord],
+    args: argparse.Namespace,
+    start: float,
+    lateness: list[float]
+) -> int:
+    """Replays the records of one connection, returns the number of frames sent."""
+
+    loop = asyncio.get_running_loop()
+
+    async def wait_for(record: CaptureRecord):
+        if args.max_speed:
+            return
+
+        scheduled = start + record.timestamp / 1e9 / args.speed
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        lateness.append(max(loop.time() - scheduled, 0.0))
+
+    await wait_for(records[0])
+    if args.path is not None:
+        reader, writer = await asyncio.open_unix_connection(args.path)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+
+    reading = asyncio.create_task(discard(reader))
+    sent = 0
+    try:
+        for record in records[1:]:
+            await wait_for(record)
+            if record.kind == RecordKind.CLOSE:
+                break
+            if record.kind == RecordKind.TRUNCATED:
+                # The capture lost part of a frame, the rest of the connection would not parse
+                print(f'Connection {records[0].data.decode()} was truncated by the capture', file=sys.stderr)
+                break
+
+            writer.write(record.data)
+            await writer.drain()
+            sent += 1
+
+        # The broker closes the connection once it handled a DISCONNECT, closing first would lose its replies
+        await asyncio.wait({reading}, timeout=LINGER)
+    except ConnectionError as e:
+        print(f'Connection {records[0].data.decode()} closed by the broker: {e}', file=sys.stderr)
+    finally:
+        reading.cancel()
+        writer.close()
+
+    return sent
+
+
+async def replay(args: argparse.Namespace) -> tuple[int, int, float, list[float]]:
+    connections: dict[int, list[CaptureRecord]] = dict()
+    with open(args.capture, 'rb') as file:
+        for record in read_capture(file):
+            if record.kind == RecordKind.OPEN:
+                connections[record.connection_id] = [record]
+            elif record.connection_id in connections:
+                connections[record.connection_id].append(record)
+
+    lateness = []
+    start = asyncio.get_running_loop().time()
+    sent = await asyncio.gather(
+        *(replay_connection(records, args, start, lateness) for records in connections.values())
+    )
+
+    return len(connections), sum(sent), asyncio.get_running_loop().time() - start, lateness
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--path', help='Unix domain socket of the broker')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay N times faster than recorded')
+    parser.add_argument('--max-speed', action='store_true', help='send every frame as soon as possible')
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error('--speed must be positive')
+
+    connections, frames, duration, lateness = asyncio.run(replay(args))
+
+    print(f'Replayed {frames} frames of {connections} connections in {duration:.2f} s '
+          f'({frames / max(duration, 1e-9):,.0f} frames/s)')
+    if len(lateness) > 1:
+        p99 = statistics.quantiles(lateness, n=100)[98]
+        print(f'Lateness against the schedule: median {statistics.median(lateness) * 1000:.2f} ms, '
+              f'p99 {p99 * 1000:.2f} ms, max {max(lateness) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+TLS handshake benchmark of a TLS listener with a self-signed certificate.
+
+Starts a server with a TLS listener in a separate process, then connects repeatedly: once with a new TLS session
+every time and once resuming the session of the first connection. Reports the time to the CONNACK for both.
+The certificate is generated with the openssl command line tool.
+
+Usage: python -m benchmarks.tls [--connections N]
+"""
+import argparse
+import logging
+import os
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.transport import connect
+
+PORT = 18883
+
+
+def create_certificate(directory: str) -> tuple[str, str]:
+    """Creates a self-signed certificate for localhost, returns the certificate and key paths."""
+
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+
+    subprocess.run(
+        [
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost',
+            '-keyout', keyfile, '-out', certfile
+        ],
+        check=True,
+        capture_output=True
+    )
+
+    return certfile, keyfile
+
+
+def connect_tls(context: ssl.SSLContext, session: ssl.SSLSession | None) -> tuple[float, ssl.SSLSocket]:
+    start = time.perf_counter_ns()
+
+    sock = context.wrap_socket(socket.create_connection(('localhost', PORT)), server_hostname='localhost',
+                               session=session)
+    connect(sock, 'bench-tls')
+
+    return (time.perf_counter_ns() - start) / 1000, sock
+
+
+def handshakes(context: ssl.SSLContext, connections: int, resume: bool) -> tuple[list[float], int]:
+    """
+    Connects repeatedly, resuming the session of the first connection if resume is set.
+    :return: time to the CONNACK of every connection, number of resumed sessions
+    """
+
+    _, sock = connect_tls(context, None)
+    # With TLS 1.3 the session ticket arrives after the handshake, it is there once the CONNACK has been read
+    session = sock.session
+    sock.close()
+
+    latencies = []
+    resumed = 0
+    for _ in range(connections):
+        latency, sock = connect_tls(context, session if resume else None)
+        latencies.append(latency)
+        resumed += sock.session_reused
+        sock.close()
+
+    return latencies, resumed
+
+
+def serve(certfile: str, keyfile: str):
+    """Runs the server with a TLS listener."""
+
+    from connection import Server
+    from connection.listener import Listener
+
+    server = Server(auth=False, listeners=[Listener(port=PORT, certfile=certfile, keyfile=keyfile)])
+    logging.getLogger().setLevel(logging.WARNING)
+    server.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--serve', nargs=2, metavar=('CERTFILE', 'KEYFILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(*args.serve)
+        return
+
+    certfile, keyfile = create_certificate(tempfile.mkdtemp())
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.tls', '--serve', certfile, keyfile],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    context = ssl.create_default_context(cafile=certfile)
+
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('localhost', PORT)).close()
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError('The server did not start')
+                time.sleep(0.05)
+
+        results = {
+            'full': handshakes(context, args.connections, resume=False),
+            'resumed': handshakes(context, args.connections, resume=True)
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f'{"handshake":<12}{"resumed":>10}{"median us":>12}{"p99 us":>12}{"mean us":>12}')
+    for name, (latencies, resumed) in results.items():
+        p99 = statistics.quantiles(latencies, n=100)[98]
+        print(f'{name:<12}{resumed:>10}{statistics.median(latencies):>12.1f}{p99:>12.1f}'
+              f'{statistics.mean(latencies):>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
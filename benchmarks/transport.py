@@ -0,0 +1,158 @@
+"""
+Latency benchmark of a Unix domain socket listener against a loopback TCP listener.
+
+Starts a server with both listeners in a separate process, then measures over each transport the round trip
+of PINGREQ/PINGRESP and of a QoS 0 PUBLISH delivered back to the same client through its subscription.
+
+Usage: python -m benchmarks.transport [--iterations N] [--payload BYTES]
+"""
+import argparse
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PORT = 18830
+
+
+def frame(packet_type: int, body: bytes) -> bytes:
+    remaining_length = bytearray()
+    length = len(body)
+    while True:
+        digit, length = length & 127, length >> 7
+        remaining_length.append(digit | (128 if length else 0))
+        if not length:
+            break
+
+    return bytes([packet_type]) + remaining_length + body
+
+
+def string(value: str) -> bytes:
+    encoded = value.encode()
+    return len(encoded).to_bytes(2, 'big') + encoded
+
+
+def receive_frame(sock: socket.socket) -> bytes:
+    def receive_exactly(size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Connection closed by the server')
+            data += chunk
+        return bytes(data)
+
+    header = receive_exactly(1)
+    length, multiplier = 0, 1
+    while True:
+        digit = receive_exactly(1)[0]
+        length += (digit & 127) * multiplier
+        multiplier *= 128
+        if not digit & 128:
+            break
+
+    return header + receive_exactly(length)
+
+
+def connect(sock: socket.socket, client_id: str):
+    sock.sendall(frame(0x10, string('MQIsdp') + bytes([3, 2]) + (60).to_bytes(2, 'big') + string(client_id)))
+    if receive_frame(sock)[-1] != 0:
+        raise ConnectionError('Connection refused')
+
+
+def round_trips(sock: socket.socket, request: bytes, iterations: int) -> list[float]:
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        sock.sendall(request)
+        receive_frame(sock)
+        latencies.append((time.perf_counter_ns() - start) / 1000)
+
+    return latencies
+
+
+def measure(sock: socket.socket, name: str, iterations: int, payload: int) -> dict[str, list[float]]:
+    connect(sock, f'bench-{name}')
+
+    topic = f'bench/{name}'
+    sock.sendall(frame(0x82, (1).to_bytes(2, 'big') + string(topic) + b'\x00'))
+    receive_frame(sock)
+
+    ping = frame(0xc0, b'')
+    publish = frame(0x30, string(topic) + b'x' * payload)
+
+    # Warm up the connection and the server's caches
+    round_trips(sock, ping, 100)
+    round_trips(sock, publish, 100)
+
+    return {
+        'PINGREQ': round_trips(sock, ping, iterations),
+        f'PUBLISH {payload} B': round_trips(sock, publish, iterations)
+    }
+
+
+def serve(path: str):
+    """Runs the server with a TCP and a Unix domain socket listener."""
+
+    from connection import Server
+    from connection.listener import Listener
+
+    server = Server(auth=False, listeners=[Listener(port=PORT), Listener(path=path)])
+    logging.getLogger().setLevel(logging.WARNING)
+    server.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10_000)
+    parser.add_argument('--payload', type=int, default=64)
+    parser.add_argument('--serve', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(), 'mqtt.sock')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.transport', '--serve', path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    try:
+        deadline = time.monotonic() + 10
+        while not os.path.exists(path):
+            if time.monotonic() > deadline or server.poll() is not None:
+                raise RuntimeError('The server did not start')
+            time.sleep(0.05)
+
+        tcp = socket.create_connection(('localhost', PORT))
+        unix = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix.connect(path)
+
+        results = {
+            'TCP loopback': measure(tcp, 'tcp', args.iterations, args.payload),
+            'Unix socket': measure(unix, 'unix', args.iterations, args.payload)
+        }
+
+        tcp.close()
+        unix.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f'{"transport":<16}{"exchange":<20}{"median us":>12}{"p99 us":>12}{"mean us":>12}')
+    for transport, exchanges in results.items():
+        for exchange, latencies in exchanges.items():
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f'{transport:<16}{exchange:<20}{statistics.median(latencies):>12.1f}{p99:>12.1f}'
+                  f'{statistics.mean(latencies):>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
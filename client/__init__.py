@@ -0,0 +1 @@
+from .client import MQTTClient, connect_many
@@ -0,0 +1,367 @@
+import asyncio
+import logging
+import ssl
+from typing import Callable, Iterable
+
+from connection.constants import ConnectReturnCode, MessageType
+from exceptions.connection import MQTTConnectionError
+from messages import (
+    Header,
+    Message,
+    ConnectMessage,
+    ConnAckMessage,
+    SubscribeMessage,
+    SubAckMessage,
+    UnsubscribeMessage,
+    UnsubAckMessage,
+    PublishMessage,
+    PingReqMessage,
+    PingRespMessage,
+    DisconnectMessage,
+    PubAckMessage,
+    PubRecMessage,
+    PubRelMessage,
+    PubCompMessage
+)
+from messages.subscribe import RequestedTopic
+
+
+log = logging.getLogger(__name__)
+
+MAXIMUM_MESSAGE_ID = 65535
+
+
+class MQTTClient:
+    """
+    Asyncio MQTT 3.1 client built on the messages package, light enough to run thousands of them in one process
+    for load tests. \\
+    QoS 1 and 2 messages are pipelined: publish returns as soon as the message is written, with a future
+    resolved by its acknowledgement, and up to max_inflight messages wait for their acknowledgement at once.
+    Received messages are passed to on_message if it is set, otherwise they are queued for the async iterator.
+
+    Example::
+
+        client = MQTTClient('sensor-1')
+        await client.connect()
+        await client.subscribe({'sensors/#': 1})
+        acknowledged = await client.publish('sensors/1', b'21.5', qos=1)
+        await acknowledged
+        async for message in client:
+            print(message.topic_name, message.payload)
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        host: str = 'localhost',
+        port: int = 1883,
+        path: str | None = None,
+        user_name: str | None = None,
+        password: str | None = None,
+        keep_alive: int = 60,
+        clean_session: bool = True,
+        will_topic: str | None = None,
+        will_message: str | None = None,
+        will_qos: int = 0,
+        will_retain: bool = False,
+        max_inflight: int = 64,
+        ssl_context: ssl.SSLContext | None = None,
+        on_message: Callable[[PublishMessage], None] | None = None
+    ):
+        """
+        :param path: Unix domain socket of the broker, host and port are ignored when it is set
+        :param max_inflight: QoS 1 and 2 messages published but not acknowledged yet, publish waits above it
+        :param on_message: called with every received PUBLISH message instead of queuing it for the iterator
+        """
+
+        self.client_id = client_id
+        self.host = host
+        self.port = port
+        self.path = path
+        self.user_name = user_name
+        self.password = password
+        self.keep_alive = keep_alive
+        self.clean_session = clean_session
+        self.will_topic = will_topic
+        self.will_message = will_message
+        self.will_qos = will_qos
+        self.will_retain = will_retain
+        self.ssl_context = ssl_context
+        self.on_message = on_message
+
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._closed = True
+
+        self._inflight = asyncio.Semaphore(max_inflight)
+        # Futures of the messages waiting for an acknowledgement by message id
+        self._pending: dict[int, asyncio.Future] = dict()
+        self._last_message_id = 0
+        self._messages: asyncio.Queue[PublishMessage | None] = asyncio.Queue()
+
+        self.published = 0
+        self.acknowledged = 0
+        self.received = 0
+
+    async def connect(self, timeout: float = 10.0):
+        """
+        Connects to the broker and waits for the CONNACK.
+        :raises ConnectionRefusedError: when the broker refuses the connection
+        """
+
+        if self.path is not None:
+            connection = asyncio.open_unix_connection(self.path, ssl=self.ssl_context)
+        else:
+            connection = asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+
+        self._reader, self._writer = await asyncio.wait_for(connection, timeout)
+        self._closed = False
+
+        self._write(ConnectMessage(
+            Header(MessageType.CONNECT),
+            self.will_retain,
+            self.will_qos,
+            self.clean_session,
+            self.keep_alive,
+            self.client_id,
+            self.user_name,
+            self.password,
+            self.will_topic,
+            self.will_message
+        ))
+
+        try:
+            connack = await asyncio.wait_for(Message.from_reader(self._reader), timeout)
+            if not isinstance(connack, ConnAckMessage):
+                raise MQTTConnectionError(f'Expected CONNACK, received {connack.header.message_type.name}')
+            if connack.return_code != ConnectReturnCode.ACCEPTED:
+                raise ConnectionRefusedError(f'Connection refused: {connack.return_code.name}')
+        except BaseException:
+            self._close_transport()
+            raise
+
+        self._tasks.append(asyncio.create_task(self._read()))
+        if self.keep_alive:
+            self._tasks.append(asyncio.create_task(self._ping()))
+
+    async def publish(
+        self,
+        topic: str | bytes,
+        payload: bytes,
+        qos: int = 0,
+        retain: bool = False
+    ) -> asyncio.Future | None:
+        """
+        Publishes a message, waiting first for a free slot of the in-flight window if it has QoS 1 or 2.
+        :return: future resolved once the broker acknowledged the message, None for QoS 0
+        """
+
+        self._check_connected()
+
+        acknowledged = None
+        message_id = None
+        if qos:
+            await self._inflight.acquire()
+            message_id, acknowledged = self._expect_acknowledgement()
+            acknowledged.add_done_callback(self._on_acknowledged)
+
+        if isinstance(topic, str):
+            topic = topic.encode()
+
+        self._write(PublishMessage(Header(MessageType.PUBLISH, 0, qos, retain), topic, message_id, payload))
+        self.published += 1
+        await self._writer.drain()
+
+        return acknowledged
+
+    def _on_acknowledged(self, acknowledged: asyncio.Future):
+        self._inflight.release()
+        if not acknowledged.cancelled() and acknowledged.exception() is None:
+            self.acknowledged += 1
+
+    async def flush(self):
+        """Waits until every message published so far has been acknowledged."""
+
+        while self._pending:
+            await asyncio.gather(*self._pending.values())
+
+    async def subscribe(self, topic_filters: str | dict[str, int], qos: int = 0) -> list[int]:
+        """
+        Subscribes to a topic filter, or to several filters with their QoS, and waits for the SUBACK.
+        :return: granted QoS levels
+        """
+
+        self._check_connected()
+
+        if isinstance(topic_filters, str):
+            topic_filters = {topic_filters: qos}
+
+        message_id, acknowledged = self._expect_acknowledgement()
+        requested_topics = [RequestedTopic(topic_filter, qos) for topic_filter, qos in topic_filters.items()]
+        self._write(SubscribeMessage(Header(MessageType.SUBSCRIBE, qos=1), message_id, requested_topics))
+
+        return await acknowledged
+
+    async def unsubscribe(self, topic_filters: str | Iterable[str]):
+        """Unsubscribes from one or several topic filters and waits for the UNSUBACK."""
+
+        self._check_connected()
+
+        if isinstance(topic_filters, str):
+            topic_filters = [topic_filters]
+
+        message_id, acknowledged = self._expect_acknowledgement()
+        self._write(UnsubscribeMessage(Header(MessageType.UNSUBSCRIBE, qos=1), message_id, list(topic_filters)))
+
+        await acknowledged
+
+    async def disconnect(self):
+        """Sends a DISCONNECT and closes the connection, unacknowledged messages fail with ConnectionError."""
+
+        if self._closed:
+            return
+
+        self._write(DisconnectMessage(Header(MessageType.DISCONNECT)))
+        try:
+            await self._writer.drain()
+        except ConnectionError:
+            pass
+
+        self._connection_lost(None)
+        await self._writer.wait_closed()
+
+    def is_connected(self) -> bool:
+        return not self._closed
+
+    def __aiter__(self) -> 'MQTTClient':
+        return self
+
+    async def __anext__(self) -> PublishMessage:
+        message = await self._messages.get()
+        if message is None:
+            raise StopAsyncIteration
+
+        return message
+
+    def _check_connected(self):
+        if self._closed:
+            raise ConnectionError(f'Client {self.client_id} is not connected')
+
+    def _expect_acknowledgement(self) -> tuple[int, asyncio.Future]:
+        """Allocates a message id that is not in flight and the future resolved by its acknowledgement."""
+
+        message_id = self._last_message_id
+        while True:
+            message_id = message_id % MAXIMUM_MESSAGE_ID + 1
+            if message_id not in self._pending:
+                break
+
+        self._last_message_id = message_id
+        acknowledged = self._pending[message_id] = asyncio.get_running_loop().create_future()
+
+        return message_id, acknowledged
+
+    def _acknowledge(self, message_id: int, result=None):
+        acknowledged = self._pending.pop(message_id, None)
+        if acknowledged is None:
+            log.debug(f'Client {self.client_id} received an acknowledgement of unknown message {message_id}')
+        elif not acknowledged.done():
+            acknowledged.set_result(result)
+
+    def _write(self, message: Message):
+        self._writer.write(message.pack())
+
+    async def _read(self):
+        """Handles the packets sent by the broker until the connection is lost."""
+
+        error = None
+        try:
+            while True:
+                message = await Message.from_reader(self._reader, self.keep_alive)
+                self._handle(message)
+        except (MQTTConnectionError, OSError, asyncio.IncompleteReadError) as e:
+            error = e
+        finally:
+            self._connection_lost(error)
+
+    def _handle(self, message: Message):
+        if isinstance(message, PublishMessage):
+            self.received += 1
+
+            if message.header.qos == 1:
+                self._write(PubAckMessage(Header(MessageType.PUBACK), message.message_id))
+            elif message.header.qos == 2:
+                self._write(PubRecMessage(Header(MessageType.PUBREC), message.message_id))
+
+            if self.on_message is not None:
+                self.on_message(message)
+            else:
+                self._messages.put_nowait(message)
+        elif isinstance(message, (PubAckMessage, PubCompMessage)):
+            self._acknowledge(message.message_id)
+        elif isinstance(message, PubRecMessage):
+            self._write(PubRelMessage(Header(MessageType.PUBREL, qos=1), message.message_id))
+        elif isinstance(message, PubRelMessage):
+            self._write(PubCompMessage(Header(MessageType.PUBCOMP), message.message_id))
+        elif isinstance(message, SubAckMessage):
+            self._acknowledge(message.message_id, message.granted_qos)
+        elif isinstance(message, UnsubAckMessage):
+            self._acknowledge(message.message_id)
+        elif not isinstance(message, PingRespMessage):
+            log.warning(f'Client {self.client_id} received an unexpected {message.header.message_type.name}')
+
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(self.keep_alive)
+            self._write(PingReqMessage(Header(MessageType.PINGREQ)))
+
+    def _connection_lost(self, error: Exception | None):
+        if self._closed:
+            return
+
+        if error is not None:
+            log.debug(f'Client {self.client_id} lost its connection: {error!r}')
+
+        self._closed = True
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        self._tasks.clear()
+
+        pending, self._pending = self._pending, dict()
+        for acknowledged in pending.values():
+            if not acknowledged.done():
+                acknowledged.set_exception(ConnectionError(f'Client {self.client_id} lost its connection'))
+
+        self._messages.put_nowait(None)
+        self._close_transport()
+
+    def _close_transport(self):
+        self._closed = True
+        self._writer.close()
+
+
+async def connect_many(
+    count: int,
+    client_id_prefix: str = 'client',
+    concurrency: int = 100,
+    **kwargs
+) -> list[MQTTClient]:
+    """
+    Connects count clients with the identifiers <prefix>-0, <prefix>-1, ... to the same broker.
+    The process needs a descriptor limit (ulimit -n) above count.
+    :param concurrency: connections being established at the same time
+    :param kwargs: arguments of every MQTTClient
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect(index: int) -> MQTTClient:
+        client = MQTTClient(f'{client_id_prefix}-{index}', **kwargs)
+        async with semaphore:
+            await client.connect()
+
+        return client
+
+    return list(await asyncio.gather(*(connect(index) for index in range(count))))
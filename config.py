@@ -1,11 +1,164 @@
-from authentication.user import User
+from authentication.user import RateLimit, User
 
 __all__ = (
     'PASSWD_FILE_PATH',
+    'PASSWORD_KDF',
+    'PASSWORD_KDF_PARAMS',
+    'HANDOFF_SOCKET_PATH',
+    'HANDOFF_TIMEOUT',
+    'MAXIMUM_PACKET_SIZE',
+    'RECEIVE_MAXIMUM',
+    'TOPIC_ALIAS_MAXIMUM',
+    'STREAMING_THRESHOLD',
+    'STREAMING_CHUNK_SIZE',
+    'TOPIC_NAME_CACHE_SIZE',
+    'ROUTE_CACHE_SIZE',
+    'TOPIC_HISTORY',
+    'TOPIC_HISTORY_MEMORY_LIMIT',
+    'MESSAGE_EXPIRY',
+    'EXPIRY_SWEEP_INTERVAL',
+    'PUBLISH_BATCH_WINDOW',
+    'PUBLISH_BATCH_SIZE',
+    'EVENT_LOOPS',
+    'MAILBOX_HIGH_WATER',
+    'MAILBOX_LOW_WATER',
+    'SCHEDULER_MESSAGE_BUDGET',
+    'SCHEDULER_BYTE_BUDGET',
+    'SCHEDULER_WEIGHTS',
+    'REPORT_INTERVAL',
+    'CAPTURE_PATH',
+    'CAPTURE_BUFFER_SIZE',
+    'CAPTURE_FLUSH_INTERVAL',
+    'HEAVY_HITTERS_WINDOW',
+    'HEAVY_HITTERS_BUCKETS',
+    'HEAVY_HITTERS_CAPACITY',
+    'HEAVY_HITTERS_SKETCH_WIDTH',
+    'HEAVY_HITTERS_SKETCH_DEPTH',
+    'HEAVY_HITTERS_TOPIC',
+    'BROKER_HIGH_WATER',
+    'BROKER_LOW_WATER',
+    'TOPIC_HIGH_WATER',
+    'TOPIC_LOW_WATER',
+    'FLOW_CONTROL_POLL_INTERVAL',
+    'MEMORY_SOFT_LIMIT',
+    'MEMORY_HARD_LIMIT',
+    'PAYLOAD_STORE',
+    'CLIENT_RATE_LIMIT',
+    'BRIDGE_CLIENT_IDS',
     'USERS'
 )
 
+# Credentials of the users, created from USERS only when it does not exist, see python -m authentication.passwd
 PASSWD_FILE_PATH = '~/.mqtt_passwd'
+# Key derivation function of new and updated passwords, 'pbkdf2_sha256' or 'scrypt', and its parameters:
+# iterations for pbkdf2_sha256 (600000 by default), n, r and p for scrypt (2 ** 14, 8 and 1 by default).
+# Stored passwords keep the function and parameters they were hashed with
+PASSWORD_KDF = 'pbkdf2_sha256'
+PASSWORD_KDF_PARAMS: dict[str, int] = {}
+
+# Unix socket used to hand the listening socket and live connections over to a new process on hot restart
+HANDOFF_SOCKET_PATH = '~/.mqtt_handoff.sock'
+# Seconds to wait for a client to finish the packet it is reading or to flush its pending data
+HANDOFF_TIMEOUT = 5
+
+# Packets larger than this (in bytes, fixed header included) are rejected as soon as their length is read
+MAXIMUM_PACKET_SIZE = 268435455  # the protocol limit of 256 MB
+
+# Announced to MQTT 5 clients: QoS 1 and 2 messages a client may send before they are acknowledged,
+# and topic aliases a client may define for the topics it publishes to, 0 to not accept aliases
+RECEIVE_MAXIMUM = 1024
+TOPIC_ALIAS_MAXIMUM = 64
+# PUBLISH payloads above this size are forwarded to subscribers in chunks instead of being buffered
+STREAMING_THRESHOLD = 1024 * 1024
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+# Number of validated and split topic names kept, so repeated topics skip decoding and splitting
+TOPIC_NAME_CACHE_SIZE = 4096
+# Number of topics whose recipients are kept, until the next subscription change
+ROUTE_CACHE_SIZE = 4096
+
+# Recent messages kept for the topics matching a filter: (messages, seconds or None), e.g. {'sensors/#': (100, 3600)}.
+# Subscribing to $history/<all | N | Ts>/<filter> replays them, e.g. $history/300s/sensors/#, then delivers live messages
+TOPIC_HISTORY: dict[str, tuple[int, float | None]] = {}
+# Bytes held by all topic histories, above it the oldest messages of the largest histories are dropped
+TOPIC_HISTORY_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Default expiry in seconds of the messages published to the topics matching a filter, e.g. {'sensors/#': 300}.
+# An MQTT 5 message expiry interval set by the publisher takes precedence. Expired messages are not delivered
+MESSAGE_EXPIRY: dict[str, float] = {}
+# Seconds between sweeps reclaiming expired queued and retained messages
+EXPIRY_SWEEP_INTERVAL = 1.0
+
+# Seconds during which received PUBLISH messages are collected to be routed together, grouped by topic,
+# 0 for the messages of a single event loop iteration, None to route every message on its own
+PUBLISH_BATCH_WINDOW: float | None = None
+# Messages after which a batch is routed without waiting for the rest of the window
+PUBLISH_BATCH_SIZE = 1024
+
+# Event loops serving the connections, each in a thread of its own, they share the topics and sessions.
+# More than one pays off on free-threaded Python builds (python3.13t), with the GIL the loops take turns
+EVENT_LOOPS = 1
+# Deliveries handed over to another event loop and not run yet, above the high-water mark publishers wait
+# until they drop below the low-water mark
+MAILBOX_HIGH_WATER = 16 * 1024
+MAILBOX_LOW_WATER = 4 * 1024
+
+# Messages and PUBLISH payload bytes a connection handles before it yields the event loop to other connections
+SCHEDULER_MESSAGE_BUDGET = 32
+SCHEDULER_BYTE_BUDGET = 64 * 1024
+# Budget multipliers by client identifier or user name, e.g. {'admin': 4}
+SCHEDULER_WEIGHTS: dict[str, float] = {}
+
+# Bytes written to subscribers but not sent yet, above the high-water mark publishers stop being read from
+# until the backlog drops below the low-water mark
+BROKER_HIGH_WATER = 64 * 1024 * 1024
+BROKER_LOW_WATER = 32 * 1024 * 1024
+TOPIC_HIGH_WATER = 16 * 1024 * 1024
+TOPIC_LOW_WATER = 8 * 1024 * 1024
+# Seconds between checks of the subscribers' backlog while publishers are paused
+FLOW_CONTROL_POLL_INTERVAL = 0.01
+
+# Bytes held by queued and retained messages and by unsent data. Above the soft limit queued messages are dropped,
+# QoS 0 first, then the oldest ones of the clients using the most. Above the hard limit new connections are refused
+MEMORY_SOFT_LIMIT = 256 * 1024 * 1024
+MEMORY_HARD_LIMIT = 512 * 1024 * 1024
+# Keep identical payloads of retained and queued messages and of topic histories once, shared by all of them.
+# The memory limits still count every message with its whole payload
+PAYLOAD_STORE = True
+
+# Limit of every client connection, limits of users are set with their rate_limit, e.g.
+# User('sensor', 'sensor', RateLimit(messages_per_second=10, bytes_per_second=64 * 1024, disconnect=True))
+CLIENT_RATE_LIMIT: RateLimit | None = None
+
+# Client identifiers of the peer brokers' bridges, e.g. '$bridge-east', allowed to connect as bridges when clients
+# are not authenticated. The messages of a bridge are not forwarded to other bridges, so without authentication
+# other clients may not use the $bridge- prefix
+BRIDGE_CLIENT_IDS: list[str] = []
+
+# Seconds between reports of the clients that waited the longest for their turn and of the memory usage
+REPORT_INTERVAL = 60
+
+# File the frames received from clients are recorded to, with timestamps and connection ids, None to not capture.
+# Replay a capture with python -m benchmarks.replay
+CAPTURE_PATH: str | None = None
+# Bytes of records buffered in memory, records arriving while the buffer is full are dropped
+CAPTURE_BUFFER_SIZE = 16 * 1024 * 1024
+# Seconds between writes of the buffered records to the file
+CAPTURE_FLUSH_INTERVAL = 0.1
+
+# Seconds of traffic the heavy hitters cover, e.g. 60: the topics and clients with the most messages and payload
+# bytes, received and sent, estimated in constant memory. None to not track them, every PUBLISH is counted otherwise
+HEAVY_HITTERS_WINDOW: float | None = None
+# Intervals the window is divided into, it slides by one interval at a time
+HEAVY_HITTERS_BUCKETS = 6
+# Topics or clients monitored per interval, the top of a report is drawn from them
+HEAVY_HITTERS_CAPACITY = 32
+# Counters per row and rows of the count-min sketches estimating the counts
+HEAVY_HITTERS_SKETCH_WIDTH = 2048
+HEAVY_HITTERS_SKETCH_DEPTH = 4
+# Topic the heavy hitters are published to as JSON every REPORT_INTERVAL, e.g. '$SYS/broker/heavy_hitters',
+# None to only log them. The report names topics and clients, and any subscriber of the topic gets it
+HEAVY_HITTERS_TOPIC: str | None = None
 
 USERS = [
     User('admin', 'admin'),
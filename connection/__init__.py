@@ -1,2 +1,3 @@
 from .client import Client
+from .local_client import LocalClient
 from .server import Server
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from messages import PublishMessage
+
+if TYPE_CHECKING:
+    from processing import TopicManager
+
+
+log = logging.getLogger(__name__)
+
+
+class PublishBatcher:
+    """
+    Collects the PUBLISH messages received within a short window and routes them together.
+
+    Messages of a batch are grouped by topic, so the recipients of a topic are resolved once per batch,
+    and every subscriber gets all of its messages of the batch in a single write. Batches are routed
+    one after another in arrival order, which keeps the order of the messages of every topic.
+    Routing a QoS 1 or 2 message waits until its batch has been routed, so it is only acknowledged afterwards.
+    """
+
+    def __init__(self, topic_manager: 'TopicManager', window: float, max_size: int):
+        """
+        :param window: seconds to wait for more messages after the first one of a batch, 0 for a single loop tick
+        :param max_size: number of messages after which a batch is routed without waiting for the window to end
+        """
+
+        self._topic_manager = topic_manager
+        self._window = window
+        self._max_size = max_size
+
+        self._pending: list[tuple[PublishMessage, str | None]] = []
+        # Done once the pending batch has been routed, only created when a message of the batch waits for it
+        self._pending_routed: asyncio.Future | None = None
+        self._scheduled: asyncio.Handle | asyncio.TimerHandle | None = None
+        self._task: asyncio.Task | None = None
+
+        self.batches = 0
+        self.messages = 0
+
+    async def route(self, message: PublishMessage, owner: str | None):
+        """
+        Adds a message to the current batch, a streamed payload is routed right away after the pending batch.
+        A QoS 1 or 2 message is waited for until its batch has been routed, a failure to route it is raised.
+        """
+
+        if message.payload_stream is not None:
+            await self.flush()
+            await self._topic_manager.publish(message, owner)
+            return
+
+        self._pending.append((message, owner))
+
+        routed = None
+        if message.header.qos:
+            if self._pending_routed is None:
+                self._pending_routed = asyncio.get_running_loop().create_future()
+            routed = self._pending_routed
+
+        if len(self._pending) >= self._max_size:
+            self._cancel_scheduled()
+            self._start_routing()
+        elif self._scheduled is None:
+            loop = asyncio.get_running_loop()
+            if self._window:
+                self._scheduled = loop.call_later(self._window, self._start_routing)
+            else:
+                self._scheduled = loop.call_soon(self._start_routing)
+
+        if routed is not None:
+            # Shielded, the batch is routed for the other messages in it even if this publisher goes away
+            await asyncio.shield(routed)
+
+    async def flush(self):
+        """Routes the pending batch now and waits until every batch has been routed."""
+
+        self._cancel_scheduled()
+        if self._pending:
+            self._start_routing()
+
+        if self._task is not None:
+            await self._task
+
+    def _cancel_scheduled(self):
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+
+    def _start_routing(self):
+        self._scheduled = None
+        batch, self._pending = self._pending, []
+        routed, self._pending_routed = self._pending_routed, None
+        if not batch:
+            return
+
+        self._task = asyncio.create_task(self._route_batch(batch, self._task, routed))
+
+    async def _route_batch(
+        self,
+        batch: list[tuple[PublishMessage, str | None]],
+        previous: asyncio.Task | None,
+        routed: asyncio.Future | None
+    ):
+        # The previous batch may still be delivering to in-process clients
+        if previous is not None and not previous.done():
+            await asyncio.wait({previous})
+
+        self.batches += 1
+        self.messages += len(batch)
+
+        try:
+            await self._topic_manager.publish_batch(batch)
+        except Exception as e:
+            log.exception(f'Could not route a batch of {len(batch)} messages')
+            if routed is not None and not routed.cancelled():
+                routed.set_exception(e)
+        else:
+            if routed is not None and not routed.cancelled():
+                routed.set_result(None)
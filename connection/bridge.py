@@ -0,0 +1,228 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import config
+from exceptions.connection import MQTTConnectionError
+from messages import (
+    Header,
+    Message,
+    ConnectMessage,
+    ConnAckMessage,
+    SubscribeMessage,
+    SubAckMessage,
+    PublishMessage,
+    PingReqMessage,
+    PubAckMessage,
+    PubRecMessage,
+    PubRelMessage,
+    PubCompMessage
+)
+from messages.subscribe import RequestedTopic
+from .batching import PublishBatcher
+from .constants import BRIDGE_CLIENT_ID_PREFIX, MAXIMUM_CLIENT_ID_LENGTH, ConnectReturnCode, MessageType
+
+if TYPE_CHECKING:
+    from .server import Server
+
+
+log = logging.getLogger(__name__)
+
+
+def is_bridge(identifier: str | None) -> bool:
+    """Checks if a client identifier, or the owner of a routed message, belongs to a bridge."""
+
+    return identifier is not None and identifier.startswith(BRIDGE_CLIENT_ID_PREFIX)
+
+
+@dataclass(eq=False)
+class Bridge:
+    """
+    Connection to a peer broker. The filters are subscribed to on the peer, so the peer forwards only
+    the messages this broker asked for, and they are published here to the local subscribers. \\
+    Messages received from a peer are never forwarded to another bridge, so bridged brokers have to
+    form a full mesh and messages cannot loop between them. \\
+    A peer accepts the bridge's client identifier only from an authenticated connection, or when it is listed in
+    its BRIDGE_CLIENT_IDS.
+    """
+
+    # Name of this broker, the bridge connects to the peer with the client identifier $bridge-<name>
+    name: str
+    host: str = 'localhost'
+    port: int = 1883
+    # Topic filters subscribed to on the peer with their QoS
+    filters: dict[str, int] = field(default_factory=lambda: {'#': 0})
+    user_name: str | None = None
+    password: str | None = None
+    keep_alive: int = 60
+    # Seconds before reconnecting, doubled after every failed attempt up to the maximum
+    reconnect_delay: float = 1.0
+    max_reconnect_delay: float = 30.0
+    # Seconds during which the received messages are collected to be routed together, None to route one by one
+    batch_window: float | None = 0
+
+    def __post_init__(self):
+        if len(self.client_id) > MAXIMUM_CLIENT_ID_LENGTH:
+            raise ValueError(f'Bridge name {self.name} is too long for a client identifier')
+
+        self.received = 0
+        self.connections = 0
+        self._server: 'Server | None' = None
+        self._batcher: PublishBatcher | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        # QoS 2 messages received but not released by the peer yet, kept across reconnects like the session
+        self._unreleased: set[int] = set()
+        self._task: asyncio.Task | None = None
+
+    def __str__(self) -> str:
+        return f'{self.host}:{self.port}'
+
+    @property
+    def client_id(self) -> str:
+        return f'{BRIDGE_CLIENT_ID_PREFIX}{self.name}'
+
+    @property
+    def address(self) -> str:
+        return f'bridge:{self}'
+
+    @property
+    def owner(self) -> str:
+        """Identifier the messages received from the peer are routed with, see is_bridge."""
+
+        return f'{BRIDGE_CLIENT_ID_PREFIX}{self}'
+
+    def start(self, server: 'Server'):
+        """Connects to the peer in the background, reconnecting whenever the connection is lost."""
+
+        self._server = server
+        if self.batch_window is not None:
+            self._batcher = PublishBatcher(server.topic_manager, self.batch_window, config.PUBLISH_BATCH_SIZE)
+
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.wait({self._task})
+
+        if self._batcher is not None:
+            await self._batcher.flush()
+
+    async def _run(self):
+        delay = self.reconnect_delay
+
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                log.warning(f'Could not connect the bridge to {self}: {e}, retrying in {delay:.1f} s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            self._writer = writer
+            try:
+                await self._connect(reader)
+                delay = self.reconnect_delay
+                log.info(f'Bridge to {self} connected, subscribed to {", ".join(self.filters)}')
+
+                await self._serve(reader)
+            except (MQTTConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                log.warning(f'Bridge to {self} lost: {e!r}, reconnecting in {delay:.1f} s')
+            finally:
+                self._writer = None
+                self._server.scheduler.forget(self)
+                self._server.flow_control.forget(self)
+                writer.close()
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _connect(self, reader: asyncio.StreamReader):
+        """Connects to the peer with a persistent session, so QoS 1 and 2 messages wait for a reconnect."""
+
+        self._write(ConnectMessage(
+            Header(MessageType.CONNECT),
+            will_retain=False,
+            will_qos=0,
+            clean_session=False,
+            keep_alive=self.keep_alive,
+            client_id=self.client_id,
+            user_name=self.user_name,
+            password=self.password,
+            will_topic=None,
+            will_message=None
+        ))
+
+        connack = await asyncio.wait_for(Message.from_reader(reader), self.keep_alive or None)
+        if not isinstance(connack, ConnAckMessage):
+            raise MQTTConnectionError(f'Expected CONNACK, received {connack.header.message_type.name}')
+        if connack.return_code != ConnectReturnCode.ACCEPTED:
+            raise ConnectionRefusedError(f'Peer refused the bridge: {connack.return_code.name}')
+
+        self.connections += 1
+
+        requested_topics = [RequestedTopic(topic_filter, qos) for topic_filter, qos in self.filters.items()]
+        self._write(SubscribeMessage(Header(MessageType.SUBSCRIBE, qos=1), 1, requested_topics))
+
+    async def _serve(self, reader: asyncio.StreamReader):
+        """Publishes the messages forwarded by the peer until the connection is lost."""
+
+        ping_task = asyncio.create_task(self._ping()) if self.keep_alive else None
+        try:
+            while True:
+                message = await Message.from_reader(
+                    reader,
+                    self.keep_alive,
+                    max_packet_size=self._server.max_packet_size,
+                    streaming_threshold=self._server.streaming_threshold,
+                    chunk_size=self._server.streaming_chunk_size
+                )
+
+                if isinstance(message, PublishMessage):
+                    await self._on_publish(message)
+                elif isinstance(message, PubRelMessage):
+                    self._unreleased.discard(message.message_id)
+                    self._write(PubCompMessage(Header(MessageType.PUBCOMP), message.message_id))
+                elif isinstance(message, SubAckMessage):
+                    log.debug(f'Bridge to {self} granted QoS levels: {message.granted_qos}')
+        finally:
+            if ping_task is not None:
+                ping_task.cancel()
+
+    async def _on_publish(self, message: PublishMessage):
+        self.received += 1
+
+        qos = message.header.qos
+        # A QoS 2 message redelivered before its release has been published already, it is only acknowledged again
+        if qos == 2 and message.message_id in self._unreleased:
+            log.debug(f'Bridge to {self} received message {message.message_id} again, not publishing it twice')
+        elif self._batcher is None:
+            await self._server.topic_manager.publish(message, self.owner)
+        else:
+            await self._batcher.route(message, self.owner)
+
+        if message.payload_stream is not None:
+            await message.payload_stream.discard()
+
+        await self._server.flow_control.throttle(self, message.topic)
+
+        if qos == 1:
+            self._write(PubAckMessage(Header(MessageType.PUBACK), message.message_id))
+        elif qos == 2:
+            self._unreleased.add(message.message_id)
+            self._write(PubRecMessage(Header(MessageType.PUBREC), message.message_id))
+
+        await self._server.scheduler.charge(self, message)
+
+    async def _ping(self):
+        """Keeps the connection alive, the peer's PINGRESP keeps the read timeout from expiring."""
+
+        while True:
+            await asyncio.sleep(self.keep_alive)
+            self._write(PingReqMessage(Header(MessageType.PINGREQ)))
+
+    def _write(self, message: Message):
+        if self._writer is not None:
+            self._writer.write(message.pack())
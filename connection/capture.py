@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import BinaryIO, Iterator
+
+
+log = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b'MQTTCAP\x01'
+# Nanoseconds since the capture started, connection id, record kind and length of the data that follows
+RECORD_HEADER = struct.Struct('<QIBI')
+
+
+class RecordKind(IntEnum):
+    # The data is the address of the connection
+    OPEN = 1
+    # The data is received bytes, frames are recorded whole, a streamed payload in its chunks
+    DATA = 2
+    CLOSE = 3
+    # Records of the connection were lost in the middle of a frame, the connection is not recorded any further
+    TRUNCATED = 4
+
+
+@dataclass
+class CaptureRecord:
+    timestamp: int
+    connection_id: int
+    kind: RecordKind
+    data: bytes
+
+
+class TrafficCapture:
+    """
+    Records the frames received from clients, with timestamps and connection ids, to a compact binary file. \\
+    Records are copied into a fixed-size ring buffer and written to the file in a thread, so recording costs
+    a copy of the frame. When the file cannot keep up and the ring is full, frames are dropped whole and counted
+    instead of slowing the broker down. A streamed frame that runs out of room after its first records truncates
+    the recording of its connection, replays stop the connection there.
+    """
+
+    def __init__(self, path: str, buffer_size: int, flush_interval: float):
+        """
+        :param buffer_size: bytes of records held in memory until they are written
+        :param flush_interval: seconds between writes of the buffered records
+        """
+
+        self.path = os.path.expanduser(path)
+        self._flush_interval = flush_interval
+
+        self._ring = bytearray(buffer_size)
+        # Records are written at the head and flushed from the tail
+        self._head = 0
+        self._tail = 0
+        self._used = 0
+
+        self._start = time.monotonic_ns()
+        self._connection_ids = 0
+        # Bytes still to be recorded of the streamed frame a connection is receiving, and whether it is dropped
+        self._partial_frames: dict[int, tuple[int, bool]] = dict()
+        # Connections whose recording stopped in the middle of a frame, by whether their mark is recorded yet
+        self._truncated: dict[int, bool] = dict()
+        self._file: BinaryIO | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
+
+        self.records = 0
+        self.dropped = 0
+        self.written = 0
+
+    def start(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(CAPTURE_MAGIC)
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_periodically())
+
+        log.info(f'Capturing client traffic to {self.path}')
+
+    async def stop(self):
+        """Writes the remaining records and closes the file."""
+
+        if self._task is None:
+            return
+
+        # A write in progress is finished rather than cancelled, so nothing is written twice
+        self._stopping.set()
+        await self._task
+
+        self._file.close()
+        self._task = None
+
+    def open(self, address: str) -> int:
+        """Records a new connection, returns its connection id."""
+
+        self._connection_ids += 1
+        self._append(self._connection_ids, RecordKind.OPEN, address.encode())
+
+        return self._connection_ids
+
+    def record(self, connection_id: int, *chunks: bytes):
+        """
+        Records bytes received on a connection, passed in chunks to avoid joining them.
+        Every call starts a frame with its fixed header, or continues a frame whose payload is streamed.
+        """
+
+        if connection_id in self._truncated:
+            self.dropped += 1
+            self._truncate(connection_id)
+            return
+
+        length = sum(len(chunk) for chunk in chunks)
+        partial = self._partial_frames.pop(connection_id, None)
+        if partial is None:
+            remaining = _frame_size(chunks[0]) - length
+            # A streamed frame is only started with room for all of it, so it is rarely cut short
+            if remaining > 0 and not self._has_room(length + RECORD_HEADER.size + remaining):
+                self.dropped += 1
+                dropped = True
+            else:
+                dropped = not self._append(connection_id, RecordKind.DATA, *chunks)
+        else:
+            remaining, dropped = partial
+            remaining -= length
+            if dropped:
+                self.dropped += 1
+            elif not self._append(connection_id, RecordKind.DATA, *chunks):
+                # The start of the frame is recorded already, the connection cannot be replayed past it
+                self._truncate(connection_id)
+                return
+
+        if remaining > 0:
+            self._partial_frames[connection_id] = (remaining, dropped)
+
+    def close(self, connection_id: int):
+        self._partial_frames.pop(connection_id, None)
+
+        if connection_id in self._truncated:
+            self._truncate(connection_id)
+            del self._truncated[connection_id]
+            return
+
+        self._append(connection_id, RecordKind.CLOSE)
+
+    def _truncate(self, connection_id: int):
+        """Stops recording a connection, its mark is recorded as soon as there is room for it."""
+
+        if not self._truncated.get(connection_id):
+            self._truncated[connection_id] = self._has_room(0) and self._append(connection_id, RecordKind.TRUNCATED)
+
+    def _has_room(self, length: int) -> bool:
+        return RECORD_HEADER.size + length <= len(self._ring) - self._used
+
+    def _append(self, connection_id: int, kind: RecordKind, *chunks: bytes) -> bool:
+        """:return: False if the record was dropped because the ring is full"""
+
+        length = sum(len(chunk) for chunk in chunks)
+        if not self._has_room(length):
+            self.dropped += 1
+            return False
+
+        header = RECORD_HEADER.pack(time.monotonic_ns() - self._start, connection_id, kind, length)
+        self._copy(header)
+        for chunk in chunks:
+            self._copy(chunk)
+
+        self.records += 1
+
+        return True
+
+    def _copy(self, data: bytes):
+        """Copies data to the head of the ring, wrapping around its end."""
+
+        size = len(data)
+        first = min(size, len(self._ring) - self._head)
+
+        view = memoryview(self._ring)
+        data = memoryview(data)
+        view[self._head:self._head + first] = data[:first]
+        if first < size:
+            view[:size - first] = data[first:]
+
+        self._head = (self._head + size) % len(self._ring)
+        self._used += size
+
+    async def _flush_periodically(self):
+        # Flushes once more after a stop, also when it came before the first flush
+        stopping = False
+        while not stopping:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            stopping = self._stopping.is_set()
+            await self._flush()
+
+    async def _flush(self):
+        """Writes the records buffered so far. New records go to the free part of the ring meanwhile."""
+
+        used = self._used
+        if not used:
+            return
+
+        first = min(used, len(self._ring) - self._tail)
+        view = memoryview(self._ring)
+        regions = [view[self._tail:self._tail + first]]
+        if first < used:
+            regions.append(view[:used - first])
+
+        try:
+            await asyncio.to_thread(self._file.writelines, regions)
+        except OSError as e:
+            log.error(f'Could not write the traffic capture: {e}')
+        finally:
+            for region in regions:
+                region.release()
+            view.release()
+
+        self._tail = (self._tail + used) % len(self._ring)
+        self._used -= used
+        self.written += used
+
+    def __str__(self) -> str:
+        return f'{self.records} records, {self.dropped} dropped, {self.written} bytes written to {self.path}'
+
+
+def _frame_size(fixed_header: bytes) -> int:
+    """Returns the size of a frame from its fixed header."""
+
+    remaining_length = 0
+    for index, digit in enumerate(fixed_header[1:5]):
+        remaining_length |= (digit & 127) << (7 * index)
+        if not digit & 128:
+            return 2 + index + remaining_length
+
+    return len(fixed_header)
+
+
+def read_capture(file: BinaryIO) -> Iterator[CaptureRecord]:
+    """Reads the records of a capture file in the order they were recorded."""
+
+    if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+        raise ValueError('Not a traffic capture file')
+
+    while True:
+        header = file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+
+        timestamp, connection_id, kind, length = RECORD_HEADER.unpack(header)
+        data = file.read(length)
+        if len(data) < length:
+            return
+
+        yield CaptureRecord(timestamp, connection_id, RecordKind(kind), data)
@@ -1,6 +1,11 @@
 import asyncio
 import logging
-from typing import TYPE_CHECKING, Callable
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, Awaitable, Callable
 
 from exceptions.connection import (
     IdentifierRejectedError,
@@ -26,20 +31,76 @@ from messages import (
     PubRelMessage,
     PubCompMessage
 )
+from messages.properties import Properties, PropertyId
 from messages.structs import pack_string
-from .constants import ConnectReturnCode, MessageType
+from .bridge import is_bridge
+from .constants import (
+    ConnectReturnCode,
+    MessageType,
+    MAXIMUM_PACKET_SIZE,
+    MQTT5_PROTOCOL_VERSION,
+    PROTOCOL_VERSION
+)
 
 if TYPE_CHECKING:
+    from .loops import LoopWorker
     from .server import Server
 
 
 log = logging.getLogger(__name__)
 
 
+@dataclass
+class Will:
+    """Last will of a client, published when it is disconnected for a malformed packet or an exceeded keep alive."""
+
+    topic: str
+    message: str
+    qos: int
+    retain: bool
+
+
 class Client:
+    # Slots instead of a __dict__, and state that most connections never need allocated on first use,
+    # keep the memory of an idle connection small
+    __slots__ = (
+        'server',
+        '_reader',
+        '_writer',
+        '_auth_required',
+        '_address',
+        '_closed',
+        '_task',
+        '_idle',
+        '_detaching',
+        '_capture_id',
+        '_capture',
+        '_queue',
+        '_queued_size',
+        '_flush_task',
+        '_holding',
+        '_deferred',
+        '_held_buffers',
+        '_next_expiry',
+        '_client_id',
+        '_user_name',
+        '_keep_alive',
+        '_clean_session',
+        '_will',
+        '_protocol_version',
+        '_receive_maximum',
+        '_inflight',
+        '_unreleased',
+        '_maximum_packet_size',
+        '_aliases_in',
+        '_alias_topics',
+        '_aliases_out',
+        '_next_alias'
+    )
+
     def __init__(
         self,
-        server: 'Server',
+        server: 'Server | LoopWorker',
         reader: asyncio.StreamReader,
         writer: asyncio.StreamWriter,
         auth_required: bool,
@@ -52,53 +113,165 @@ class Client:
         self._address = address
         self._closed = False
 
+        # Hot restart bookkeeping
+        self._task: asyncio.Task | None = None
+        self._idle = False
+        self._detaching = False
+
+        # Records the received frames when the server captures traffic
+        self._capture_id: int | None = None
+        self._capture: Callable[..., None] | None = None
+
+        # Messages waiting for room in a congested transport, or for a persistent session to reconnect,
+        # None while there are none
+        self._queue: deque[PublishMessage] | None = None
+        self._queued_size = 0
+        self._flush_task: asyncio.Task | None = None
+        # Set while the session is taken over from another event loop, messages are queued until the CONNACK is sent
+        self._holding = False
+        # Set while a streamed message is written, see begin_stream: packets other than PUBLISH messages written
+        # meanwhile, held back until the streamed frame is complete
+        self._deferred: list[bytes] | None = None
+        # Pooled buffers written but maybe not sent yet, returned to the pool once the transport has drained
+        self._held_buffers: list[bytearray] | None = None
+        # Earliest expiry of the queued messages the expiry sweeper is scheduled for
+        self._next_expiry: float | None = None
+
+        self._client_id = None
+        self._user_name = None
         self._keep_alive = None
         self._clean_session = None
-        self._will_retain = None
-        self._will_qos = None
-        self._will_topic = None
-        self._will_message = None
-
-        self._actions: dict[MessageType, Callable] = {
-            MessageType.SUBSCRIBE: self._on_subscribe,
-            MessageType.UNSUBSCRIBE: self._on_unsubscribe,
-            MessageType.PUBLISH: self._on_publish,
-            MessageType.PINGREQ: self._on_ping,
-            MessageType.DISCONNECT: self._on_disconnect,
-            MessageType.PUBREL: self._on_pubrel,
-            MessageType.PUBREC: self._on_pubrec
-        }
+        self._will: Will | None = None
+
+        # Negotiated by the CONNECT and CONNACK of an MQTT 5 connection
+        self._protocol_version = PROTOCOL_VERSION
+        # QoS 1 and 2 messages the client accepts unacknowledged, None for no limit, and how many are in flight
+        self._receive_maximum: int | None = None
+        self._inflight = 0
+        # QoS 2 messages received from the client waiting for their PUBREL
+        self._unreleased = 0
+        # Largest packet the client accepts, larger messages are not sent to it
+        self._maximum_packet_size: int | None = None
+        # Topics by alias - 1: the aliases defined by the client, and the ones defined by the server for the client.
+        # Allocated when an MQTT 5 client connects, the empty tuples are shared
+        self._aliases_in: list[bytes | None] | tuple = ()
+        self._alias_topics: list[bytes | None] | tuple = ()
+        self._aliases_out: dict[bytes, int] | None = None
+        # Aliases of the server are reused round robin once they are all taken
+        self._next_alias = 0
 
     async def notify(self, message: PublishMessage):
-        """Notifies the client."""
-
-        await self._send_message(message)
+        """
+        Notifies the client. The message is not waited for to be sent,
+        the data piling up for slow clients is kept in check by the server's flow control. \\
+        Messages for a congested connection, and QoS 1 and 2 messages for a disconnected persistent session,
+        are queued. Queued messages may be dropped when the broker runs low on memory. \
+        A message routed on another event loop is handed over to the loop of the client.
+        """
 
-    async def serve(self):
-        """Serves the client connection."""
+        mailbox = self.server.mailbox
+        if mailbox is not None and not mailbox.is_current():
+            mailbox.post(self._deliver, message)
+        else:
+            self._deliver(message)
 
-        log.info(f'New client connection from {self._address}')
+    def _deliver(self, message: PublishMessage):
+        if self._closed:
+            if self._has_persistent_session() and message.header.qos > 0:
+                self._enqueue(message)
+            return
 
-        connected = await self._connect()
-        if not connected:
-            await self.close()
+        queued = bool(
+            self._queue or self._holding or self._deferred is not None or self._is_congested()
+            or self._is_inflight_full(message)
+        )
+        if queued:
+            size = self._enqueue(message)
+            if not self._holding:
+                self._start_flush()
+        else:
+            size = self._write_publish(message)
+
+        self.server.flow_control.charge(self, message.topic, size, queued)
+        if self.server.traffic is not None:
+            self.server.traffic.record_out(message.topic, self.identifier, message.payload_length)
+
+    async def notify_many(self, messages: list[PublishMessage]):
+        """Notifies the client of several messages, packed into a single write unless they have to be queued."""
+
+        mailbox = self.server.mailbox
+        if mailbox is not None and not mailbox.is_current():
+            mailbox.post(self._deliver_many, messages)
+        else:
+            self._deliver_many(messages)
+
+    def _deliver_many(self, messages: list[PublishMessage]):
+        # MQTT 5 messages are written one by one, every one of them may need a topic alias or an in-flight slot
+        mqtt5 = self._protocol_version == MQTT5_PROTOCOL_VERSION
+        busy = self._closed or self._queue or self._holding or self._deferred is not None
+        if busy or len(messages) == 1 or mqtt5 or self._is_congested():
+            for message in messages:
+                self._deliver(message)
             return
 
-        while True:
+        if any(message.properties is not None for message in messages):
+            messages = [self._without_properties(message) for message in messages]
+
+        sizes = self._write_messages(messages)
+        traffic = self.server.traffic
+        for message, size in zip(messages, sizes):
+            self.server.flow_control.charge(self, message.topic, size)
+            if traffic is not None:
+                traffic.record_out(message.topic, self.identifier, message.payload_length)
+
+    async def serve(self, resume: bool = False):
+        """
+        Serves the client connection.
+        :param resume: True if the connection was handed over by a previous server process and is already connected
+        """
+
+        self._task = asyncio.current_task()
+
+        if self.server.capture is not None:
+            self._capture_id = self.server.capture.open(self._address)
+            self._capture = partial(self.server.capture.record, self._capture_id)
+
+        if resume:
+            log.info(f'Resuming client connection from {self._address}')
+        else:
+            log.info(f'New client connection from {self._address}')
+
+            connected = await self._connect()
+            if not connected:
+                await self.close()
+                return
+
+        while not self._detaching:
+            self._idle = True
             try:
-                message = await Message.from_reader(self._reader, self._keep_alive)
+                message = await Message.from_reader(
+                    self._reader,
+                    self._keep_alive,
+                    self._on_header,
+                    self.server.max_packet_size,
+                    self.server.streaming_threshold,
+                    self.server.streaming_chunk_size,
+                    self._capture,
+                    self._protocol_version
+                )
             except (MalformedPacketError, GracePeriodExceededError):
                 log.debug(f'Disconnecting {self._address} because of a malformed packet or exceeded grace period')
 
-                if self._will_message is not None:
+                if self._will is not None:
                     will_publish_message = PublishMessage(
-                        Header(MessageType.PUBLISH, 0, self._will_qos, self._will_retain),
-                        self._will_topic,
+                        Header(MessageType.PUBLISH, 0, self._will.qos, self._will.retain),
+                        self._will.topic.encode(),
                         self.server.get_next_message_id(),
-                        pack_string(self._will_message)
+                        pack_string(self._will.message)
                     )
 
-                    self.server.topic_manager.publish(will_publish_message)
+                    # Routed like the client's own messages, behind the ones still waiting in a batch
+                    await self.server.route(will_publish_message, self.identifier)
 
                 await self.close()
                 return
@@ -106,16 +279,23 @@ class Client:
                 log.warning('Received a message but it has not been implemented!')
                 continue
 
-            action = self._actions.get(message.header.message_type)
+            action = Client._ACTIONS.get(message.header.message_type)
             if action is None:
                 log.warning(f'Action not implemented for message of type {message.header.message_type.name}!')
                 continue
 
-            await action(message)
+            await action(self, message)
 
             if self._closed:
                 return
 
+            await self.server.scheduler.charge(self, message)
+
+    def _on_header(self):
+        """Marks the client as busy once it started reading a packet."""
+
+        self._idle = False
+
     async def _connect(self) -> bool:
         """
         Awaits a CONNECT message from the client and sends a CONNACK.
@@ -124,22 +304,53 @@ class Client:
 
         return_code = ConnectReturnCode.ACCEPTED
         try:
-            connect_message = await Message.from_reader(self._reader)
+            connect_message = await Message.from_reader(
+                self._reader,
+                max_packet_size=self.server.max_packet_size,
+                capture=self._capture
+            )
             if not isinstance(connect_message, ConnectMessage):
                 return False
 
             if self._auth_required:
                 if not connect_message.user_name or not connect_message.password:
                     return_code = ConnectReturnCode.NOT_AUTHORIZED
-                elif not self.server.auth_module.authenticate(connect_message.user_name, connect_message.password):
+                # Deriving the key of the password takes tens of milliseconds, the event loop keeps serving meanwhile
+                elif not await asyncio.to_thread(
+                    self.server.auth_module.authenticate,
+                    connect_message.user_name,
+                    connect_message.password
+                ):
                     return_code = ConnectReturnCode.BAD_USER_NAME_OR_PASSWORD
 
+            # Bridges are trusted not to send messages back to other bridges, so their prefix is reserved
+            if (
+                return_code == ConnectReturnCode.ACCEPTED
+                and is_bridge(connect_message.client_id)
+                and not self._auth_required
+                and connect_message.client_id not in self.server.bridge_client_ids
+            ):
+                log.warning(f'Refusing {self._address}, {connect_message.client_id} is not a configured bridge')
+                return_code = ConnectReturnCode.IDENTIFIER_REJECTED
+
+            if return_code == ConnectReturnCode.ACCEPTED and self.server.memory.is_over_hard_limit():
+                log.warning(f'Refusing {self._address}, memory usage is over the hard limit')
+                return_code = ConnectReturnCode.SERVER_UNAVAILABLE
+
+            self._client_id = connect_message.client_id
+            self._user_name = connect_message.user_name
             self._keep_alive = connect_message.keep_alive
             self._clean_session = connect_message.clean_session
-            self._will_retain = connect_message.will_retain
-            self._will_qos = connect_message.will_qos
-            self._will_topic = connect_message.will_topic
-            self._will_message = connect_message.will_message
+            if connect_message.will_message is not None:
+                self._will = Will(
+                    connect_message.will_topic,
+                    connect_message.will_message,
+                    connect_message.will_qos,
+                    connect_message.will_retain
+                )
+
+            if connect_message.protocol_version == MQTT5_PROTOCOL_VERSION:
+                self._negotiate(connect_message.properties)
         except IdentifierRejectedError:
             return_code = ConnectReturnCode.IDENTIFIER_REJECTED
         except UnacceptableProtocolVersionError:
@@ -147,22 +358,59 @@ class Client:
 
         log.debug(f'Sending CONNACK with status {return_code.name}')
 
-        connack_message = ConnAckMessage(Header(MessageType.CONNACK), return_code)
+        if return_code == ConnectReturnCode.ACCEPTED:
+            await self.server.take_over_session(self)
+
+        connack_properties = None
+        if self._protocol_version == MQTT5_PROTOCOL_VERSION:
+            connack_properties = self._connack_properties()
+
+        connack_message = ConnAckMessage(Header(MessageType.CONNACK), return_code, connack_properties)
         await self._send_message(connack_message)
 
+        # Messages queued while the session was disconnected
+        if self._queue:
+            self._start_flush()
+
         return return_code == ConnectReturnCode.ACCEPTED
 
+    def _negotiate(self, properties: Properties):
+        """Applies the limits an MQTT 5 client asked for in its CONNECT."""
+
+        self._protocol_version = MQTT5_PROTOCOL_VERSION
+        self._receive_maximum = properties.get(PropertyId.RECEIVE_MAXIMUM) or 65535
+        self._maximum_packet_size = properties.get(PropertyId.MAXIMUM_PACKET_SIZE)
+        self._alias_topics = [None] * properties.get(PropertyId.TOPIC_ALIAS_MAXIMUM, 0)
+        self._aliases_out = dict()
+        self._aliases_in = [None] * self.server.topic_alias_maximum
+
+    def _connack_properties(self) -> Properties:
+        """Gets the limits of the server announced to an MQTT 5 client."""
+
+        properties = {
+            PropertyId.RECEIVE_MAXIMUM: self.server.receive_maximum,
+            PropertyId.TOPIC_ALIAS_MAXIMUM: self.server.topic_alias_maximum,
+            PropertyId.SUBSCRIPTION_IDENTIFIER_AVAILABLE: 0,
+            PropertyId.SHARED_SUBSCRIPTION_AVAILABLE: 0
+        }
+        if self.server.max_packet_size < MAXIMUM_PACKET_SIZE:
+            properties[PropertyId.MAXIMUM_PACKET_SIZE] = self.server.max_packet_size
+
+        return properties
+
     async def _on_subscribe(self, message: SubscribeMessage):
         """Handles an incoming SUBSCRIBE message."""
 
         for topic in message.requested_topics:
-            await self.server.topic_manager.subscribe_to_topic(topic.topic_name, self)
+            await self.server.topic_manager.subscribe_to_topic(topic.topic_name, self, topic.qos)
 
         granted_qos = [topic.qos for topic in message.requested_topics]
 
         log.debug(f'Sending SUBACK with granted QoS levels: {granted_qos}')
 
         suback_message = SubAckMessage(Header(MessageType.SUBACK), message.message_id, granted_qos)
+        if self._protocol_version == MQTT5_PROTOCOL_VERSION:
+            suback_message.properties = dict()
         await self._send_message(suback_message)
 
     async def _on_unsubscribe(self, message: UnsubscribeMessage):
@@ -174,6 +422,9 @@ class Client:
             self.server.topic_manager.unsubscribe_from_topic(topic, self)
 
         unsuback_message = UnsubAckMessage(Header(MessageType.UNSUBACK), message.message_id)
+        if self._protocol_version == MQTT5_PROTOCOL_VERSION:
+            unsuback_message.properties = dict()
+            unsuback_message.reason_codes = [0] * len(message.topics)
 
         await self._send_message(unsuback_message)
 
@@ -182,7 +433,25 @@ class Client:
 
         log.debug(f'Received PUBLISH from {self._address}')
 
-        await self.server.topic_manager.publish(message)
+        if message.properties is not None:
+            error = self._check_mqtt5_publish(message)
+            if error is not None:
+                log.warning(f'Disconnecting {self._address}, {error}')
+                await self.close()
+                return
+
+        if not await self.server.rate_limiter.acquire(self, message):
+            log.warning(f'Disconnecting {self._address}, it exceeded its rate limit')
+            await self.close()
+            return
+
+        await self.server.route(message, self.identifier)
+
+        # Nobody consumed the streamed payload, it still has to be read from the connection
+        if message.payload_stream is not None:
+            await message.payload_stream.discard()
+
+        await self.server.flow_control.throttle(self, message.topic)
 
         qos = message.header.qos
         if not qos:
@@ -197,8 +466,37 @@ class Client:
         elif qos == 2:
             pubrec_message = PubRecMessage(Header(MessageType.PUBREC, qos=2), message.message_id)
 
+            self._unreleased += 1
             await self._send_message(pubrec_message)
 
+    def _check_mqtt5_publish(self, message: PublishMessage) -> str | None:
+        """
+        Replaces the topic alias of a PUBLISH message received from an MQTT 5 client by its topic,
+        and drops the properties if they were just the alias, so the message is forwarded as if it had none.
+        :return: the protocol violation if the message is not valid
+        """
+
+        if message.header.qos and self._unreleased >= self.server.receive_maximum:
+            return 'it exceeded the receive maximum'
+
+        properties = message.properties
+        alias = properties.pop(PropertyId.TOPIC_ALIAS, None)
+        if alias is not None:
+            if not 0 < alias <= len(self._aliases_in):
+                return f'it used topic alias {alias} above the topic alias maximum'
+
+            if message.topic:
+                self._aliases_in[alias - 1] = message.topic
+            elif self._aliases_in[alias - 1] is None:
+                return f'it used topic alias {alias} before defining it'
+            else:
+                message.topic = self._aliases_in[alias - 1]
+
+        if not properties:
+            message.properties = None
+
+        return None
+
     async def _on_ping(self, message: PingReqMessage):
         """Handles an incoming PINGREQ message."""
 
@@ -213,6 +511,8 @@ class Client:
 
         log.debug(f'Received PUBREL from {self._address}')
 
+        self._unreleased = max(self._unreleased - 1, 0)
+
         pubcomp_message = PubCompMessage(Header(MessageType.PUBCOMP, qos=2), message.message_id)
 
         await self._send_message(pubcomp_message)
@@ -226,30 +526,648 @@ class Client:
 
         await self._send_message(pubrel_message)
 
+    async def _on_ack(self, message: PubAckMessage | PubCompMessage):
+        """Handles an incoming PUBACK or PUBCOMP message, messages sent to subscribers are not retried."""
+
+        log.debug(f'Received {message.header.message_type.name} from {self._address}')
+
+        if self._receive_maximum is not None:
+            self._inflight = max(self._inflight - 1, 0)
+            # Messages may be queued because the client had too many in flight
+            if self._queue:
+                self._start_flush()
+
     async def _on_disconnect(self, message: DisconnectMessage):
         """Handles an incoming DISCONNECT message."""
 
         log.debug(f'Received DISCONNECT from {self._address}')
 
-        if self._clean_session:
-            self.server.topic_manager.clear_session(self)
-
         await self.close()
 
     async def _send_message(self, message: Message):
         """Sends a message to the client."""
 
-        self._writer.write(message.pack())
+        self._write_message(message)
         await self._writer.drain()
+        self._release_sent_buffers()
+
+    def _write_publish(self, message: PublishMessage) -> int:
+        """
+        Writes a PUBLISH message in the format of the client's protocol version, without waiting for it to be sent.
+        :return: size of the written frame, 0 if the message is too large for the client
+        """
+
+        if self._protocol_version == MQTT5_PROTOCOL_VERSION:
+            message = self._for_mqtt5(message)
+            if message is None:
+                return 0
+            if message.header.qos:
+                self._inflight += 1
+        elif message.properties is not None:
+            message = self._without_properties(message)
+
+        return self._write_message(message)
+
+    def _for_mqtt5(self, message: PublishMessage) -> PublishMessage | None:
+        """
+        Gets the message to send to an MQTT 5 client: with a topic alias if the client accepts them,
+        None if it is larger than the maximum packet size of the client. The payload is shared.
+        """
+
+        properties = dict(message.properties) if message.properties else dict()
+        topic = message.topic
+
+        alias = None
+        new_alias = False
+        if self._alias_topics:
+            alias = self._aliases_out.get(topic)
+            new_alias = alias is None
+            if new_alias:
+                alias = self._next_alias % len(self._alias_topics) + 1
+            properties[PropertyId.TOPIC_ALIAS] = alias
+        # The subscriber is told how long the message has left, not the interval it was published with
+        if message.expires_at is not None:
+            properties[PropertyId.MESSAGE_EXPIRY_INTERVAL] = message.remaining_expiry(time.monotonic())
+
+        # The topic is sent along with an alias the first time, afterwards the alias is enough
+        outgoing = PublishMessage(
+            message.header,
+            topic if new_alias or alias is None else b'',
+            message.message_id,
+            message.payload,
+            message.payload_stream,
+            properties
+        )
+
+        if self._maximum_packet_size is not None and outgoing.frame_size() > self._maximum_packet_size:
+            log.debug(f'Not sending a message of {outgoing.frame_size()} bytes to {self._address}, '
+                      f'it exceeds the maximum packet size of the client')
+            return None
+
+        if new_alias:
+            replaced = self._alias_topics[alias - 1]
+            if replaced is not None:
+                del self._aliases_out[replaced]
+            self._alias_topics[alias - 1] = topic
+            self._aliases_out[topic] = alias
+            self._next_alias += 1
+
+        return outgoing
+
+    @staticmethod
+    def _without_properties(message: PublishMessage) -> PublishMessage:
+        """Gets the message to send to an MQTT 3.1 client, which can't receive properties."""
+
+        if message.properties is None:
+            return message
+
+        return PublishMessage(message.header, message.topic, message.message_id, message.payload, message.payload_stream)
+
+    def _is_inflight_full(self, message: PublishMessage) -> bool:
+        """Checks if a QoS 1 or 2 message has to wait until the client acknowledged others."""
+
+        return (
+            self._receive_maximum is not None
+            and message.header.qos > 0
+            and self._inflight >= self._receive_maximum
+        )
+
+    def stream_prefix(self, message: PublishMessage) -> bytes | None:
+        """
+        Packs everything but the payload of a message streamed to the client in the format of its protocol version.
+        :return: the packed prefix, None if the message is too large for the client
+        """
+
+        if self._protocol_version != MQTT5_PROTOCOL_VERSION:
+            return Client._without_properties(message).pack_prefix()
+
+        message = self._for_mqtt5(message)
+        if message is None:
+            return None
+        if message.header.qos:
+            self._inflight += 1
+
+        return message.pack_prefix()
+
+    def _write_message(self, message: Message) -> int:
+        """
+        Writes a message to the client without waiting for it to be sent.
+        :return: size of the written frame
+        """
+
+        if self._deferred is not None:
+            packed = message.pack()
+            self._deferred.append(packed)
+            return len(packed)
+
+        size = message.frame_size()
+        buffer = self.server.buffer_pool.acquire(size)
+        message.pack_into(buffer)
+
+        self._write_pooled(buffer, size)
+
+        return size
+
+    def _has_persistent_session(self) -> bool:
+        """Checks if the client connected without asking for a clean session."""
+
+        return self._clean_session is not None and not self._clean_session
+
+    def _write_messages(self, messages: list[Message]) -> list[int]:
+        """
+        Writes messages to the client with a single write, without waiting for them to be sent.
+        :return: sizes of the written frames
+        """
+
+        sizes = [message.frame_size() for message in messages]
+        buffer = self.server.buffer_pool.acquire(sum(sizes))
+
+        offset = 0
+        for message in messages:
+            offset = message.pack_into(buffer, offset)
+
+        self._write_pooled(buffer, offset)
+
+        return sizes
+
+    def _write_pooled(self, buffer: bytearray, size: int):
+        """
+        Writes the start of a buffer taken from the server's pool, and returns it to the pool once it has been sent.
+        :param buffer: pooled buffer holding the data
+        :param size: number of bytes to write
+        """
+
+        self._writer.write(memoryview(buffer)[:size])
+
+        # Data the transport could not send right away may still reference the buffer, it is held until it is sent
+        if self._held_buffers is None and self._writer.transport.get_write_buffer_size() == 0:
+            self.server.buffer_pool.release(buffer)
+            return
+
+        if self._held_buffers is None:
+            self._held_buffers = []
+        self._held_buffers.append(buffer)
+        self._release_sent_buffers()
+
+    def _release_sent_buffers(self):
+        """Returns the held pooled buffers to the pool once the transport has sent all the data written."""
+
+        if self._held_buffers is None or self._closed or self._writer.transport.get_write_buffer_size():
+            return
+
+        for buffer in self._held_buffers:
+            self.server.buffer_pool.release(buffer)
+        self._held_buffers = None
+
+    def _is_congested(self) -> bool:
+        """Checks if the transport holds more unsent data than its high-water mark."""
+
+        transport = self._writer.transport
+        return transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+
+    def _enqueue(self, message: PublishMessage) -> int:
+        """
+        Queues a message and charges it to the server's memory accountant, its payload is shared through
+        the server's payload store.
+        :return: size of the message frame
+        """
+
+        size = message.frame_size()
+        if self.server.payload_store is not None:
+            message.payload = self.server.payload_store.acquire(message.payload)
+        if self._queue is None:
+            self._queue = deque()
+        self._queue.append(message)
+        self._queued_size += size
+
+        self.server.memory.track_queue(self)
+        self.server.memory.charge(self.identifier, message.topic, size)
+        if message.expires_at is not None:
+            self._watch_expiry(message.expires_at)
+
+        return size
+
+    def _release_queued(self, message: PublishMessage) -> int:
+        """
+        Releases the memory charged for a message removed from the queue.
+        :return: size of the message frame
+        """
+
+        size = message.frame_size()
+        self._queued_size -= size
+
+        self.server.memory.release(self.identifier, message.topic, size)
+        # The flow control of a closed connection has forgotten it already
+        if not self._closed:
+            self.server.flow_control.dequeue(self, size)
+        if self.server.payload_store is not None:
+            self.server.payload_store.release(message.payload)
+        if not self._queue:
+            self._queue = None
+            self.server.memory.untrack_queue(self)
+
+        return size
+
+    def _start_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_queue())
+
+    async def _flush_queue(self):
+        """Moves queued messages to the transport whenever it has room for more."""
+
+        try:
+            while self._queue and not self._closed:
+                await self._writer.drain()
+                self._release_sent_buffers()
+
+                while self._queue and not self._closed and not self._is_congested():
+                    # Resumed once the client acknowledged a message in flight, or once a streamed message is written
+                    if self._deferred is not None or self._is_inflight_full(self._queue[0]):
+                        return
+
+                    message = self._queue.popleft()
+                    size = self._release_queued(message)
+                    if message.expires_at is not None and message.is_expired(time.monotonic()):
+                        self.server.expiry.count((1, size))
+                        continue
+
+                    self._write_publish(message)
+        except ConnectionError:
+            pass
+
+    def _watch_expiry(self, expires_at: float):
+        """Schedules the expiry sweeper for a queued message, unless it is already scheduled earlier."""
+
+        if self._next_expiry is None or expires_at < self._next_expiry:
+            self._next_expiry = expires_at
+            self.server.expiry.schedule(expires_at, self._reclaim_expired)
+
+    def _reclaim_expired(self, now: float) -> tuple[int, int]:
+        """
+        Drops the expired queued messages, called by the expiry sweeper.
+        :return: number of dropped messages and their size
+        """
+
+        # Superseded by an earlier schedule, which already swept the queue and scheduled the next expiry
+        if self._next_expiry is None or self._next_expiry > now:
+            return 0, 0
+
+        self._next_expiry = None
+        if not self._queue:
+            return 0, 0
+
+        expired = [message for message in self._queue if message.is_expired(now)]
+        if expired:
+            self._queue = deque(message for message in self._queue if not message.is_expired(now))
+
+        expiries = [message.expires_at for message in self._queue if message.expires_at is not None]
+        if expiries:
+            self._watch_expiry(min(expiries))
+
+        return len(expired), sum(self._release_queued(message) for message in expired)
+
+    def shed_qos0(self) -> tuple[int, int]:
+        """
+        Drops every queued QoS 0 message.
+        :return: number of dropped messages and their size
+        """
+
+        if not self._queue:
+            return 0, 0
+
+        dropped = [message for message in self._queue if not message.header.qos]
+        if not dropped:
+            return 0, 0
+
+        self._queue = deque(message for message in self._queue if message.header.qos)
+
+        return len(dropped), sum(self._release_queued(message) for message in dropped)
+
+    def shed_oldest(self) -> tuple[int, int]:
+        """
+        Drops the oldest queued message.
+        :return: number of dropped messages and their size
+        """
+
+        if not self._queue:
+            return 0, 0
+
+        return 1, self._release_queued(self._queue.popleft())
+
+    def clear_queue(self):
+        """Drops every queued message."""
+
+        queue, self._queue = self._queue, None
+        for message in queue or ():
+            self._release_queued(message)
+
+    def take_queue(self) -> list[PublishMessage]:
+        """Removes every queued message, for a new connection of the same client on another event loop."""
+
+        queued = list(self._queue or ())
+        self.clear_queue()
+
+        return queued
+
+    async def adopt_session(self, queued: Awaitable[list[PublishMessage]]):
+        """
+        Takes over the messages queued for a previous connection of the same client on another event loop.
+        Messages delivered meanwhile are queued behind them, none is written before the CONNACK.
+        :param queued: messages taken from the previous connection on its loop
+        """
+
+        self._holding = True
+        try:
+            messages = await queued
+        finally:
+            self._holding = False
+
+        delivered, self._queue = self._queue, None
+        for message in messages:
+            size = self._enqueue(message)
+            self.server.flow_control.charge(self, message.topic, size, queued=True)
+
+        if delivered:
+            if self._queue is None:
+                self._queue = delivered
+            else:
+                self._queue.extend(delivered)
+
+    def take_over_queue(self, previous: 'Client'):
+        """Takes over the messages queued for a previous connection of the same client."""
+
+        self._queue, previous._queue = previous._queue, None
+        self._queued_size, previous._queued_size = previous._queued_size, 0
+        if not previous._closed:
+            previous.server.flow_control.dequeue(previous, self._queued_size)
+
+        self.server.memory.untrack_queue(previous)
+        if self._queue:
+            self.server.memory.track_queue(self)
+
+            # The queue is this connection's backlog now
+            for message in self._queue:
+                self.server.flow_control.charge(self, message.topic, message.frame_size(), queued=True)
+
+            expiries = [message.expires_at for message in self._queue if message.expires_at is not None]
+            if expiries:
+                self._watch_expiry(min(expiries))
+
+    def can_stream(self, message: PublishMessage) -> bool:
+        """
+        Checks if a message can be streamed to the client right away. A client with a backlog, or one that is
+        being streamed another message, has to get it once its payload has been read.
+        """
+
+        return not (self._closed or self._queue or self._holding or self._deferred is not None
+                    or self._is_congested() or self._is_inflight_full(message))
+
+    def begin_stream(self, prefix: bytes):
+        """
+        Starts writing a streamed message, see can_stream. Until end_stream, messages for the client are queued
+        and other packets are held back, so nothing gets written in the middle of the streamed frame.
+        :param prefix: everything but the payload, see stream_prefix
+        """
+
+        self._deferred = []
+        self.write_stream(prefix)
+
+    def write_stream(self, data: bytes):
+        """Writes a part of the streamed message without waiting for it to be sent."""
+
+        if not self._closed:
+            self._writer.write(data)
+
+    def end_stream(self):
+        """Writes the packets held back while the message was streamed, and the messages queued meanwhile."""
+
+        deferred, self._deferred = self._deferred, None
+        if not self._closed and deferred:
+            self._writer.write(b''.join(deferred))
+
+        if self._queue:
+            self._start_flush()
+
+    async def abort_stream(self):
+        """Closes the connection, a streamed message could not be written completely."""
+
+        self._deferred = None
+        await self.close()
+
+    async def drain(self):
+        """Waits until the data written to the client has been flushed enough to write more."""
+
+        if not self._closed:
+            await self._writer.drain()
+            self._release_sent_buffers()
+
+    def pending_size(self) -> int:
+        """Gets the amount of data queued or written to the client that has not been sent yet."""
+
+        return self._writer.transport.get_write_buffer_size() + self._queued_size
 
     def is_closed(self) -> bool:
         """Checks if the client connection has been closed."""
 
         return self._closed
 
+    def is_detached(self) -> bool:
+        """Checks if the client connection has been detached for a handoff to another process."""
+
+        return self._detaching
+
+    @property
+    def address(self) -> str:
+        return self._address
+
+    @property
+    def client_id(self) -> str | None:
+        return self._client_id
+
+    @property
+    def user_name(self) -> str | None:
+        return self._user_name
+
+    @property
+    def protocol_version(self) -> int:
+        return self._protocol_version
+
+    @property
+    def clean_session(self) -> bool | None:
+        return self._clean_session
+
+    @property
+    def identifier(self) -> str:
+        """Client identifier, or the address if the client has not connected yet."""
+
+        return self._client_id or self._address
+
+    @property
+    def queued_size(self) -> int:
+        return self._queued_size
+
+    def export_state(self) -> dict:
+        """Exports the session state needed to resume the connection in another process."""
+
+        return {
+            'address': self._address,
+            'client_id': self._client_id,
+            'user_name': self._user_name,
+            'keep_alive': self._keep_alive,
+            'clean_session': self._clean_session,
+            'will_retain': self._will.retain if self._will is not None else None,
+            'will_qos': self._will.qos if self._will is not None else None,
+            'will_topic': self._will.topic if self._will is not None else None,
+            'will_message': self._will.message if self._will is not None else None,
+            'protocol_version': self._protocol_version,
+            'receive_maximum': self._receive_maximum,
+            'inflight': self._inflight,
+            'unreleased': self._unreleased,
+            'maximum_packet_size': self._maximum_packet_size,
+            'aliases_in': [topic.hex() if topic is not None else None for topic in self._aliases_in],
+            'alias_topics': [topic.hex() if topic is not None else None for topic in self._alias_topics],
+            'next_alias': self._next_alias
+        }
+
+    def restore_state(self, state: dict):
+        """Restores the session state exported by export_state."""
+
+        self._client_id = state['client_id']
+        self._user_name = state['user_name']
+        self._keep_alive = state['keep_alive']
+        self._clean_session = state['clean_session']
+        if state['will_message'] is not None:
+            self._will = Will(state['will_topic'], state['will_message'], state['will_qos'], state['will_retain'])
+
+        # Missing from the state of a process without MQTT 5 support
+        self._protocol_version = state.get('protocol_version', PROTOCOL_VERSION)
+        self._receive_maximum = state.get('receive_maximum')
+        self._inflight = state.get('inflight', 0)
+        self._unreleased = state.get('unreleased', 0)
+        self._maximum_packet_size = state.get('maximum_packet_size')
+        self._aliases_in = [bytes.fromhex(topic) if topic is not None else None for topic in state.get('aliases_in', [])]
+        self._alias_topics = [
+            bytes.fromhex(topic) if topic is not None else None for topic in state.get('alias_topics', [])
+        ]
+        self._aliases_out = {topic: alias for alias, topic in enumerate(self._alias_topics, 1) if topic is not None}
+        self._next_alias = state.get('next_alias', 0)
+
+    async def detach(self, timeout: float) -> tuple[int, bytes] | None:
+        """
+        Stops serving the connection at a packet boundary so that it can be handed over to another process.
+        :param timeout: how long to wait for a packet that is being read or handled
+        :return: duplicated socket descriptor and the bytes already read but not yet parsed,
+            or None if the connection could not be detached cleanly, it is then served on unless its serve loop
+            already stopped, see is_serving
+        """
+
+        if self._closed:
+            return None
+
+        # The TLS session state can't be handed over, the client has to reconnect
+        if self._writer.get_extra_info('sslcontext') is not None:
+            return None
+
+        self._detaching = True
+        transport = self._writer.transport
+
+        # A client waiting for its next packet has not consumed anything yet, so it can be interrupted right away.
+        # Otherwise the packet in progress is handled first and the loop in serve stops before the next one.
+        if self._idle and self._task is not None:
+            transport.pause_reading()
+            self._task.cancel()
+
+        if self._task is not None and self._task is not asyncio.current_task():
+            done, _ = await asyncio.wait({self._task}, timeout=timeout)
+            if not done:
+                log.warning(f'Client {self._address} did not reach a packet boundary, it will not be handed over')
+                self.cancel_detach()
+                return None
+
+        transport.pause_reading()
+
+        # Queued messages are not handed over, they have to reach the transport first
+        if self._flush_task is not None:
+            await asyncio.wait({self._flush_task}, timeout=timeout)
+        if self._queue:
+            log.warning(f'Could not flush queued messages of {self._address}, it will not be handed over')
+            self.cancel_detach()
+            return None
+
+        # Flush everything already written so no outgoing data stays behind in this process
+        transport.set_write_buffer_limits(high=0)
+        try:
+            await asyncio.wait_for(self._writer.drain(), timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            log.warning(f'Could not flush pending data of {self._address}, it will not be handed over')
+            self.cancel_detach()
+            return None
+
+        # StreamReader keeps no public accessor for data that has been received but not read yet, its _buffer
+        # is a CPython implementation detail
+        buffered = getattr(self._reader, '_buffer', None)
+        if not isinstance(buffered, bytearray):
+            log.warning(f'Could not read the buffered data of {self._address}, it will not be handed over')
+            self.cancel_detach()
+            return None
+
+        sock = self._writer.get_extra_info('socket')
+
+        return os.dup(sock.fileno()), bytes(buffered)
+
+    def cancel_detach(self):
+        """
+        Undoes detach, when the connection is not handed over after all. A client interrupted while it was
+        waiting for its next packet has to be served again, see is_serving.
+        """
+
+        if not self._detaching:
+            return
+
+        self._detaching = False
+        if self._closed:
+            return
+
+        transport = self._writer.transport
+        transport.set_write_buffer_limits()
+        transport.resume_reading()
+
+    def is_serving(self) -> bool:
+        """Checks if the loop serving the connection is running."""
+
+        return self._task is not None and not self._task.done()
+
     async def close(self):
         """Closes the client connection."""
 
         self._closed = True
+
+        if self._capture_id is not None:
+            self.server.capture.close(self._capture_id)
+            self._capture_id = self._capture = None
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+
+        # A persistent session keeps its queue until the client connects again
+        if not self._has_persistent_session():
+            self.clear_queue()
+
+        # The transport may still reference the held buffers, they are left to the garbage collector
+        self._held_buffers = None
+
         self._writer.close()
         await self._writer.wait_closed()
+
+    # Handlers by packet type, shared by all connections instead of bound methods per connection
+    _ACTIONS: dict[MessageType, Callable[['Client', Message], Awaitable[None]]] = {
+        MessageType.SUBSCRIBE: _on_subscribe,
+        MessageType.UNSUBSCRIBE: _on_unsubscribe,
+        MessageType.PUBLISH: _on_publish,
+        MessageType.PINGREQ: _on_ping,
+        MessageType.DISCONNECT: _on_disconnect,
+        MessageType.PUBREL: _on_pubrel,
+        MessageType.PUBREC: _on_pubrec,
+        MessageType.PUBACK: _on_ack,
+        MessageType.PUBCOMP: _on_ack
+    }
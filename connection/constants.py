@@ -2,8 +2,13 @@ from enum import IntEnum
 
 PROTOCOL_NAME = 'MQIsdp'
 PROTOCOL_VERSION = 3
+# MQTT 5 is supported alongside 3.1, the protocol version of a connection is the one of its CONNECT
+MQTT5_PROTOCOL_NAME = 'MQTT'
+MQTT5_PROTOCOL_VERSION = 5
 MAXIMUM_PACKET_SIZE = 268435455
 MAXIMUM_CLIENT_ID_LENGTH = 23
+# Client identifiers of the connections of bridged brokers start with this
+BRIDGE_CLIENT_ID_PREFIX = '$bridge-'
 
 
 class MessageType(IntEnum):
@@ -30,3 +35,14 @@ class ConnectReturnCode(IntEnum):
     SERVER_UNAVAILABLE = 3
     BAD_USER_NAME_OR_PASSWORD = 4
     NOT_AUTHORIZED = 5
+
+
+# Reason codes of an MQTT 5 CONNACK for the MQTT 3.1 return codes
+CONNACK_REASON_CODES: dict[ConnectReturnCode, int] = {
+    ConnectReturnCode.ACCEPTED: 0x00,
+    ConnectReturnCode.UNACCEPTABLE_PROTOCOL_VERSION: 0x84,
+    ConnectReturnCode.IDENTIFIER_REJECTED: 0x85,
+    ConnectReturnCode.SERVER_UNAVAILABLE: 0x88,
+    ConnectReturnCode.BAD_USER_NAME_OR_PASSWORD: 0x86,
+    ConnectReturnCode.NOT_AUTHORIZED: 0x87
+}
@@ -0,0 +1,59 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable
+
+
+class ExpirySweeper:
+    """
+    Reclaims expired messages held by the broker: queued messages and retained messages. \\
+    Holders schedule a reclaim callback for the earliest expiry of their messages, the callbacks are kept in a heap
+    by time and called once they are due. A holder keeps a single entry at a time and schedules the next one
+    from its callback, so the heap grows with the number of holders, not with the number of messages.
+    """
+
+    def __init__(self, interval: float):
+        """
+        :param interval: seconds between sweeps, messages may outlive their expiry by up to this long
+        """
+
+        self._interval = interval
+        # (time, sequence, callback), the sequence keeps callbacks from being compared
+        self._heap: list[tuple[float, int, Callable[[float], tuple[int, int]]]] = []
+        self._sequence = itertools.count()
+
+        self.reclaimed_messages = 0
+        self.reclaimed_bytes = 0
+
+    def schedule(self, expires_at: float, reclaim: Callable[[float], tuple[int, int]]):
+        """
+        Calls reclaim with the current time once expires_at (time.monotonic) has passed.
+        :param reclaim: drops the expired messages of a holder, returns their number and size
+        """
+
+        heapq.heappush(self._heap, (expires_at, next(self._sequence), reclaim))
+
+    def count(self, dropped: tuple[int, int]):
+        """Counts expired messages dropped by their holder, e.g. when a queue is flushed."""
+
+        messages, size = dropped
+        self.reclaimed_messages += messages
+        self.reclaimed_bytes += size
+
+    def sweep(self, now: float):
+        """Calls the callbacks that are due."""
+
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, _, reclaim = heapq.heappop(heap)
+            self.count(reclaim(now))
+
+    async def sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            self.sweep(time.monotonic())
+
+    def __str__(self) -> str:
+        return (f'{self.reclaimed_messages} expired messages ({self.reclaimed_bytes} bytes) reclaimed, '
+                f'{len(self._heap)} scheduled sweeps')
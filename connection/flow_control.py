@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from collections import deque
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .client import Client
+
+
+log = logging.getLogger(__name__)
+
+
+class _Backlog:
+    """Data queued or written to a subscriber that has not been sent yet, in the order it was charged."""
+
+    def __init__(self):
+        self.size = 0
+        self.charges: deque[tuple[bytes, int]] = deque()
+        # Part of the size still queued by the subscriber rather than written to its transport
+        self.queued = 0
+
+
+class FlowController:
+    """
+    Keeps the data waiting for subscribers bounded.
+
+    Messages are written or queued to subscribers without waiting for them to be sent. The data still pending
+    is tracked for each topic and for the whole broker; once a high-water mark is crossed, publishers to the congested
+    topic stop being read from until the backlog drops below the low-water mark again.
+    A paused publisher's read loop waits in throttle before reading its next packet, and its stream reader stops
+    the transport once its buffer is full, so reading is paused in a single place.
+    Nothing gets dropped, the publishers are slowed down to the pace of the subscribers.
+    """
+
+    def __init__(
+        self,
+        broker_high_water: int,
+        broker_low_water: int,
+        topic_high_water: int,
+        topic_low_water: int,
+        poll_interval: float
+    ):
+        self._broker_high_water = broker_high_water
+        self._broker_low_water = broker_low_water
+        self._topic_high_water = topic_high_water
+        self._topic_low_water = topic_low_water
+        self._poll_interval = poll_interval
+
+        # Updated when subscribers get more data and while publishers are paused, so it may lag behind
+        self.backlog = 0
+        # Part of the backlog in subscribers' queues, the memory accountant charges queued messages itself
+        self.queued = 0
+        self._topic_backlogs: dict[bytes, int] = dict()
+        self._client_backlogs: dict['Client', _Backlog] = dict()
+
+        self._paused: dict['Client', tuple[bytes, asyncio.Future]] = dict()
+        self._poll_task: asyncio.Task | None = None
+
+    def topic_backlog(self, topic: bytes) -> int:
+        return self._topic_backlogs.get(topic, 0)
+
+    @property
+    def transport_backlog(self) -> int:
+        """Part of the backlog written to subscribers' transports."""
+
+        return self.backlog - self.queued
+
+    def charge(self, subscriber: 'Client', topic: bytes, size: int, queued: bool = False):
+        """
+        Records data written or queued to a subscriber for the given topic.
+        :param queued: True if the subscriber queued the data, see dequeue
+        """
+
+        backlog = self._client_backlogs.get(subscriber)
+        if backlog is None:
+            backlog = self._client_backlogs[subscriber] = _Backlog()
+        else:
+            # The subscriber's pending data includes the data being charged
+            self._release_sent(subscriber, backlog, size)
+
+        backlog.size += size
+        backlog.charges.append((topic, size))
+        if queued:
+            backlog.queued += size
+            self.queued += size
+
+        self.backlog += size
+        self._topic_backlogs[topic] = self._topic_backlogs.get(topic, 0) + size
+
+    def dequeue(self, subscriber: 'Client', size: int):
+        """Records queued data the subscriber removed from its queue, to write it to its transport or to drop it."""
+
+        backlog = self._client_backlogs.get(subscriber)
+        if backlog is None:
+            return
+
+        size = min(size, backlog.queued)
+        backlog.queued -= size
+        self.queued -= size
+
+    def _release_sent(self, subscriber: 'Client', backlog: _Backlog, uncharged: int = 0):
+        """
+        Releases the charges of a subscriber's data that its transport has sent meanwhile.
+        :param uncharged: size of the subscriber's pending data that is not charged yet
+        """
+
+        sent = backlog.size - (subscriber.pending_size() - uncharged)
+
+        while sent > 0 and backlog.charges:
+            topic, size = backlog.charges[0]
+            released = min(sent, size)
+
+            if released == size:
+                backlog.charges.popleft()
+            else:
+                backlog.charges[0] = (topic, size - released)
+
+            sent -= released
+            backlog.size -= released
+            self.backlog -= released
+            self._release_topic(topic, released)
+
+    def _release_all_sent(self):
+        for subscriber, backlog in list(self._client_backlogs.items()):
+            self._release_sent(subscriber, backlog)
+            if not backlog.charges:
+                del self._client_backlogs[subscriber]
+
+    def _release_topic(self, topic: bytes, size: int):
+        remaining = self._topic_backlogs[topic] - size
+        if remaining > 0:
+            self._topic_backlogs[topic] = remaining
+        else:
+            del self._topic_backlogs[topic]
+
+    def forget(self, client: 'Client'):
+        """Drops everything charged to a client that is gone, and lets it go if it was paused."""
+
+        backlog = self._client_backlogs.pop(client, None)
+        if backlog is not None:
+            self.queued -= backlog.queued
+            for topic, size in backlog.charges:
+                self.backlog -= size
+                self._release_topic(topic, size)
+
+        paused = self._paused.pop(client, None)
+        if paused is not None and not paused[1].done():
+            paused[1].set_result(None)
+
+    def _is_congested(self, topic: bytes) -> bool:
+        if self.backlog <= self._broker_high_water and self.topic_backlog(topic) <= self._topic_high_water:
+            return False
+
+        # Backlogs are only updated when a subscriber gets more data, so they may be outdated
+        self._release_all_sent()
+
+        return self.backlog > self._broker_high_water or self.topic_backlog(topic) > self._topic_high_water
+
+    def _is_relieved(self, topic: bytes) -> bool:
+        return self.backlog <= self._broker_low_water and self.topic_backlog(topic) <= self._topic_low_water
+
+    async def throttle(self, publisher: 'Client', topic: bytes):
+        """
+        Called after a message of the publisher has been delivered to subscribers, before its next packet is read. \\
+        If the topic or the broker is congested, waits until the backlog drains.
+        """
+
+        if not self._is_congested(topic):
+            return
+
+        log.debug(f'Pausing {publisher.address}, backlog of {topic.decode()}: {self.topic_backlog(topic)} bytes, '
+                  f'broker: {self.backlog} bytes')
+
+        resumed = asyncio.get_running_loop().create_future()
+        self._paused[publisher] = (topic, resumed)
+
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll())
+
+        try:
+            await resumed
+        finally:
+            self._paused.pop(publisher, None)
+
+        log.debug(f'Resuming {publisher.address}')
+
+    async def _poll(self):
+        """Follows the subscribers' transports while publishers are paused and resumes the relieved ones."""
+
+        while self._paused:
+            await asyncio.sleep(self._poll_interval)
+
+            self._release_all_sent()
+
+            for publisher, (topic, resumed) in list(self._paused.items()):
+                if self._is_relieved(topic) and not resumed.done():
+                    resumed.set_result(None)
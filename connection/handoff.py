@@ -0,0 +1,134 @@
+import json
+import logging
+import socket
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+HANDOFF_REQUEST = b'HANDOFF\n'
+HANDOFF_DONE = b'DONE\n'
+
+# Linux refuses more than 253 descriptors (SCM_MAX_FD) in a single message
+MAX_FDS_PER_MESSAGE = 250
+
+_LENGTH = struct.Struct('!I')
+
+
+@dataclass
+class Handoff:
+    """Everything a running server hands over to its successor."""
+
+    state: dict
+    listener_fds: list[int] = field(default_factory=list)
+    client_fds: list[int] = field(default_factory=list)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    """Receives exactly size bytes from a blocking socket."""
+
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError('Handoff connection closed unexpectedly')
+        buffer += chunk
+
+    return bytes(buffer)
+
+
+def _send_fds(sock: socket.socket, fds: list[int]) -> None:
+    """Sends file descriptors in batches small enough for a single SCM_RIGHTS message."""
+
+    for start in range(0, len(fds), MAX_FDS_PER_MESSAGE):
+        batch = fds[start:start + MAX_FDS_PER_MESSAGE]
+        socket.send_fds(sock, [_LENGTH.pack(len(batch))], batch)
+
+
+def _recv_fds(sock: socket.socket, count: int) -> list[int]:
+    """Receives count file descriptors sent with _send_fds."""
+
+    fds = []
+    while len(fds) < count:
+        data, batch, _, _ = socket.recv_fds(sock, _LENGTH.size, MAX_FDS_PER_MESSAGE)
+        if not data:
+            raise ConnectionError('Handoff connection closed unexpectedly')
+
+        if len(data) < _LENGTH.size:
+            data += _recv_exactly(sock, _LENGTH.size - len(data))
+
+        expected, = _LENGTH.unpack(data)
+        if expected != len(batch):
+            raise ConnectionError(f'Expected {expected} descriptors, received {len(batch)}')
+
+        fds.extend(batch)
+
+    return fds
+
+
+def send_handoff(sock: socket.socket, handoff: Handoff) -> None:
+    """
+    Sends the server state and the listening and client sockets to the new process.
+    Blocks until the new process confirms it has taken them over.
+    """
+
+    sock.setblocking(True)
+
+    header = json.dumps({
+        'state': handoff.state,
+        'listeners': len(handoff.listener_fds),
+        'clients': len(handoff.client_fds)
+    }).encode()
+
+    sock.sendall(_LENGTH.pack(len(header)) + header)
+    _send_fds(sock, handoff.listener_fds)
+    _send_fds(sock, handoff.client_fds)
+
+    if _recv_exactly(sock, len(HANDOFF_DONE)) != HANDOFF_DONE:
+        raise ConnectionError('New process did not confirm the handoff')
+
+
+def request_handoff(path: str) -> Handoff | None:
+    """
+    Asks the server listening on the given Unix socket to hand over its sockets and state.
+    :return: Handoff or None if no server is running
+    """
+
+    socket_path = Path(path).expanduser()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    with sock:
+        sock.sendall(HANDOFF_REQUEST)
+
+        length, = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+        header = json.loads(_recv_exactly(sock, length))
+
+        listener_fds = _recv_fds(sock, header['listeners'])
+        client_fds = _recv_fds(sock, header['clients'])
+
+        sock.sendall(HANDOFF_DONE)
+
+    log.info(f'Took over {len(listener_fds)} listener(s) and {len(client_fds)} client connection(s)')
+
+    return Handoff(header['state'], listener_fds, client_fds)
+
+
+def create_handoff_socket(path: str) -> socket.socket:
+    """Creates the Unix socket a future process connects to when requesting a handoff."""
+
+    socket_path = Path(path).expanduser()
+    socket_path.unlink(missing_ok=True)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(socket_path))
+    sock.listen(1)
+    sock.setblocking(False)
+
+    return sock
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+from typing import Hashable
+
+
+log = logging.getLogger(__name__)
+
+MESSAGES = 0
+BYTES = 1
+
+
+class CountMinSketch:
+    """
+    Estimates the count of any key in constant memory: depth rows of width counters, a key adds to one counter
+    of every row and its estimate is the smallest of them. Estimates are never below the true count.
+    """
+
+    def __init__(self, width: int, depth: int):
+        self._width = width
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key: Hashable) -> list[int]:
+        # Double hashing derives the index of every row from a single hash
+        key_hash = hash(key)
+        first = key_hash & 0xffffffff
+        second = (key_hash >> 32) | 1
+
+        return [(first + row * second) % self._width for row in range(len(self._rows))]
+
+    def add(self, key: Hashable, amount: int) -> int:
+        """Adds amount to the count of a key, returns its new estimate."""
+
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += amount
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+
+        return estimate
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+
+class TopK:
+    """
+    Space-saving top-K: a fixed number of monitored keys with their estimated counts. A key that is not
+    monitored replaces the one with the smallest count once its estimate is larger.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self.counts: dict[Hashable, int] = dict()
+        self._minimum = 0
+
+    def offer(self, key: Hashable, estimate: int):
+        counts = self.counts
+        if key in counts:
+            counts[key] = estimate
+            return
+
+        if len(counts) < self._capacity:
+            counts[key] = estimate
+            if len(counts) == self._capacity:
+                self._minimum = min(counts.values())
+            return
+
+        # Counts only grow, so the cached minimum is a lower bound and most keys are rejected without a scan
+        if estimate <= self._minimum:
+            return
+
+        smallest = min(counts, key=counts.get)
+        if estimate <= counts[smallest]:
+            self._minimum = counts[smallest]
+            return
+
+        del counts[smallest]
+        counts[key] = estimate
+        self._minimum = min(counts.values())
+
+
+class _Bucket:
+    """Sketches and top keys by messages and by bytes of one interval of the window."""
+
+    def __init__(self, capacity: int, width: int, depth: int):
+        self.sketches = (CountMinSketch(width, depth), CountMinSketch(width, depth))
+        self.top = (TopK(capacity), TopK(capacity))
+
+
+class HeavyHitters:
+    """
+    Tracks the keys (topics or clients) with the most messages and bytes over a sliding window, in constant memory. \\
+    The window is a ring of buckets, each with a count-min sketch and a top-K per metric, the oldest bucket is
+    cleared when the window slides. Counts are first summed in a small dictionary and folded into the sketches
+    when it fills up or the window slides, so a repeated key costs a dictionary update.
+    """
+
+    def __init__(self, buckets: int, capacity: int, width: int, depth: int, pending_limit: int = 1024):
+        """
+        :param buckets: intervals the window is divided into
+        :param capacity: keys monitored per bucket and metric
+        :param width: counters per row of the count-min sketches
+        :param depth: rows of the count-min sketches
+        :param pending_limit: distinct keys summed before they are folded into the sketches
+        """
+
+        self._capacity = capacity
+        self._width = width
+        self._depth = depth
+        self._pending_limit = pending_limit
+
+        self._buckets = [_Bucket(capacity, width, depth) for _ in range(buckets)]
+        self._current = 0
+        # Key -> [messages, bytes] not folded into the current bucket yet
+        self._pending: dict[Hashable, list[int]] = dict()
+
+    def add(self, key: Hashable, size: int, messages: int = 1):
+        counts = self._pending.get(key)
+        if counts is None:
+            if len(self._pending) >= self._pending_limit:
+                self._fold()
+            self._pending[key] = [messages, size]
+        else:
+            counts[0] += messages
+            counts[1] += size
+
+    def _fold(self):
+        """Adds the pending counts to the current bucket."""
+
+        bucket = self._buckets[self._current]
+        for metric in (MESSAGES, BYTES):
+            sketch = bucket.sketches[metric]
+            top = bucket.top[metric]
+            for key, counts in self._pending.items():
+                top.offer(key, sketch.add(key, counts[metric]))
+
+        self._pending.clear()
+
+    def slide(self):
+        """Starts a new bucket, dropping the counts of the oldest one."""
+
+        self._fold()
+        self._current = (self._current + 1) % len(self._buckets)
+        self._buckets[self._current] = _Bucket(self._capacity, self._width, self._depth)
+
+    def estimate(self, key: Hashable) -> tuple[int, int]:
+        """Gets the estimated messages and bytes of a key over the window, never below the true counts."""
+
+        pending = self._pending.get(key, (0, 0))
+
+        return tuple(
+            pending[metric] + sum(bucket.sketches[metric].estimate(key) for bucket in self._buckets)
+            for metric in (MESSAGES, BYTES)
+        )
+
+    def top(self, count: int, metric: int = MESSAGES) -> list[tuple[Hashable, int, int]]:
+        """
+        Gets the keys with the most messages or bytes over the window.
+        :param metric: MESSAGES or BYTES
+        :return: keys with their estimated messages and bytes, largest first
+        """
+
+        self._fold()
+        candidates = set()
+        for bucket in self._buckets:
+            candidates.update(bucket.top[metric].counts)
+
+        estimates = [(key, *self.estimate(key)) for key in candidates]
+        estimates.sort(key=lambda item: item[1 + metric], reverse=True)
+
+        return estimates[:count]
+
+
+class TrafficStats:
+    """Heavy hitters of the broker: topics and clients by messages and bytes received and sent."""
+
+    def __init__(self, window: float, buckets: int, capacity: int, width: int, depth: int):
+        """
+        :param window: seconds the counts cover
+        :param buckets: intervals the window is divided into, it slides by one interval at a time
+        """
+
+        self._interval = window / buckets
+        self.topics_in = HeavyHitters(buckets, capacity, width, depth)
+        self.topics_out = HeavyHitters(buckets, capacity, width, depth)
+        self.clients_in = HeavyHitters(buckets, capacity, width, depth)
+        self.clients_out = HeavyHitters(buckets, capacity, width, depth)
+
+    def record_in(self, topic: bytes, owner: str | None, size: int):
+        """Counts a message received from a client, None if it has no owning client."""
+
+        self.topics_in.add(topic, size)
+        if owner is not None:
+            self.clients_in.add(owner, size)
+
+    def record_out(self, topic: bytes, client_id: str, size: int):
+        """Counts a message sent to a client."""
+
+        self.topics_out.add(topic, size)
+        self.clients_out.add(client_id, size)
+
+    def merge(self, counts: tuple[dict[Hashable, list[int]], ...]):
+        """Adds the counts taken from a TrafficBuffer."""
+
+        for hitters, hitter_counts in zip((self.topics_in, self.clients_in, self.topics_out, self.clients_out), counts):
+            for key, (messages, size) in hitter_counts.items():
+                hitters.add(key, size, messages)
+
+    async def slide_periodically(self):
+        while True:
+            await asyncio.sleep(self._interval)
+
+            for hitters in (self.topics_in, self.topics_out, self.clients_in, self.clients_out):
+                hitters.slide()
+
+    def report(self, count: int = 5) -> dict[str, list[dict]]:
+        """
+        Gets the top topics and clients by messages and by bytes, in and out, e.g.
+        {'topics_in_by_messages': [{'key': 'sensors/1', 'messages': 1200, 'bytes': 76800}, ...], ...}
+        """
+
+        report = dict()
+        for name in ('topics_in', 'topics_out', 'clients_in', 'clients_out'):
+            hitters: HeavyHitters = getattr(self, name)
+            for metric, metric_name in ((MESSAGES, 'messages'), (BYTES, 'bytes')):
+                report[f'{name}_by_{metric_name}'] = [
+                    {
+                        'key': key.decode(errors='replace') if isinstance(key, bytes) else key,
+                        'messages': messages,
+                        'bytes': size
+                    }
+                    for key, messages, size in hitters.top(count, metric)
+                ]
+
+        return report
+
+    def log_top(self, count: int = 5):
+        """Logs the top topics and clients by messages and by bytes, in and out."""
+
+        for name, entries in self.report(count).items():
+            if entries:
+                top = ', '.join(f'{entry["key"]} ({entry["messages"]} messages, {entry["bytes"]} bytes)'
+                                for entry in entries)
+                log.info(f'Heavy hitters, {name.replace("_", " ")}: {top}')
+
+
+class TrafficBuffer:
+    """
+    Counts the traffic of an event loop of a server running several of them, with the interface of TrafficStats. \
+    The counts are summed by key until they are taken, to be merged into the TrafficStats of the server on its own
+    loop, so the sketches are only ever updated by one thread. \
+    At most limit keys are summed per kind of count. Beyond them the half with the fewest messages is dropped, and
+    keys added afterwards start from the largest dropped counts like in a space-saving summary, so memory stays
+    constant and no count falls below the true one.
+    """
+
+    def __init__(self, limit: int = 1024):
+        """:param limit: distinct keys summed per kind of count until they are taken"""
+
+        self._limit = limit
+        self._counts, self._floors = TrafficBuffer._empty()
+
+    @staticmethod
+    def _empty() -> tuple[tuple[dict[Hashable, list[int]], ...], tuple[list[int], ...]]:
+        # Topics in, clients in, topics out, clients out, and the largest messages and bytes dropped of each
+        return (dict(), dict(), dict(), dict()), ([0, 0], [0, 0], [0, 0], [0, 0])
+
+    def _add(self, kind: int, key: Hashable, size: int):
+        counts = self._counts[kind]
+        entry = counts.get(key)
+        if entry is not None:
+            entry[0] += 1
+            entry[1] += size
+            return
+
+        floor = self._floors[kind]
+        if len(counts) >= self._limit:
+            self._drop_smallest(counts, floor)
+        counts[key] = [floor[0] + 1, floor[1] + size]
+
+    @staticmethod
+    def _drop_smallest(counts: dict[Hashable, list[int]], floor: list[int]):
+        """Drops the half of the keys with the fewest messages, raising the floor to their largest counts."""
+
+        by_messages = sorted(counts, key=lambda key: counts[key][0])
+        for key in by_messages[:len(by_messages) // 2 or 1]:
+            messages, size = counts.pop(key)
+            floor[0] = max(floor[0], messages)
+            floor[1] = max(floor[1], size)
+
+    def record_in(self, topic: bytes, owner: str | None, size: int):
+        self._add(0, topic, size)
+        if owner is not None:
+            self._add(1, owner, size)
+
+    def record_out(self, topic: bytes, client_id: str, size: int):
+        self._add(2, topic, size)
+        self._add(3, client_id, size)
+
+    def take(self) -> tuple[dict[Hashable, list[int]], ...]:
+        """Gets the counts summed since they were last taken, for TrafficStats.merge."""
+
+        counts = self._counts
+        self._counts, self._floors = TrafficBuffer._empty()
+        return counts
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import socket
+import ssl
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class HandshakeStats:
+    """TLS handshakes of a listener, a resumed handshake reuses the session of a previous connection."""
+
+    full: int = 0
+    resumed: int = 0
+    failed: int = 0
+    # Handshakes that had to wait because too many were in progress
+    queued: int = 0
+    full_time: float = 0.0
+    resumed_time: float = 0.0
+
+    @property
+    def mean_full_time(self) -> float:
+        return self.full_time / self.full if self.full else 0.0
+
+    @property
+    def mean_resumed_time(self) -> float:
+        return self.resumed_time / self.resumed if self.resumed else 0.0
+
+    def __str__(self) -> str:
+        return (f'{self.full} full (mean {self.mean_full_time * 1000:.2f} ms), '
+                f'{self.resumed} resumed (mean {self.mean_resumed_time * 1000:.2f} ms), '
+                f'{self.failed} failed, {self.queued} queued')
+
+
+class _PendingTLSProtocol(asyncio.Protocol):
+    """Holds an accepted connection without reading from it until its TLS handshake may start."""
+
+    def __init__(self, listener: 'Listener', handle_connection: Callable):
+        self._listener = listener
+        self._handle_connection = handle_connection
+
+    def connection_made(self, transport: asyncio.Transport):
+        # Nothing must be read before the TLS protocol takes over the transport
+        transport.pause_reading()
+        self._listener._start_task(self._listener._accept_tls(transport, self._handle_connection))
+
+
+@dataclass
+class Listener:
+    """
+    Address the server accepts connections on, TCP or a Unix domain socket,
+    with the settings of the connections accepted on it.
+    """
+
+    host: str = 'localhost'
+    port: int = 1883
+    # Path of a Unix domain socket, host and port are ignored when it is set
+    path: str | None = None
+    auth: bool = False
+    backlog: int = 100
+    # Size limit of the buffer of the stream reader of every connection
+    reader_limit: int = 64 * 1024
+    tcp_nodelay: bool = True
+    # SO_SNDBUF and SO_RCVBUF of the connections, None to keep the system default
+    send_buffer_size: int | None = None
+    receive_buffer_size: int | None = None
+    # Certificate chain and private key, TLS is enabled when certfile is set
+    certfile: str | None = None
+    keyfile: str | None = None
+    # TLS 1.3 session tickets sent after a full handshake, so that reconnecting clients can resume the session,
+    # 0 disables session resumption
+    session_tickets: int = 2
+    # TLS handshakes in progress at the same time, further connections wait so established ones keep being served
+    max_handshakes: int = 32
+    handshake_timeout: float = 10.0
+
+    def __post_init__(self):
+        self.handshake_stats = HandshakeStats()
+        self._ssl_context: ssl.SSLContext | None = None
+        self._handshakes: asyncio.Semaphore | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def is_unix(self) -> bool:
+        return self.path is not None
+
+    @property
+    def is_tls(self) -> bool:
+        return self.certfile is not None
+
+    def __str__(self) -> str:
+        scheme = 'tls+' if self.is_tls else ''
+        if self.is_unix:
+            return f'{scheme}unix:{self.path}'
+
+        return f'{scheme}{self.host}:{self.port}'
+
+    async def start(self, handle_connection: Callable, sock: socket.socket | None = None) -> asyncio.Server:
+        """
+        Starts accepting connections.
+        :param sock: listening socket handed over by a previous process, or shared with another event loop,
+            instead of binding a new one
+        """
+
+        if self.is_tls:
+            server = await self._start_tls(handle_connection, sock)
+        elif self.is_unix:
+            if sock is None:
+                self._remove_stale_socket()
+                server = await asyncio.start_unix_server(
+                    handle_connection, os.path.expanduser(self.path), limit=self.reader_limit, backlog=self.backlog
+                )
+            else:
+                server = await asyncio.start_unix_server(
+                    handle_connection, sock=sock, limit=self.reader_limit, backlog=self.backlog
+                )
+        else:
+            if sock is None:
+                server = await asyncio.start_server(
+                    handle_connection, self.host, self.port, limit=self.reader_limit, backlog=self.backlog
+                )
+            else:
+                server = await asyncio.start_server(
+                    handle_connection, sock=sock, limit=self.reader_limit, backlog=self.backlog
+                )
+
+        # Accepted sockets inherit the buffer sizes of the listening socket
+        for listening_socket in server.sockets:
+            if self.send_buffer_size is not None:
+                listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+            if self.receive_buffer_size is not None:
+                listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+
+        return server
+
+    async def _start_tls(self, handle_connection: Callable, sock: socket.socket | None) -> asyncio.Server:
+        """Starts accepting connections whose TLS handshakes are done once a handshake slot is free."""
+
+        loop = asyncio.get_running_loop()
+        self._ssl_context = self._create_ssl_context()
+        self._handshakes = asyncio.Semaphore(self.max_handshakes)
+
+        def protocol_factory():
+            return _PendingTLSProtocol(self, handle_connection)
+
+        if self.is_unix:
+            if sock is None:
+                self._remove_stale_socket()
+                return await loop.create_unix_server(
+                    protocol_factory, os.path.expanduser(self.path), backlog=self.backlog
+                )
+
+            return await loop.create_unix_server(protocol_factory, sock=sock, backlog=self.backlog)
+
+        if sock is None:
+            return await loop.create_server(protocol_factory, self.host, self.port, backlog=self.backlog)
+
+        return await loop.create_server(protocol_factory, sock=sock, backlog=self.backlog)
+
+    def _create_ssl_context(self) -> ssl.SSLContext:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(
+            os.path.expanduser(self.certfile),
+            os.path.expanduser(self.keyfile) if self.keyfile is not None else None
+        )
+
+        context.num_tickets = self.session_tickets
+        if not self.session_tickets:
+            context.options |= ssl.OP_NO_TICKET
+
+        return context
+
+    def _start_task(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _accept_tls(self, transport: asyncio.Transport, handle_connection: Callable):
+        """Does the TLS handshake of an accepted connection and hands the connection over to the server."""
+
+        loop = asyncio.get_running_loop()
+
+        if self._handshakes.locked():
+            self.handshake_stats.queued += 1
+
+        async with self._handshakes:
+            reader = asyncio.StreamReader(limit=self.reader_limit)
+            protocol = asyncio.StreamReaderProtocol(reader)
+
+            start = time.perf_counter()
+            try:
+                tls_transport = await loop.start_tls(
+                    transport,
+                    protocol,
+                    self._ssl_context,
+                    server_side=True,
+                    ssl_handshake_timeout=self.handshake_timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                self.handshake_stats.failed += 1
+                log.debug(f'TLS handshake on {self} failed: {e!r}')
+                transport.close()
+                return
+
+            duration = time.perf_counter() - start
+
+        if tls_transport.get_extra_info('ssl_object').session_reused:
+            self.handshake_stats.resumed += 1
+            self.handshake_stats.resumed_time += duration
+        else:
+            self.handshake_stats.full += 1
+            self.handshake_stats.full_time += duration
+
+        # start_tls leaves it to the caller to tell the protocol about the new transport
+        protocol.connection_made(tls_transport)
+        writer = asyncio.StreamWriter(tls_transport, protocol, reader, loop)
+
+        await handle_connection(reader, writer)
+
+    def configure_connection(self, writer: asyncio.StreamWriter):
+        """Applies the settings that are not inherited from the listening socket to an accepted connection."""
+
+        # asyncio enables TCP_NODELAY on every TCP connection
+        if not self.is_unix and not self.tcp_nodelay:
+            sock = writer.get_extra_info('socket')
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+
+    def matches(self, sock: socket.socket) -> bool:
+        """Checks if a listening socket, e.g. one handed over by a previous process, is bound to this address."""
+
+        if sock.family == socket.AF_UNIX:
+            return self.is_unix and sock.getsockname() == os.path.expanduser(self.path)
+
+        return not self.is_unix and sock.getsockname()[1] == self.port
+
+    def _remove_stale_socket(self):
+        """Removes a socket file left behind by a server that is not running anymore."""
+
+        path = os.path.expanduser(self.path)
+        if not os.path.exists(path):
+            return
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path)
+            else:
+                raise OSError(f'Another server is listening on {path}')
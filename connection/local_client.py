@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Iterable
+
+from messages import Header, PublishMessage
+from messages.structs import split_topic_name
+from .constants import MessageType
+
+if TYPE_CHECKING:
+    from .server import Server
+
+
+log = logging.getLogger(__name__)
+
+
+class LocalClient:
+    """
+    Client running in the same process as the broker. \\
+    Messages are routed like the ones of network clients, without framing, encoding or sockets:
+    published messages are injected into the topic manager and the subscribed messages are delivered
+    to an async iterator. Rate limits, scheduling and flow control apply the same way.
+
+    Example::
+
+        client = server.connect_local('ingest')
+        await client.subscribe('sensors/#')
+        async for message in client:
+            print(message.topic_name, message.payload)
+    """
+
+    def __init__(self, server: 'Server', client_id: str, user_name: str | None = None):
+        self.server = server
+        self._client_id = client_id
+        self._user_name = user_name
+        self._address = f'local:{client_id}'
+        self._closed = False
+
+        self._queue: asyncio.Queue[PublishMessage | None] = asyncio.Queue()
+        self._queued_size = 0
+
+    async def publish(self, topic: str | bytes, payload: bytes, qos: int = 0, retain: bool = False):
+        """
+        Publishes a message. Waits if the client is rate limited or the subscribers of the topic are congested.
+        :raises ValueError: when the topic is not a valid topic name
+        """
+
+        message = self._create_message(topic, payload, qos, retain)
+        await self._route(message)
+        await self.server.flow_control.throttle(self, message.topic)
+
+    async def publish_many(
+        self,
+        messages: Iterable[tuple[str | bytes, bytes]],
+        qos: int = 0,
+        retain: bool = False
+    ):
+        """
+        Publishes (topic, payload) pairs in order, flow control is only waited for once the whole batch is routed.
+        :raises ValueError: when a topic is not a valid topic name, the messages before it are published
+        """
+
+        topics = dict()
+        for topic, payload in messages:
+            message = self._create_message(topic, payload, qos, retain)
+            await self._route(message)
+            topics[message.topic] = None
+
+        for topic in topics:
+            await self.server.flow_control.throttle(self, topic)
+
+    def _create_message(self, topic: str | bytes, payload: bytes, qos: int, retain: bool) -> PublishMessage:
+        if self._closed:
+            raise ConnectionError(f'Local client {self._client_id} is closed')
+
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if split_topic_name(topic) is None:
+            raise ValueError(f'Invalid topic name: {topic.decode()}')
+
+        return PublishMessage(
+            Header(MessageType.PUBLISH, 0, qos, retain),
+            topic,
+            self.server.get_next_message_id() if qos else None,
+            bytes(payload)
+        )
+
+    async def _route(self, message: PublishMessage):
+        if not await self.server.rate_limiter.acquire(self, message):
+            raise ConnectionError(f'Local client {self._client_id} exceeded its rate limit')
+
+        await self.server.route(message, self._client_id)
+        await self.server.scheduler.charge(self, message)
+
+    async def subscribe(self, topic_structure: str, qos: int = 0):
+        """Subscribes to every topic matching the structure, retained messages are delivered right away."""
+
+        await self.server.topic_manager.subscribe_to_topic(topic_structure, self, qos)
+
+    def unsubscribe(self, topic_structure: str):
+        """Unsubscribes from every topic matching the structure. Raises Warning when no topic matched"""
+
+        self.server.topic_manager.unsubscribe_from_topic(topic_structure, self)
+
+    async def notify(self, message: PublishMessage):
+        """
+        Queues a message for the iterator, the queue is kept in check by the server's flow control. \
+        A message routed on another event loop is handed over to the loop of the server.
+        """
+
+        mailbox = self.server.mailbox
+        if mailbox is not None and not mailbox.is_current():
+            mailbox.post(self._deliver, message)
+        else:
+            self._deliver(message)
+
+    def _deliver(self, message: PublishMessage):
+        if self._closed:
+            return
+
+        size = message.frame_size()
+        self._queued_size += size
+        self._queue.put_nowait(message)
+        self.server.flow_control.charge(self, message.topic, size)
+        if self.server.traffic is not None:
+            self.server.traffic.record_out(message.topic, self._client_id, message.payload_length)
+
+    async def notify_many(self, messages: list[PublishMessage]):
+        for message in messages:
+            await self.notify(message)
+
+    def __aiter__(self) -> 'LocalClient':
+        return self
+
+    async def __anext__(self) -> PublishMessage:
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                raise StopAsyncIteration
+
+            size = message.frame_size()
+            self._queued_size -= size
+            # Messages that expired while waiting to be iterated over are skipped
+            if message.expires_at is None or not message.is_expired(time.monotonic()):
+                return message
+
+            self.server.expiry.count((1, size))
+
+    def pending_size(self) -> int:
+        """Gets the size of the messages delivered but not iterated over yet."""
+
+        return self._queued_size
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+    @property
+    def address(self) -> str:
+        return self._address
+
+    @property
+    def client_id(self) -> str:
+        return self._client_id
+
+    @property
+    def user_name(self) -> str | None:
+        return self._user_name
+
+    def close(self):
+        """Drops the subscriptions of the client and ends the iteration once the queued messages are consumed."""
+
+        if self._closed:
+            return
+
+        self._closed = True
+        self.server.topic_manager.clear_session(self)
+        self.server.scheduler.forget(self)
+        self.server.flow_control.forget(self)
+        self.server.rate_limiter.forget(self)
+
+        self._queue.put_nowait(None)
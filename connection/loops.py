@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import sys
+import threading
+from collections import deque
+from dataclasses import replace
+from functools import partial
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Coroutine
+
+import config
+from messages import PublishMessage
+from messages.buffer_pool import BufferPool
+from .batching import PublishBatcher
+from .expiry import ExpirySweeper
+from .flow_control import FlowController
+from .heavy_hitters import TrafficBuffer
+from .listener import Listener
+from .memory import MemoryAccountant
+from .scheduler import IngressScheduler
+
+if TYPE_CHECKING:
+    from .client import Client
+    from .server import Server
+
+
+log = logging.getLogger(__name__)
+
+# Seconds between merges of the traffic counted by a worker into the heavy hitters of the server
+TRAFFIC_MERGE_INTERVAL = 1.0
+
+
+def is_free_threaded() -> bool:
+    """Checks if the interpreter runs without the global interpreter lock, e.g. python3.13t."""
+
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+class Mailbox:
+    """
+    Handoff queue of the callbacks other threads want to run on an event loop, e.g. deliveries to its clients. \\
+    Appending to and popping from a deque are atomic, so callbacks are handed over without a lock. The loop is only
+    woken up with call_soon_threadsafe when the mailbox is not scheduled already, and runs every callback it finds
+    in one go, so a burst of deliveries costs a single wake-up.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        """
+        :param loop: loop the callbacks run on, the mailbox has to be created on the thread running it
+        """
+
+        self.loop = loop
+        self._thread = threading.get_ident()
+        self._callbacks: deque[tuple[Callable, tuple]] = deque()
+        self._scheduled = False
+
+        self.wake_ups = 0
+        self.handed_over = 0
+
+    def __len__(self) -> int:
+        return len(self._callbacks)
+
+    def is_current(self) -> bool:
+        """Checks if the caller runs on the loop of the mailbox."""
+
+        return threading.get_ident() == self._thread
+
+    def post(self, callback: Callable, *args):
+        """Runs the callback on the loop of the mailbox, from any thread."""
+
+        self._callbacks.append((callback, args))
+
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon_threadsafe(self._run)
+
+    def call(self, callback: Callable, *args):
+        """Runs the callback right away on the loop of the mailbox, from other threads it is posted."""
+
+        if threading.get_ident() == self._thread:
+            callback(*args)
+        else:
+            self.post(callback, *args)
+
+    def run(self, coroutine: Coroutine) -> Awaitable:
+        """Runs a coroutine on the loop of the mailbox, its result can be awaited on any loop."""
+
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+    def _run(self):
+        # Cleared before running, a callback posted from now on schedules another run unless this one picks it up
+        self._scheduled = False
+        self.wake_ups += 1
+
+        callbacks = self._callbacks
+        count = len(callbacks)
+        self.handed_over += count
+
+        for _ in range(count):
+            callback, args = callbacks.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                log.exception(f'Callback {callback} handed over to another event loop failed')
+
+    def __str__(self) -> str:
+        return f'{self.handed_over} callbacks handed over in {self.wake_ups} wake-ups, {len(self)} waiting'
+
+
+class LoopBound:
+    """Calls the methods of an object owned by an event loop from any thread, through the mailbox of the loop."""
+
+    def __init__(self, target: Any, mailbox: Mailbox):
+        self._target = target
+        self._mailbox = mailbox
+
+    def __getattr__(self, name: str) -> Callable:
+        return partial(self._mailbox.call, getattr(self._target, name))
+
+
+async def relieve_mailboxes(mailboxes: list[Mailbox]):
+    """Waits while the mailbox of another event loop holds more than MAILBOX_HIGH_WATER, until it is relieved."""
+
+    for mailbox in mailboxes:
+        if len(mailbox) > config.MAILBOX_HIGH_WATER:
+            while len(mailbox) > config.MAILBOX_LOW_WATER:
+                await asyncio.sleep(config.FLOW_CONTROL_POLL_INTERVAL)
+
+
+def create_loop_state(context: 'Server | LoopWorker', server: 'Server', loops: int):
+    """
+    Sets the state bound to the connections of an event loop on its context, the server or one of its workers.
+    The broker-wide limits of flow control and memory are shared out between the loops.
+    """
+
+    context.flow_control = FlowController(
+        config.BROKER_HIGH_WATER // loops,
+        config.BROKER_LOW_WATER // loops,
+        config.TOPIC_HIGH_WATER,
+        config.TOPIC_LOW_WATER,
+        config.FLOW_CONTROL_POLL_INTERVAL
+    )
+    context.memory = MemoryAccountant(
+        config.MEMORY_SOFT_LIMIT // loops,
+        config.MEMORY_HARD_LIMIT // loops,
+        context.flow_control
+    )
+    context.scheduler = IngressScheduler(
+        config.SCHEDULER_MESSAGE_BUDGET,
+        config.SCHEDULER_BYTE_BUDGET,
+        config.SCHEDULER_WEIGHTS
+    )
+    context.expiry = ExpirySweeper(config.EXPIRY_SWEEP_INTERVAL)
+    context.batcher = None
+    if server.batch_window is not None:
+        context.batcher = PublishBatcher(server.topic_manager, server.batch_window, config.PUBLISH_BATCH_SIZE)
+    context.buffer_pool = BufferPool()
+
+
+class LoopWorker:
+    """
+    Event loop of a server running several of them, in a thread of its own. \\
+    The worker accepts connections on the listening sockets of the server, next to the other loops, and owns
+    the state bound to the connections it serves: flow control, memory accounting, scheduling, expiry of queued
+    messages and batching. Its clients use it in place of the server, the topics and subscriptions, sessions,
+    rate limits and authentication are the server's. Messages for clients of other loops are handed over
+    through their mailboxes.
+    """
+
+    def __init__(self, server: 'Server', index: int, loops: int):
+        self.server = server
+        self.index = index
+
+        self.topic_manager = server.topic_manager
+        self.rate_limiter = server.rate_limiter
+        self.payload_store = server.payload_store
+        self.max_packet_size = server.max_packet_size
+        self.receive_maximum = server.receive_maximum
+        self.topic_alias_maximum = server.topic_alias_maximum
+        self.streaming_threshold = server.streaming_threshold
+        self.streaming_chunk_size = server.streaming_chunk_size
+        self.bridge_client_ids = server.bridge_client_ids
+        self.capture = None
+        self.traffic = TrafficBuffer() if server.traffic is not None else None
+        create_loop_state(self, server, loops)
+
+        self.mailbox: Mailbox | None = None
+        # Mailboxes of the other loops, set once every loop has started
+        self.mailboxes: list[Mailbox] = []
+        self.connections = 0
+        self._listeners: list[Listener] = []
+        self._thread: threading.Thread | None = None
+        self._started = threading.Event()
+        self._stopped: asyncio.Event | None = None
+
+    def __str__(self) -> str:
+        return f'event loop {self.index}'
+
+    @property
+    def auth_module(self):
+        return self.server.auth_module
+
+    def get_next_message_id(self) -> int:
+        return self.server.get_next_message_id()
+
+    async def take_over_session(self, client: 'Client'):
+        await self.server.take_over_session(client)
+
+    async def route(self, message: PublishMessage, owner: str | None):
+        """Routes a received PUBLISH message like Server.route."""
+
+        if self.batcher is None:
+            await self.topic_manager.publish(message, owner)
+        else:
+            await self.batcher.route(message, owner)
+
+        await relieve_mailboxes(self.mailboxes)
+
+    def start(self, sockets: list[tuple[Listener, list]]):
+        """
+        Starts the thread of the worker and waits until it accepts connections.
+        :param sockets: listeners of the server with their listening sockets, the worker accepts from duplicates
+        """
+
+        self._thread = threading.Thread(target=self._run, args=(sockets,), name=f'mqtt-loop-{self.index}', daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+        if self.mailbox is None or not self._thread.is_alive():
+            raise RuntimeError(f'Could not start {self}')
+
+    def stop(self):
+        """Stops the loop of the worker, from any thread, and waits until its thread ends."""
+
+        if self._stopped is not None:
+            self.mailbox.loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+
+    def _run(self, sockets: list[tuple[Listener, list]]):
+        try:
+            asyncio.run(self._serve(sockets))
+        finally:
+            # The server must not wait forever for a worker that could not start
+            self._started.set()
+
+    async def _serve(self, sockets: list[tuple[Listener, list]]):
+        self._stopped = asyncio.Event()
+        self.mailbox = Mailbox(asyncio.get_running_loop())
+        self.topic_manager.register_loop(self.traffic)
+
+        servers = []
+        for listener, listening_sockets in sockets:
+            for sock in listening_sockets:
+                # Listeners keep the state of their TLS handshakes, which is bound to a loop
+                own_listener = replace(listener)
+                handle_connection = partial(self.server._handle_connection, own_listener, context=self)
+                servers.append(await own_listener.start(handle_connection, sock.dup()))
+                self._listeners.append(own_listener)
+
+        background_tasks = [asyncio.create_task(self.expiry.sweep_periodically())]
+        if self.traffic is not None:
+            background_tasks.append(asyncio.create_task(self._merge_traffic_periodically()))
+
+        self._started.set()
+
+        try:
+            await self._stopped.wait()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
+            for server in servers:
+                server.close()
+
+    async def _merge_traffic_periodically(self):
+        """Hands the traffic counted on this loop over to the heavy hitters of the server."""
+
+        while True:
+            await asyncio.sleep(TRAFFIC_MERGE_INTERVAL)
+            self.server.mailbox.post(self.server.traffic.merge, self.traffic.take())
+
+    def log_stats(self):
+        """Logs the statistics of the connections of the loop, to be run on it."""
+
+        log.info(f'Event loop {self.index}: {self.connections} connections accepted, mailbox: {self.mailbox}')
+        self.scheduler.log_stats()
+        self.scheduler.reset_stats()
+        self.memory.log_usage()
+        log.info(f'Message expiry on event loop {self.index}: {self.expiry}')
+
+        for listener in self._listeners:
+            if listener.is_tls:
+                log.info(f'TLS handshakes on {listener}, event loop {self.index}: {listener.handshake_stats}')
@@ -0,0 +1,144 @@
+import heapq
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .client import Client
+    from .flow_control import FlowController
+
+
+log = logging.getLogger(__name__)
+
+
+class MemoryAccountant:
+    """
+    Accounts for the memory used by messages the broker holds on to: messages queued for clients,
+    retained messages and data waiting in clients' transports.
+
+    Every queued or retained message is charged to its owner (client identifier) and its topic.
+    Above the soft limit queued messages get dropped, QoS 0 messages first, then the oldest message of the
+    client using the most memory. Above the hard limit new connections are refused.
+    """
+
+    def __init__(self, soft_limit: int, hard_limit: int, flow_control: 'FlowController', shed_ratio: float = 0.9):
+        """
+        :param soft_limit: bytes above which queued messages are dropped
+        :param hard_limit: bytes above which new connections are refused
+        :param flow_control: flow control tracking data written to transports but not sent yet, and queued data
+            already charged here
+        :param shed_ratio: once shedding starts, messages are dropped until usage is below soft_limit * shed_ratio
+        """
+
+        self._soft_limit = soft_limit
+        self._hard_limit = hard_limit
+        self._flow_control = flow_control
+        self._shed_target = int(soft_limit * shed_ratio)
+
+        self.charged = 0
+        self.shed_messages = 0
+        self.shed_bytes = 0
+        self._owners: dict[str, int] = dict()
+        self._topics: dict[bytes, int] = dict()
+        self._queues: set['Client'] = set()
+
+    @property
+    def usage(self) -> int:
+        """Bytes held by queued and retained messages and by transports, each of them counted once."""
+
+        return self.charged + self._flow_control.transport_backlog
+
+    def is_over_hard_limit(self) -> bool:
+        return self.usage > self._hard_limit
+
+    def charge(self, owner: str | None, topic: bytes, size: int):
+        """Charges a message held by the broker to its owner and topic, None if it has no owning client."""
+
+        self.charged += size
+        if owner is not None:
+            self._owners[owner] = self._owners.get(owner, 0) + size
+        self._topics[topic] = self._topics.get(topic, 0) + size
+
+        if self.usage > self._soft_limit:
+            self._shed()
+
+    def release(self, owner: str | None, topic: bytes, size: int):
+        """Releases a message charged with charge."""
+
+        self.charged -= size
+        if owner is not None:
+            self._release(self._owners, owner, size)
+        self._release(self._topics, topic, size)
+
+    @staticmethod
+    def _release(usage: dict, key, size: int):
+        remaining = usage[key] - size
+        if remaining > 0:
+            usage[key] = remaining
+        else:
+            del usage[key]
+
+    def track_queue(self, client: 'Client'):
+        """Registers a client whose queued messages may be dropped."""
+
+        self._queues.add(client)
+
+    def untrack_queue(self, client: 'Client'):
+        self._queues.discard(client)
+
+    def usage_by_client(self) -> dict[str, int]:
+        """Gets the bytes charged to every client, by client identifier."""
+
+        return dict(self._owners)
+
+    def usage_by_topic(self) -> dict[str, int]:
+        """Gets the bytes charged to every topic, by topic name."""
+
+        return {topic.decode(): size for topic, size in self._topics.items()}
+
+    def log_usage(self, count: int = 5):
+        """Logs the total memory usage and the clients and topics using the most."""
+
+        log.info(f'Memory usage: {self.usage} bytes, {self.charged} in queued and retained messages, '
+                 f'{self.shed_messages} messages ({self.shed_bytes} bytes) dropped')
+
+        for owner, size in sorted(self._owners.items(), key=lambda item: item[1], reverse=True)[:count]:
+            log.info(f'Memory usage of client {owner}: {size} bytes')
+
+        for topic, size in sorted(self._topics.items(), key=lambda item: item[1], reverse=True)[:count]:
+            log.info(f'Memory usage of topic {topic.decode()}: {size} bytes')
+
+    def _shed(self):
+        """Drops queued messages until the usage is back under the target."""
+
+        # Retained messages and unsent data can't be dropped
+        if not self._queues:
+            return
+
+        usage = self.usage
+        shed_messages = self.shed_messages
+        clients = sorted(self._queues, key=lambda client: client.queued_size, reverse=True)
+
+        for client in clients:
+            if self.usage <= self._shed_target:
+                break
+
+            self._count_shed(client.shed_qos0())
+
+        # Repeatedly drop the oldest message of the client with the largest queue
+        heap = [(-client.queued_size, index, client) for index, client in enumerate(clients) if client.queued_size]
+        heapq.heapify(heap)
+
+        while heap and self.usage > self._shed_target:
+            _, index, client = heapq.heappop(heap)
+            self._count_shed(client.shed_oldest())
+
+            if client.queued_size:
+                heapq.heappush(heap, (-client.queued_size, index, client))
+
+        log.warning(f'Memory usage of {usage} bytes exceeded the soft limit, dropped '
+                    f'{self.shed_messages - shed_messages} queued messages, now {self.usage} bytes')
+
+    def _count_shed(self, dropped: tuple[int, int]):
+        messages, size = dropped
+        self.shed_messages += messages
+        self.shed_bytes += size
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from authentication.user import RateLimit
+from messages import PublishMessage
+
+if TYPE_CHECKING:
+    from .client import Client
+
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled lazily from the time elapsed since it was last used, so idle clients cost no timers.
+    Taking more tokens than available leaves the bucket in debt, which is paid off by the refill.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def take(self, amount: float, now: float) -> float:
+        """
+        Takes tokens from the bucket.
+        :return: seconds until the bucket is out of debt, 0 if there were enough tokens
+        """
+
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self.tokens -= amount
+
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class _Buckets:
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.messages = None
+        self.bytes = None
+
+        if limit.messages_per_second is not None:
+            self.messages = TokenBucket(limit.messages_per_second, limit.message_burst)
+        if limit.bytes_per_second is not None:
+            self.bytes = TokenBucket(limit.bytes_per_second, limit.byte_burst)
+
+    def take(self, size: int, now: float) -> float:
+        """
+        Takes a message of the given size from the buckets.
+        :return: seconds to wait until the limit is respected again
+        """
+
+        delay = 0.0
+        if self.messages is not None:
+            delay = self.messages.take(1, now)
+        if self.bytes is not None:
+            delay = max(delay, self.bytes.take(size, now))
+
+        return delay
+
+
+class RateLimiter:
+    """
+    Limits the PUBLISH messages and bytes per second of every client connection and of every user,
+    with token buckets allowing short bursts.
+    A client exceeding a limit is either throttled, by delaying the reads from its connection, or disconnected.
+    """
+
+    def __init__(self, client_limit: RateLimit | None, user_limits: dict[str, RateLimit]):
+        """
+        :param client_limit: limit of every client connection, None for no limit
+        :param user_limits: limits shared by all connections of a user, by user name
+        """
+
+        self._client_limit = client_limit
+        self._user_limits = user_limits
+        self._client_buckets: dict['Client', _Buckets] = dict()
+        self._user_buckets: dict[str, _Buckets] = dict()
+
+        self.throttled = 0
+        self.disconnected = 0
+
+    def _buckets(self, client: 'Client') -> list[_Buckets]:
+        buckets = []
+
+        if self._client_limit is not None:
+            client_buckets = self._client_buckets.get(client)
+            if client_buckets is None:
+                client_buckets = self._client_buckets[client] = _Buckets(self._client_limit)
+            buckets.append(client_buckets)
+
+        user_limit = self._user_limits.get(client.user_name)
+        if user_limit is not None:
+            user_buckets = self._user_buckets.get(client.user_name)
+            if user_buckets is None:
+                user_buckets = self._user_buckets[client.user_name] = _Buckets(user_limit)
+            buckets.append(user_buckets)
+
+        return buckets
+
+    async def acquire(self, client: 'Client', message: PublishMessage) -> bool:
+        """
+        Charges a PUBLISH message to the client and its user, waits if the client is throttled.
+        :return: False if the client exceeded a limit and has to be disconnected
+        """
+
+        delay = self._charge(client, message.payload_length)
+        if delay is None:
+            return False
+
+        if delay:
+            log.debug(f'Throttling {client.address} for {delay * 1000:.1f} ms')
+            await asyncio.sleep(delay)
+
+        return True
+
+    def _charge(self, client: 'Client', size: int) -> float | None:
+        """
+        Takes a message of the given size from the buckets of the client and its user.
+        :return: seconds the client has to wait, None if it has to be disconnected
+        """
+
+        buckets = self._buckets(client)
+        if not buckets:
+            return 0.0
+
+        now = time.monotonic()
+        delay = 0.0
+
+        for client_buckets in buckets:
+            wait = client_buckets.take(size, now)
+            if wait and client_buckets.limit.disconnect:
+                self.disconnected += 1
+                return None
+
+            delay = max(delay, wait)
+
+        if delay:
+            self.throttled += 1
+
+        return delay
+
+    def forget(self, client: 'Client'):
+        """Drops the buckets of a client that is gone, buckets of its user are kept."""
+
+        self._client_buckets.pop(client, None)
+
+
+class ConcurrentRateLimiter(RateLimiter):
+    """
+    RateLimiter shared by the event loops of a server running several of them.
+    Connections of a user may be served on different loops, so the buckets are charged under a lock.
+    """
+
+    def __init__(self, client_limit: RateLimit | None, user_limits: dict[str, RateLimit]):
+        super().__init__(client_limit, user_limits)
+        self._lock = threading.Lock()
+
+    def _charge(self, client: 'Client', size: int) -> float | None:
+        with self._lock:
+            return super()._charge(client, size)
+
+    def forget(self, client: 'Client'):
+        with self._lock:
+            super().forget(client)
@@ -1,16 +1,27 @@
 import asyncio
 from io import BytesIO
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 
-from connection.constants import MessageType
-from exceptions.connection import GracePeriodExceededError, MalformedPacketError
+from connection.constants import MessageType, MAXIMUM_PACKET_SIZE, MQTT5_PROTOCOL_VERSION, PROTOCOL_VERSION
+from exceptions.connection import GracePeriodExceededError, MalformedPacketError, PacketTooLargeError
 from messages.header import Header
-from messages.structs import read_remaining_length
+from messages.stream import PayloadStream
+from messages.structs import BYTE_ORDER, pack_remaining_length, read_remaining_length, remaining_length_size
 
 if TYPE_CHECKING:
     from messages import Message
 
 
+if hasattr(asyncio, 'timeout'):
+    async def _wait_for(awaitable, timeout: float | None):
+        # Unlike wait_for before Python 3.12, it does not wrap the awaitable in a task of its own,
+        # which is held by every idle connection
+        async with asyncio.timeout(timeout):
+            return await awaitable
+else:
+    _wait_for = asyncio.wait_for
+
+
 class AbstractHandler:
     _next_handler: 'AbstractHandler' = None
 
@@ -32,41 +43,117 @@ class AbstractHandler:
 
 
 class HeaderHandler(AbstractHandler):
+    def __init__(self, on_header: Callable[[], None] | None = None):
+        # Called once the first byte of a packet has been consumed from the reader
+        self._on_header = on_header
+
     async def process(self, reader: asyncio.StreamReader, keep_alive: int = None):
         grace_period = int(keep_alive * 1.5) if keep_alive else None
 
         try:
-            buffer = await asyncio.wait_for(reader.readexactly(1), grace_period)
+            buffer = await _wait_for(reader.readexactly(1), grace_period)
         except asyncio.TimeoutError:
             raise GracePeriodExceededError('No message from client within 1.5 x keep alive')
 
+        if self._on_header is not None:
+            self._on_header()
+
         return reader, Header.from_bytes(buffer)
 
 
 class RemainingLengthHandler(AbstractHandler):
+    def __init__(self, max_packet_size: int | None = None):
+        self._max_packet_size = max_packet_size or MAXIMUM_PACKET_SIZE
+
     async def process(self, reader: asyncio.StreamReader, header: Header):
         remaining_length = await read_remaining_length(reader)
 
+        # Reject the packet before anything of its body is read
+        packet_size = 1 + remaining_length_size(remaining_length) + remaining_length
+        if packet_size > self._max_packet_size:
+            raise PacketTooLargeError(f'Packet of {packet_size} bytes exceeds maximum packet size')
+
         return reader, header, remaining_length
 
 
 class DataHandler(AbstractHandler):
+    def __init__(
+        self,
+        streaming_threshold: int | None = None,
+        chunk_size: int | None = None,
+        capture: Callable[..., None] | None = None,
+        protocol_version: int = PROTOCOL_VERSION
+    ):
+        # PUBLISH packets above the threshold are not buffered, their payload is read in chunks while delivered
+        self._streaming_threshold = streaming_threshold
+        self._chunk_size = chunk_size
+        # Gets the bytes of the frame, the fixed header is packed again from the parsed values
+        self._capture = capture
+        # MQTT 5 PUBLISH packets have properties in their variable header
+        self._protocol_version = protocol_version
+
     async def process(self, reader: asyncio.StreamReader, header: Header, remaining_length: int):
         try:
+            if self._is_streamed(header, remaining_length):
+                return await self._read_streamed(reader, header, remaining_length)
+
             data = await reader.readexactly(remaining_length)
         except asyncio.IncompleteReadError:
             raise MalformedPacketError('Data incomplete')
 
-        return header, data
+        if self._capture is not None:
+            self._capture(DataHandler._pack_fixed_header(header, remaining_length), data)
+
+        return header, data, None
+
+    @staticmethod
+    def _pack_fixed_header(header: Header, remaining_length: int) -> bytes:
+        return bytes([header.to_int()]) + pack_remaining_length(remaining_length)
+
+    def _is_streamed(self, header: Header, remaining_length: int) -> bool:
+        # Retained messages are kept by the topic, so they have to be buffered anyway
+        return (
+            self._streaming_threshold is not None
+            and header.message_type == MessageType.PUBLISH
+            and not header.retain
+            and remaining_length > self._streaming_threshold
+        )
+
+    async def _read_streamed(self, reader: asyncio.StreamReader, header: Header, remaining_length: int):
+        """Reads only the variable header of a PUBLISH packet and leaves the payload in the reader."""
+
+        topic_length = await reader.readexactly(2)
+        variable_header = topic_length + await reader.readexactly(int.from_bytes(topic_length, BYTE_ORDER))
+        if header.qos > 0:
+            variable_header += await reader.readexactly(2)
+        if self._protocol_version == MQTT5_PROTOCOL_VERSION:
+            properties_length = await read_remaining_length(reader)
+            variable_header += pack_remaining_length(properties_length) + await reader.readexactly(properties_length)
+
+        payload_length = remaining_length - len(variable_header)
+        if payload_length < 0:
+            raise MalformedPacketError('Variable header exceeds remaining length')
+
+        if self._capture is not None:
+            self._capture(DataHandler._pack_fixed_header(header, remaining_length), variable_header)
+
+        return header, variable_header, PayloadStream(reader, payload_length, self._chunk_size, self._capture)
 
 
 class MessageHandler(AbstractHandler):
-    async def process(self, header: Header, data: bytes):
+    def __init__(self, protocol_version: int = PROTOCOL_VERSION):
+        self._protocol_version = protocol_version
+
+    async def process(self, header: Header, data: bytes, payload_stream: PayloadStream | None = None):
         _class = get_message_class(header.message_type)
         if _class is None:
             raise MalformedPacketError('Invalid message type')
 
-        return _class.from_data(header, BytesIO(data))
+        message = _class.from_data(header, BytesIO(data), self._protocol_version)
+        if payload_stream is not None:
+            message.payload_stream = payload_stream
+
+        return message
 
 
 def get_message_class(message_type: MessageType) -> type['Message']:
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from messages import Message, PublishMessage
+
+if TYPE_CHECKING:
+    from .client import Client
+
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class SchedulingStats:
+    """Time a client waited for its turn after yielding the event loop to other connections."""
+
+    yields: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.yields if self.yields else 0.0
+
+
+@dataclass
+class _Budget:
+    weight: float
+    messages: int = 0
+    bytes: int = 0
+
+
+class IngressScheduler:
+    """
+    Shares the event loop fairly between connections.
+
+    Reading a buffered packet does not suspend a coroutine, so a client sending a burst of messages
+    would otherwise be served until its buffer is empty. Every connection gets a budget of messages and
+    PUBLISH payload bytes per turn, scaled by its weight; once it is used, the connection yields to the others.
+    """
+
+    def __init__(self, message_budget: int, byte_budget: int, weights: dict[str, float] | None = None):
+        """
+        :param message_budget: messages a connection with weight 1 handles before yielding
+        :param byte_budget: PUBLISH payload bytes a connection with weight 1 handles before yielding
+        :param weights: weights by client identifier or user name, a client identifier takes precedence
+        """
+
+        self._message_budget = message_budget
+        self._byte_budget = byte_budget
+        self._weights = weights or dict()
+        self._budgets: dict['Client', _Budget] = dict()
+        self._stats: dict['Client', SchedulingStats] = dict()
+
+    def _weight(self, client: 'Client') -> float:
+        weight = self._weights.get(client.client_id)
+        if weight is None:
+            weight = self._weights.get(client.user_name, 1.0)
+
+        return weight
+
+    async def charge(self, client: 'Client', message: Message):
+        """Charges a handled message to the client and yields to other connections once its budget is used."""
+
+        budget = self._budgets.get(client)
+        if budget is None:
+            budget = self._budgets[client] = _Budget(self._weight(client))
+
+        budget.messages += 1
+        if isinstance(message, PublishMessage):
+            budget.bytes += message.payload_length
+
+        if (budget.messages < self._message_budget * budget.weight
+                and budget.bytes < self._byte_budget * budget.weight):
+            return
+
+        budget.messages = 0
+        budget.bytes = 0
+
+        start = time.perf_counter()
+        await asyncio.sleep(0)
+        latency = time.perf_counter() - start
+
+        stats = self._stats.get(client)
+        if stats is None:
+            stats = self._stats[client] = SchedulingStats()
+
+        stats.yields += 1
+        stats.total_latency += latency
+        stats.max_latency = max(stats.max_latency, latency)
+
+    def forget(self, client: 'Client'):
+        """Drops the budget and statistics of a client that is gone."""
+
+        self._budgets.pop(client, None)
+        self._stats.pop(client, None)
+
+    def stats(self) -> dict[str, SchedulingStats]:
+        """Gets the scheduling latency of every client that had to yield, by client address."""
+
+        return {client.address: stats for client, stats in self._stats.items()}
+
+    def reset_stats(self):
+        self._stats.clear()
+
+    def log_stats(self, count: int = 5):
+        """Logs the clients that waited the longest for their turn."""
+
+        worst = sorted(self._stats.items(), key=lambda item: item[1].max_latency, reverse=True)[:count]
+        for client, stats in worst:
+            log.info(
+                f'Scheduling latency of {client.address}: '
+                f'{stats.yields} yields, mean {stats.mean_latency * 1000:.3f} ms, max {stats.max_latency * 1000:.3f} ms'
+            )
@@ -1,11 +1,30 @@
 import asyncio
+import itertools
+import json
 import logging
+import os
+import socket
 import sys
+import threading
 import traceback
+from dataclasses import asdict
+from functools import partial
 
+import config
 from authentication.auth import Auth
-from processing import TopicManager
+from messages import Header, PublishMessage
+from messages.payload_store import ConcurrentPayloadStore, PayloadStore
+from processing import ConcurrentTopicManager, TopicManager
+from .bridge import Bridge
+from .capture import TrafficCapture
 from .client import Client
+from .constants import MessageType
+from .heavy_hitters import TrafficStats
+from .handoff import Handoff, create_handoff_socket, request_handoff, send_handoff, HANDOFF_REQUEST
+from .listener import Listener
+from .local_client import LocalClient
+from .loops import LoopBound, LoopWorker, Mailbox, create_loop_state, is_free_threaded, relieve_mailboxes
+from .rate_limit import ConcurrentRateLimiter, RateLimiter
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -18,80 +37,576 @@ log = logging.getLogger(__name__)
 
 
 class Server:
-    def __init__(self, auth: bool):
+    def __init__(
+        self,
+        auth: bool,
+        hot_restart: bool = False,
+        handoff_clients: bool = True,
+        max_packet_size: int = config.MAXIMUM_PACKET_SIZE,
+        streaming_threshold: int | None = config.STREAMING_THRESHOLD,
+        batch_window: float | None = config.PUBLISH_BATCH_WINDOW,
+        listeners: list[Listener] | None = None,
+        bridges: list[Bridge] | None = None,
+        capture_path: str | None = config.CAPTURE_PATH,
+        loops: int = config.EVENT_LOOPS
+    ):
+        """
+        :param auth: True if clients of the default listener have to authenticate
+        :param hot_restart: True to take over sockets and state from a running server, if any,
+            and to hand them over to the next process started with hot restart
+        :param handoff_clients: True to hand over live client connections and sessions too, not just the listener
+        :param max_packet_size: packets larger than this are rejected and the client is disconnected
+        :param streaming_threshold: PUBLISH payloads larger than this are forwarded to subscribers in chunks
+            while they are being read, None to always buffer the whole packet
+        :param batch_window: seconds during which received PUBLISH messages are collected to be routed together,
+            0 to collect the messages of a single event loop iteration, None to route every message on its own
+        :param listeners: TCP and Unix domain socket addresses to accept connections on, with their settings,
+            localhost:1883 by default, or localhost:1884 with auth
+        :param bridges: peer brokers to subscribe to, the messages they forward are published to local subscribers
+        :param capture_path: file to record the frames received from clients to, None to not capture them
+        :param loops: event loops serving the connections, each in a thread of its own, see LoopWorker.
+            Hot restart, traffic capture and streamed payloads need a single loop
+        """
+
+        if max_packet_size <= 0:
+            raise ValueError('Maximum packet size must be positive')
+        if loops < 1:
+            raise ValueError('At least one event loop is needed')
+        if loops > 1 and (hot_restart or capture_path is not None):
+            raise ValueError('Hot restart and traffic capture need a single event loop')
+
+        self.max_packet_size = max_packet_size
+        self.receive_maximum = config.RECEIVE_MAXIMUM
+        self.topic_alias_maximum = config.TOPIC_ALIAS_MAXIMUM
+        # A streamed payload is written to the subscribers' transports by the publisher's loop
+        self.streaming_threshold = streaming_threshold if loops == 1 else None
+        self.streaming_chunk_size = config.STREAMING_CHUNK_SIZE
+        self.bridge_client_ids = frozenset(config.BRIDGE_CLIENT_IDS)
+        self.batch_window = batch_window
+        # Shared by the loops, whose connections may belong to the same user
+        self.rate_limiter = (RateLimiter if loops == 1 else ConcurrentRateLimiter)(
+            config.CLIENT_RATE_LIMIT,
+            {user.username: user.rate_limit for user in config.USERS if user.rate_limit is not None}
+        )
+
         self._client_tasks: set[asyncio.Task] = set()
         self._clients: dict[str, Client] = dict()
-        self.topic_manager = TopicManager()
-        self._auth = auth
+        # Connected clients and disconnected persistent sessions by client identifier
+        self._sessions: dict[str, Client] = dict()
+        self._sessions_lock = threading.Lock()
+        self.topic_manager = TopicManager() if loops == 1 else ConcurrentTopicManager()
+        # Shared by the retained messages, the queues of every loop and the histories
+        self.payload_store = None
+        if config.PAYLOAD_STORE:
+            self.payload_store = PayloadStore() if loops == 1 else ConcurrentPayloadStore()
+        self.topic_manager.payload_store = self.payload_store
+        # Flow control, memory, scheduler, expiry sweeper, batcher and buffer pool of the connections of this loop
+        create_loop_state(self, self, loops)
+        self.traffic = None
+        if config.HEAVY_HITTERS_WINDOW is not None:
+            self.traffic = TrafficStats(
+                config.HEAVY_HITTERS_WINDOW,
+                config.HEAVY_HITTERS_BUCKETS,
+                config.HEAVY_HITTERS_CAPACITY,
+                config.HEAVY_HITTERS_SKETCH_WIDTH,
+                config.HEAVY_HITTERS_SKETCH_DEPTH
+            )
+        if loops == 1:
+            self.topic_manager.memory = self.memory
+            self.topic_manager.traffic = self.traffic
+            self.topic_manager.expiry = self.expiry
+        self._listeners = listeners or [Listener(port=1884 if auth else 1883, auth=auth)]
+        # Any listener requiring authentication needs the auth module
+        self._auth = any(listener.auth for listener in self._listeners)
+        self._connection_ids = itertools.count(1)
+        self.connections = 0
+        self._bridges = bridges or []
+        self.capture = None
+        if capture_path is not None:
+            self.capture = TrafficCapture(capture_path, config.CAPTURE_BUFFER_SIZE, config.CAPTURE_FLUSH_INTERVAL)
         self._message_count = 0
+        self._message_lock = threading.Lock()
+
+        self._loops = loops
+        self._workers: list[LoopWorker] = []
+        # Mailbox of this loop, and the ones of the workers, when there are several loops
+        self.mailbox: Mailbox | None = None
+        self._mailboxes: list[Mailbox] = []
+
+        self._hot_restart = hot_restart
+        self._handoff_clients = handoff_clients
+        self._handoff: Handoff | None = None
+        self._servers: list[tuple[Listener, asyncio.Server]] = []
+        self._shutdown: asyncio.Event | None = None
+
+        if self._hot_restart:
+            self._handoff = request_handoff(config.HANDOFF_SOCKET_PATH)
+
+        if self._handoff is not None:
+            self._message_count = self._handoff.state['message_count']
 
         if self._auth:
             log.info('Authentication is enabled')
+
             self.auth_module = Auth()
-            self.auth_module.create_passwd_file()
+            self.auth_module.load()
 
     def run(self):
         """Starts the server."""
 
         try:
-            asyncio.run(self._start())
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
             return
 
+    async def serve(self):
+        """Runs the server in the running event loop, e.g. next to in-process clients created with connect_local."""
+
+        await self._start()
+
+    def connect_local(self, client_id: str, user_name: str | None = None) -> LocalClient:
+        """
+        Creates a client publishing and subscribing from within this process, without a network connection.
+        :param user_name: user whose rate limit applies to the client
+        """
+
+        return LocalClient(self, client_id, user_name)
+
     def get_next_message_id(self) -> int:
-        """Gets a message id for the next message."""
+        """Gets a message id for the next message, from any event loop."""
 
-        self._message_count += 1
-        return self._message_count
+        with self._message_lock:
+            self._message_count += 1
+            return self._message_count
+
+    def heavy_hitters(self, count: int = 5) -> dict[str, list[dict]]:
+        """Gets the topics and clients with the most messages and bytes, in and out, over the recent window."""
+
+        if self.traffic is None:
+            return dict()
+
+        return self.traffic.report(count)
+
+    async def route(self, message: PublishMessage, owner: str | None):
+        """
+        Routes a received PUBLISH message to its subscribers, through the micro-batching stage if it is enabled.
+        :param owner: identifier of the publishing client
+        """
+
+        if self.batcher is None:
+            await self.topic_manager.publish(message, owner)
+        else:
+            await self.batcher.route(message, owner)
+
+        if self._mailboxes:
+            await relieve_mailboxes(self._mailboxes)
 
     def _get_client(
         self,
         reader: asyncio.StreamReader,
         writer: asyncio.StreamWriter,
         auth: bool,
-        address: str
+        address: str,
+        context: 'Server | LoopWorker'
     ) -> Client:
-        """Gets the client object in case a disconnect happened or creates a new one."""
+        """
+        Creates the client object of a new connection, its session is looked up once it connects.
+        :param context: the server, or the worker of the event loop serving the connection
+        """
 
-        client = self._clients.get(address)
-        if client is None:
-            client = Client(self, reader, writer, auth, address)
-            self._clients[address] = client
+        client = Client(context, reader, writer, auth, address)
+        self._clients[address] = client
 
         return client
 
+    async def take_over_session(self, client: Client):
+        """
+        Registers the session of a client that has just connected. A previous connection with the same
+        client identifier is closed, its subscriptions and queued messages are taken over unless
+        the client asked for a clean session.
+        """
+
+        with self._sessions_lock:
+            previous = self._sessions.get(client.client_id)
+            self._sessions[client.client_id] = client
+
+        if previous is None or previous is client:
+            return
+
+        if previous.server is not client.server:
+            # The previous connection belongs to another event loop, its queue can only be touched there
+            await client.adopt_session(previous.server.mailbox.run(self._give_up_session(previous, client)))
+            return
+
+        if not previous.is_closed():
+            log.info(f'Client {client.client_id} connected again from {client.address}, '
+                     f'closing the connection from {previous.address}')
+            await previous.close()
+
+        if client.clean_session:
+            self.topic_manager.clear_session(previous)
+            previous.clear_queue()
+        else:
+            self.topic_manager.transfer_session(previous, client)
+            client.take_over_queue(previous)
+
+    async def _give_up_session(self, previous: Client, client: Client) -> list[PublishMessage]:
+        """
+        Closes the previous connection of a client on its event loop, and moves its subscriptions to the new one.
+        :return: messages queued for the previous connection, to be queued for the new one on its loop
+        """
+
+        if not previous.is_closed():
+            log.info(f'Client {client.client_id} connected again from {client.address}, '
+                     f'closing the connection from {previous.address}')
+            await previous.close()
+
+        if client.clean_session:
+            self.topic_manager.clear_session(previous)
+            previous.clear_queue()
+            return []
+
+        self.topic_manager.transfer_session(previous, client)
+        return previous.take_queue()
+
+    def _end_session(self, client: Client):
+        """Forgets a client whose connection is closed, a persistent session is kept until it connects again."""
+
+        if self._clients.get(client.address) is client:
+            del self._clients[client.address]
+
+        if client.clean_session:
+            self.topic_manager.clear_session(client)
+
+            with self._sessions_lock:
+                if self._sessions.get(client.client_id) is client:
+                    del self._sessions[client.client_id]
+
     async def _start(self):
         """The async startup function."""
 
-        port = 1884 if self._auth else 1883
+        self._shutdown = asyncio.Event()
+
+        if self.capture is not None:
+            self.capture.start()
+
+        if self._handoff is not None and self._handoff.listener_fds:
+            handed_over = self._handoff.state.get('listeners', [])
+            for index, fd in enumerate(self._handoff.listener_fds):
+                sock = socket.socket(fileno=fd)
+                listener = self._listener_for(sock, handed_over[index] if index < len(handed_over) else None)
+                server = await listener.start(partial(self._handle_connection, listener), sock)
+                self._servers.append((listener, server))
+
+            await self._resume_clients()
+        else:
+            for listener in self._listeners:
+                server = await listener.start(partial(self._handle_connection, listener))
+                self._servers.append((listener, server))
+                log.info(f'Listening on {listener}')
+
+        if self._loops > 1:
+            await self._start_workers()
 
-        server = await asyncio.start_server(self._handle_connection, 'localhost', port)
+        for bridge in self._bridges:
+            bridge.start(self)
+
+        background_tasks = [
+            asyncio.create_task(self._report_stats()),
+            asyncio.create_task(self.expiry.sweep_periodically())
+        ]
+        if self.traffic is not None:
+            background_tasks.append(asyncio.create_task(self.traffic.slide_periodically()))
+        if self._hot_restart:
+            background_tasks.append(asyncio.create_task(self._serve_handoff()))
+        if self._workers:
+            background_tasks.append(asyncio.create_task(self.topic_manager.sweep_expired_periodically()))
 
         log.info('Server started!')
 
-        async with server:
-            await server.serve_forever()
+        try:
+            await self._shutdown.wait()
+        finally:
+            for task in background_tasks:
+                task.cancel()
 
-    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        """Handles a new connection to the server."""
+            for bridge in self._bridges:
+                await bridge.stop()
 
-        task = asyncio.current_task()
-        self._client_tasks.add(task)
+            if self.capture is not None:
+                await self.capture.stop()
+
+            for _, server in self._servers:
+                server.close()
+
+            for worker in self._workers:
+                await asyncio.to_thread(worker.stop)
+
+    async def _start_workers(self):
+        """Starts the event loops of the workers, which accept connections on the listening sockets too."""
+
+        self.mailbox = Mailbox(asyncio.get_running_loop())
+        self.topic_manager.register_loop(self.traffic)
+        # Retained messages are charged to the memory accountant of this loop, whichever loop received them
+        self.topic_manager.memory = LoopBound(self.memory, self.mailbox)
+
+        sockets = [(listener, server.sockets) for listener, server in self._servers]
+        for index in range(1, self._loops):
+            worker = LoopWorker(self, index, self._loops)
+            await asyncio.to_thread(worker.start, sockets)
+            self._workers.append(worker)
+
+        mailboxes = [self.mailbox] + [worker.mailbox for worker in self._workers]
+        self._mailboxes = mailboxes[1:]
+        for worker in self._workers:
+            worker.mailboxes = [mailbox for mailbox in mailboxes if mailbox is not worker.mailbox]
+
+        log.info(f'Serving on {self._loops} event loops, {"without" if is_free_threaded() else "with"} the GIL')
+
+    def _listener_for(self, sock: socket.socket, handed_over: dict | None) -> Listener:
+        """
+        Gets the configured listener a handed over listening socket is bound to,
+        or the settings the previous process used for it.
+        """
 
-        ip, port = writer.get_extra_info('peername')
-        address = f'{ip}:{port}'
+        for listener in self._listeners:
+            if listener.matches(sock):
+                return listener
 
-        client = self._get_client(reader, writer, self._auth, address)
+        if handed_over is not None:
+            return Listener(**handed_over)
+
+        return Listener(auth=self._auth)
+
+    async def _handle_connection(
+        self,
+        listener: Listener,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        context: 'Server | LoopWorker | None' = None
+    ):
+        """
+        Handles a new connection to the server.
+        :param context: worker of the event loop the connection was accepted on, None for the loop of the server
+        """
+
+        context = context or self
+        context.connections += 1
+        listener.configure_connection(writer)
+
+        if listener.is_unix:
+            # Connections on a Unix domain socket have no peer address, the process id keeps the addresses
+            # of connections handed over by a previous process unique
+            address = f'{listener}#{os.getpid()}-{next(self._connection_ids)}'
+        else:
+            ip, port = writer.get_extra_info('peername')[:2]
+            address = f'{ip}:{port}'
+
+        client = self._get_client(reader, writer, listener.auth, address, context)
+
+        await self._serve_client(client)
+
+    async def _serve_client(self, client: Client, resume: bool = False):
+        """Serves the client until its connection is closed or handed over."""
+
+        task = asyncio.current_task()
+        self._client_tasks.add(task)
 
         try:
-            await client.serve()
+            await client.serve(resume)
+        except asyncio.CancelledError:
+            # An idle client gets interrupted when it is detached for a handoff
+            if not client.is_detached():
+                raise
         except Exception as e:
             print(traceback.format_exc(), file=sys.stderr)
         finally:
-            if not client.is_closed():
+            if not client.is_closed() and not client.is_detached():
                 await client.close()
 
+            client.server.scheduler.forget(client)
+            client.server.flow_control.forget(client)
+            self.rate_limiter.forget(client)
+
+            if not client.is_detached():
+                self._end_session(client)
+
             try:
                 self._client_tasks.remove(task)
             except KeyError:
                 pass
+
+    async def _report_stats(self):
+        """
+        Periodically logs the clients that waited the longest for their turn on the event loop,
+        the clients and topics using the most memory, the route cache counters, the reclaimed expired messages,
+        the payloads shared by the payload store, the TLS handshakes, the messages received from bridged brokers
+        and the traffic capture. \\
+        The heavy hitters are logged and published to HEAVY_HITTERS_TOPIC.
+        """
+
+        while True:
+            await asyncio.sleep(config.REPORT_INTERVAL)
+
+            self.scheduler.log_stats()
+            self.scheduler.reset_stats()
+            self.memory.log_usage()
+            log.info(f'Route cache: {self.topic_manager.route_cache_stats()}')
+            log.info(f'Message expiry: {self.expiry}')
+            if self.payload_store is not None:
+                log.info(f'Payload store: {self.payload_store}')
+            if self._workers:
+                log.info(f'Event loop 0: {self.connections} connections accepted, mailbox: {self.mailbox}')
+                log.info(f'Expiry of retained messages: {self.topic_manager.expiry}')
+                for worker in self._workers:
+                    worker.mailbox.post(worker.log_stats)
+            if config.TOPIC_HISTORY:
+                log.info(f'Topic history: {self.topic_manager.history}')
+
+            for listener, _ in self._servers:
+                if listener.is_tls:
+                    log.info(f'TLS handshakes on {listener}: {listener.handshake_stats}')
+
+            for bridge in self._bridges:
+                log.info(f'Bridge to {bridge}: {bridge.received} messages received, {bridge.connections} connections')
+
+            if self.capture is not None:
+                log.info(f'Traffic capture: {self.capture}')
+
+            if self.traffic is not None:
+                self.traffic.log_top()
+                if config.HEAVY_HITTERS_TOPIC is not None:
+                    await self._publish_heavy_hitters(config.HEAVY_HITTERS_TOPIC)
+
+    async def _publish_heavy_hitters(self, topic: str):
+        """Publishes the heavy hitters report as JSON, it is not retained so bridged brokers don't overwrite it."""
+
+        payload = json.dumps(self.traffic.report()).encode()
+        await self.topic_manager.publish(PublishMessage(Header(MessageType.PUBLISH), topic.encode(), None, payload))
+
+    async def _resume_clients(self):
+        """Adopts the client connections handed over by the previous process."""
+
+        loop = asyncio.get_running_loop()
+        clients: dict[str, Client] = dict()
+
+        for fd, client_state in zip(self._handoff.client_fds, self._handoff.state['clients']):
+            sock = socket.socket(fileno=fd)
+
+            # Data the previous process has already received goes before anything read from the socket
+            reader = asyncio.StreamReader()
+            reader.feed_data(bytes.fromhex(client_state['buffered']))
+            protocol = asyncio.StreamReaderProtocol(reader)
+            transport, _ = await loop.connect_accepted_socket(lambda: protocol, sock)
+            writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+
+            client = Client(self, reader, writer, self._auth, client_state['address'])
+            client.restore_state(client_state)
+            clients[client.address] = client
+
+        self._clients.update(clients)
+        self._sessions.update({client.client_id: client for client in clients.values()})
+        self.topic_manager.restore_state(self._handoff.state['topics'], clients)
+
+        for client in clients.values():
+            asyncio.create_task(self._serve_client(client, resume=True))
+
+        self._handoff = None
+
+    async def _serve_handoff(self):
+        """Waits for a new server process and hands the listening sockets and connections over to it."""
+
+        loop = asyncio.get_running_loop()
+
+        with create_handoff_socket(config.HANDOFF_SOCKET_PATH) as handoff_socket:
+            while True:
+                connection, _ = await loop.sock_accept(handoff_socket)
+                with connection:
+                    request = await loop.sock_recv(connection, len(HANDOFF_REQUEST))
+                    if request != HANDOFF_REQUEST:
+                        continue
+
+                    log.info('New server process requested a handoff')
+
+                    handoff = await self._prepare_handoff()
+                    try:
+                        await asyncio.to_thread(send_handoff, connection, handoff)
+                    except Exception:
+                        log.exception('Handoff to the new server process failed, serving on')
+                        await self._abort_handoff(handoff)
+                        continue
+                    finally:
+                        for fd in handoff.listener_fds + handoff.client_fds:
+                            os.close(fd)
+
+                log.info('Handoff complete, shutting down')
+
+                self._shutdown.set()
+                return
+
+    async def _prepare_handoff(self) -> Handoff:
+        """Stops accepting connections and detaches clients at packet boundaries."""
+
+        # The new process accepts from duplicates of the listening sockets, pending connections stay queued
+        listener_fds = []
+        listeners = []
+        servers, self._servers = self._servers, []
+        for listener, server in servers:
+            for sock in server.sockets:
+                listener_fds.append(sock.dup().detach())
+                listeners.append(asdict(listener))
+            server.close()
+
+        clients = []
+        client_fds = []
+        client_states = []
+        # Messages waiting in a batch are delivered before the subscribers' pending data gets flushed
+        if self.batcher is not None:
+            await self.batcher.flush()
+
+        if self._handoff_clients:
+            live_clients = [client for client in self._clients.values() if not client.is_closed()]
+            detached = await asyncio.gather(*(client.detach(config.HANDOFF_TIMEOUT) for client in live_clients))
+
+            for client, result in zip(live_clients, detached):
+                if result is None:
+                    self._serve_again(client)
+                    continue
+
+                fd, buffered = result
+                client_state = client.export_state()
+                client_state['buffered'] = buffered.hex()
+
+                clients.append(client)
+                client_fds.append(fd)
+                client_states.append(client_state)
+
+        state = {
+            'message_count': self._message_count,
+            'listeners': listeners,
+            'clients': client_states,
+            'topics': self.topic_manager.export_state(set(clients))
+        }
+
+        return Handoff(state, listener_fds, client_fds)
+
+    async def _abort_handoff(self, handoff: Handoff):
+        """Accepts connections on the listening sockets again after a failed handoff, and serves the clients again."""
+
+        handed_over = handoff.state['listeners']
+        for index, fd in enumerate(handoff.listener_fds):
+            # The descriptors of the handoff are closed once it is over, the listeners keep duplicates
+            sock = socket.socket(fileno=os.dup(fd))
+            listener = self._listener_for(sock, handed_over[index])
+            server = await listener.start(partial(self._handle_connection, listener), sock)
+            self._servers.append((listener, server))
+
+        for client in list(self._clients.values()):
+            client.cancel_detach()
+            self._serve_again(client)
+
+    def _serve_again(self, client: Client):
+        """Serves a client that was not handed over again, if its serve loop stopped when it was detached."""
+
+        if not client.is_closed() and not client.is_detached() and not client.is_serving():
+            asyncio.create_task(self._serve_client(client, resume=True))
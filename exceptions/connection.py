@@ -10,6 +10,10 @@ class UnacceptableProtocolVersionError(MalformedPacketError):
     pass
 
 
+class PacketTooLargeError(MalformedPacketError):
+    pass
+
+
 class IdentifierRejectedError(MQTTConnectionError):
     pass
 
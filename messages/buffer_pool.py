@@ -0,0 +1,46 @@
+class BufferPool:
+    """
+    Pool of reusable bytearrays for packing messages, grouped in power of two size classes.
+    Buffers larger than the biggest class are allocated with the exact size and never pooled.
+    """
+
+    def __init__(self, min_size: int = 64, max_size: int = 64 * 1024, buffers_per_class: int = 256):
+        self._min_shift = (min_size - 1).bit_length()
+        self._max_size = 1 << (max_size - 1).bit_length()
+        self._buffers_per_class = buffers_per_class
+
+        class_count = (max_size - 1).bit_length() - self._min_shift + 1
+        self._free: list[list[bytearray]] = [[] for _ in range(class_count)]
+
+        self.hits = 0
+        self.misses = 0
+
+    def _class_index(self, size: int) -> int:
+        return max(0, (size - 1).bit_length() - self._min_shift)
+
+    def acquire(self, size: int) -> bytearray:
+        """Gets a buffer of at least the given size."""
+
+        if size > self._max_size:
+            self.misses += 1
+            return bytearray(size)
+
+        index = self._class_index(size)
+        free = self._free[index]
+        if free:
+            self.hits += 1
+            return free.pop()
+
+        self.misses += 1
+        return bytearray(1 << (index + self._min_shift))
+
+    def release(self, buffer: bytearray):
+        """Returns a buffer to the pool. The buffer must not be referenced anywhere else anymore."""
+
+        size = len(buffer)
+        if size > self._max_size or size & (size - 1):
+            return
+
+        free = self._free[self._class_index(size)]
+        if len(free) < self._buffers_per_class:
+            free.append(buffer)
@@ -1,10 +1,13 @@
 from dataclasses import dataclass
 from io import BytesIO
 
-from connection.constants import ConnectReturnCode
+from connection.constants import CONNACK_REASON_CODES, ConnectReturnCode, MQTT5_PROTOCOL_VERSION, PROTOCOL_VERSION
+from exceptions.connection import MalformedPacketError
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER
+from .properties import Properties, pack_properties_into, packed_properties_size, unpack_properties
+
+_RETURN_CODES = {reason_code: return_code for return_code, reason_code in CONNACK_REASON_CODES.items()}
 
 
 @dataclass
@@ -13,22 +16,38 @@ class ConnAckMessage(Message):
 
     header: Header
     return_code: ConnectReturnCode
+    # MQTT 5 properties, packed with the MQTT 5 reason code of the return code when set
+    properties: Properties | None = None
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'Message':
-        pass  # Not required for the server implementation
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'ConnAckMessage':
+        """Creates the CONNACK message object from the given header and data."""
+
+        data.read(1)  # reserved values, the session present flag in MQTT 5
+        try:
+            code = data.read(1)[0]
+            if protocol_version == MQTT5_PROTOCOL_VERSION:
+                return cls(header, _RETURN_CODES[code], unpack_properties(data))
+
+            return_code = ConnectReturnCode(code)
+        except (IndexError, KeyError, ValueError):
+            raise MalformedPacketError('Invalid connect return code')
 
-    def pack(self) -> bytes:
-        """Packs the message into a bytes object."""
+        return cls(header, return_code)
 
-        packed = self.header.pack()
+    def remaining_length(self) -> int:
+        if self.properties is not None:
+            return 2 + packed_properties_size(self.properties)
 
-        remaining_length = 2
-        packed += remaining_length.to_bytes(1, BYTE_ORDER)
+        return 2
 
-        reserved_values = 0
-        packed += reserved_values.to_bytes(1, BYTE_ORDER)
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the reserved byte and the return code, and the properties in MQTT 5, into the buffer."""
 
-        packed += self.return_code.to_bytes(1, BYTE_ORDER)
+        buffer[offset] = 0  # reserved values
+        if self.properties is None:
+            buffer[offset + 1] = self.return_code
+            return offset + 2
 
-        return packed
+        buffer[offset + 1] = CONNACK_REASON_CODES[self.return_code]
+        return pack_properties_into(buffer, offset + 2, self.properties)
@@ -1,11 +1,21 @@
 from dataclasses import dataclass
 from io import BytesIO
 
-from connection.constants import PROTOCOL_NAME, PROTOCOL_VERSION, MAXIMUM_CLIENT_ID_LENGTH
+from connection.constants import (
+    PROTOCOL_NAME,
+    PROTOCOL_VERSION,
+    MQTT5_PROTOCOL_NAME,
+    MQTT5_PROTOCOL_VERSION,
+    MAXIMUM_CLIENT_ID_LENGTH
+)
 from exceptions.connection import MalformedPacketError, UnacceptableProtocolVersionError, IdentifierRejectedError
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER, CONNECT_FLAGS, unpack_string
+from .properties import Properties, pack_properties_into, packed_properties_size, unpack_properties
+from .structs import BYTE_ORDER, CONNECT_FLAGS, pack_string_into, unpack_string
+
+# Protocol name of every supported protocol version
+PROTOCOL_NAMES = {PROTOCOL_VERSION: PROTOCOL_NAME, MQTT5_PROTOCOL_VERSION: MQTT5_PROTOCOL_NAME}
 
 
 @dataclass
@@ -22,23 +32,30 @@ class ConnectMessage(Message):
     password: str | None
     will_topic: str | None
     will_message: str | None
+    protocol_version: int = PROTOCOL_VERSION
+    # MQTT 5 properties, the will properties are not kept
+    properties: Properties | None = None
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'ConnectMessage':
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'ConnectMessage':
         """Creates the CONNECT message object from the given header and data."""
 
+        # The protocol version is in the packet itself
         protocol_name = unpack_string(data)
-        if protocol_name != PROTOCOL_NAME:
+        if protocol_name not in PROTOCOL_NAMES.values():
             raise MalformedPacketError('Invalid protocol name')
 
         protocol_version = int.from_bytes(data.read(1), BYTE_ORDER)
-        if protocol_version != PROTOCOL_VERSION:
+        if PROTOCOL_NAMES.get(protocol_version) != protocol_name:
             raise UnacceptableProtocolVersionError('Invalid protocol version')
 
         connect_flags = data.read(1)
         user_name_flag, password_flag, will_retain, will_qos, will_flag, clean_session, _ = CONNECT_FLAGS.unpack(connect_flags)
 
         keep_alive = int.from_bytes(data.read(2), BYTE_ORDER)
+        mqtt5 = protocol_version == MQTT5_PROTOCOL_VERSION
+        properties = unpack_properties(data) if mqtt5 else None
+
         client_id = unpack_string(data)
         if not client_id:
             raise IdentifierRejectedError('Client Identifier too short')
@@ -49,6 +66,8 @@ class ConnectMessage(Message):
         will_topic = None
         will_message = None
         if will_flag:
+            if mqtt5:
+                unpack_properties(data)
             will_topic = unpack_string(data)
             will_message = unpack_string(data)
 
@@ -70,8 +89,68 @@ class ConnectMessage(Message):
             user_name,
             password,
             will_topic,
-            will_message
+            will_message,
+            protocol_version,
+            properties
         )
 
-    def pack(self) -> bytes:
-        pass  # Not required for the server implementation
+    @property
+    def _mqtt5(self) -> bool:
+        return self.protocol_version == MQTT5_PROTOCOL_VERSION
+
+    def remaining_length(self) -> int:
+        # protocol version, connect flags and keep alive take 4 bytes, every string is 2 + its length
+        remaining_length = 4 + sum(2 + len(string) for string in self._strings())
+        if self._mqtt5:
+            remaining_length += packed_properties_size(self.properties or {})
+            if self.will_topic is not None:
+                remaining_length += 1  # empty will properties
+
+        return remaining_length
+
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the protocol name and version, the connect flags, keep alive and the payload into the buffer."""
+
+        protocol_name, *payload = self._strings()
+        offset = pack_string_into(buffer, offset, protocol_name)
+
+        buffer[offset] = self.protocol_version
+        buffer[offset + 1] = CONNECT_FLAGS.pack(
+            self.user_name is not None,
+            self.password is not None,
+            self.will_retain,
+            self.will_qos,
+            self.will_topic is not None,
+            self.clean_session,
+            0
+        )[0]
+        buffer[offset + 2] = self.keep_alive >> 8
+        buffer[offset + 3] = self.keep_alive & 255
+        offset += 4
+
+        if self._mqtt5:
+            offset = pack_properties_into(buffer, offset, self.properties or {})
+
+        client_id, *payload = payload
+        offset = pack_string_into(buffer, offset, client_id)
+        if self._mqtt5 and self.will_topic is not None:
+            buffer[offset] = 0  # empty will properties
+            offset += 1
+
+        for string in payload:
+            offset = pack_string_into(buffer, offset, string)
+
+        return offset
+
+    def _strings(self) -> list[bytes]:
+        """Encoded strings of the message in the order they are packed."""
+
+        strings = [PROTOCOL_NAMES[self.protocol_version].encode(), self.client_id.encode()]
+        if self.will_topic is not None:
+            strings += [self.will_topic.encode(), self.will_message.encode()]
+        if self.user_name is not None:
+            strings.append(self.user_name.encode())
+        if self.password is not None:
+            strings.append(self.password.encode())
+
+        return strings
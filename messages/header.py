@@ -23,3 +23,8 @@ class Header:
         """Packs the header into a bytes buffer."""
 
         return FIXED_HEADER.pack(self.message_type, self.dup, self.qos, self.retain)
+
+    def to_int(self) -> int:
+        """Packs the header into the value of its single byte."""
+
+        return (self.message_type << 4) | (self.dup << 3) | (self.qos << 1) | self.retain
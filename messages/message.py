@@ -1,31 +1,85 @@
 import asyncio
 from abc import ABC, abstractmethod
 from io import BytesIO
+from typing import Callable
 
+from connection.constants import PROTOCOL_VERSION
 from connection.reader_handler import HeaderHandler, RemainingLengthHandler, DataHandler, MessageHandler
 from messages.header import Header
+from messages.structs import pack_remaining_length_into, remaining_length_size
 
 
 class Message(ABC):
     header: Header
 
     @classmethod
-    async def from_reader(cls, reader: asyncio.StreamReader, keep_alive: int = None) -> 'Message':
-        """Creates a message object from a reader stream."""
+    async def from_reader(
+        cls,
+        reader: asyncio.StreamReader,
+        keep_alive: int = None,
+        on_header: Callable[[], None] | None = None,
+        max_packet_size: int | None = None,
+        streaming_threshold: int | None = None,
+        chunk_size: int | None = None,
+        capture: Callable[..., None] | None = None,
+        protocol_version: int = PROTOCOL_VERSION
+    ) -> 'Message':
+        """
+        Creates a message object from a reader stream.
+        :param capture: called with the bytes of the frame as they are read, in one or more chunks
+        :param protocol_version: protocol version of the connection, the one of its CONNECT
+        """
 
-        header_handler = HeaderHandler()
-        length_handler = RemainingLengthHandler()
-        data_handler = DataHandler()
-        message_handler = MessageHandler()
+        # Most connections spend their time waiting for the next packet,
+        # the rest of the chain is only created once it arrives
+        reader, header = await HeaderHandler(on_header).process(reader, keep_alive)
 
-        header_handler.set_next(length_handler).set_next(data_handler).set_next(message_handler)
-        return await header_handler.handle(reader, keep_alive)
+        length_handler = RemainingLengthHandler(max_packet_size)
+        data_handler = DataHandler(streaming_threshold, chunk_size, capture, protocol_version)
+        message_handler = MessageHandler(protocol_version)
+
+        length_handler.set_next(data_handler).set_next(message_handler)
+        return await length_handler.handle(reader, header)
 
     @classmethod
     @abstractmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'Message':
-        """Creates a message object from the given header and data."""
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'Message':
+        """Creates a message object from the given header and data, as packed by the given protocol version."""
 
-    @abstractmethod
     def pack(self) -> bytes:
         """Packs the message into a bytes object."""
+
+        buffer = bytearray(self.frame_size())
+        self.pack_into(buffer)
+
+        return bytes(buffer)
+
+    def frame_size(self) -> int:
+        """Returns the exact size of the packed message."""
+
+        remaining_length = self.remaining_length()
+
+        return 1 + remaining_length_size(remaining_length) + remaining_length
+
+    def pack_into(self, buffer: bytearray, offset: int = 0) -> int:
+        """
+        Packs the message into the buffer at the given offset in a single pass.
+        The buffer has to have at least frame_size bytes left.
+        :return: offset right after the packed message
+        """
+
+        buffer[offset] = self.header.to_int()
+        offset = pack_remaining_length_into(buffer, offset + 1, self.remaining_length())
+
+        return self.pack_body_into(buffer, offset)
+
+    @abstractmethod
+    def remaining_length(self) -> int:
+        """Returns the length of the variable header and the payload."""
+
+    @abstractmethod
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """
+        Packs the variable header and the payload into the buffer at the given offset.
+        :return: offset right after the packed data
+        """
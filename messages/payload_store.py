@@ -0,0 +1,89 @@
+import threading
+
+
+class PayloadStore:
+    """
+    Reference-counted payloads of the messages the broker holds on to: retained messages, queued messages and
+    topic histories. Identical payloads are kept once, every holder references the same bytes object.
+    Payloads are keyed by their content, and an entry is dropped with its last reference.
+    """
+
+    def __init__(self):
+        # Stored payload by content, the key and the value are the same object
+        self._payloads: dict[bytes, bytes] = dict()
+        self._references: dict[bytes, int] = dict()
+
+        # Bytes of the distinct payloads kept, and of all their references
+        self.stored_bytes = 0
+        self.referenced_bytes = 0
+        # Bytes of the copies replaced by a stored payload, they are freed once their message is gone
+        self.deduplicated_bytes = 0
+
+    def acquire(self, payload: bytes) -> bytes:
+        """
+        Adds a reference to a payload.
+        :return: the stored payload identical to it, to be held instead of it
+        """
+
+        if not payload:
+            return payload
+
+        stored = self._payloads.get(payload)
+        if stored is None:
+            stored = self._payloads[payload] = payload
+            self._references[payload] = 1
+            self.stored_bytes += len(payload)
+        else:
+            self._references[stored] += 1
+            if stored is not payload:
+                self.deduplicated_bytes += len(payload)
+        self.referenced_bytes += len(payload)
+
+        return stored
+
+    def release(self, payload: bytes):
+        """Removes a reference to a payload, acquired before. The payload is dropped with its last reference."""
+
+        if not payload:
+            return
+
+        references = self._references.get(payload)
+        if references is None:
+            return
+
+        self.referenced_bytes -= len(payload)
+        if references > 1:
+            self._references[payload] = references - 1
+        else:
+            del self._references[payload]
+            del self._payloads[payload]
+            self.stored_bytes -= len(payload)
+
+    @property
+    def saved_bytes(self) -> int:
+        """Bytes of the references sharing a stored payload with other references."""
+
+        return self.referenced_bytes - self.stored_bytes
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def __str__(self) -> str:
+        return (f'{len(self)} payloads, {self.stored_bytes} bytes stored for {self.referenced_bytes} bytes referenced, '
+                f'{self.deduplicated_bytes} bytes of copies deduplicated')
+
+
+class ConcurrentPayloadStore(PayloadStore):
+    """PayloadStore shared by the event loops of a server running several of them, entries change under a lock."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def acquire(self, payload: bytes) -> bytes:
+        with self._lock:
+            return super().acquire(payload)
+
+    def release(self, payload: bytes):
+        with self._lock:
+            super().release(payload)
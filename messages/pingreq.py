@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from io import BytesIO
 
+from connection.constants import PROTOCOL_VERSION
 from .header import Header
 from .message import Message
 
@@ -12,10 +13,13 @@ class PingReqMessage(Message):
     header: Header
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'PingReqMessage':
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'PingReqMessage':
         """Creates the PINGREQ message object from the given header and data."""
 
         return cls(header)
 
-    def pack(self) -> bytes:
-        pass  # Not required for the server implementation
+    def remaining_length(self) -> int:
+        return 0
+
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        return offset
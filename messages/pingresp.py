@@ -1,9 +1,9 @@
 from dataclasses import dataclass
 from io import BytesIO
 
+from connection.constants import PROTOCOL_VERSION
 from .header import Header
 from .message import Message
-from .structs import pack_remaining_length
 
 
 @dataclass
@@ -13,16 +13,13 @@ class PingRespMessage(Message):
     header: Header
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'PingRespMessage':
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'PingRespMessage':
         """Creates the PINGRESP message object from the given header and data."""
 
         return cls(header)
 
-    def pack(self) -> bytes:
-        """Packs the message into a bytes object."""
+    def remaining_length(self) -> int:
+        return 0
 
-        packed = self.header.pack()
-        remaining_length = 0
-        packed += pack_remaining_length(remaining_length)
-
-        return packed
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        return offset
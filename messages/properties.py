@@ -0,0 +1,240 @@
+from enum import IntEnum
+from io import BytesIO
+from typing import Any
+
+from exceptions.connection import MalformedPacketError
+from .structs import BYTE_ORDER, pack_remaining_length_into, pack_string_into, remaining_length_size, unpack_bytes
+
+
+class PropertyId(IntEnum):
+    """Identifiers of the MQTT 5 properties."""
+
+    PAYLOAD_FORMAT_INDICATOR = 0x01
+    MESSAGE_EXPIRY_INTERVAL = 0x02
+    CONTENT_TYPE = 0x03
+    RESPONSE_TOPIC = 0x08
+    CORRELATION_DATA = 0x09
+    SUBSCRIPTION_IDENTIFIER = 0x0B
+    SESSION_EXPIRY_INTERVAL = 0x11
+    ASSIGNED_CLIENT_IDENTIFIER = 0x12
+    SERVER_KEEP_ALIVE = 0x13
+    AUTHENTICATION_METHOD = 0x15
+    AUTHENTICATION_DATA = 0x16
+    REQUEST_PROBLEM_INFORMATION = 0x17
+    WILL_DELAY_INTERVAL = 0x18
+    REQUEST_RESPONSE_INFORMATION = 0x19
+    RESPONSE_INFORMATION = 0x1A
+    SERVER_REFERENCE = 0x1C
+    REASON_STRING = 0x1F
+    RECEIVE_MAXIMUM = 0x21
+    TOPIC_ALIAS_MAXIMUM = 0x22
+    TOPIC_ALIAS = 0x23
+    MAXIMUM_QOS = 0x24
+    RETAIN_AVAILABLE = 0x25
+    USER_PROPERTY = 0x26
+    MAXIMUM_PACKET_SIZE = 0x27
+    WILDCARD_SUBSCRIPTION_AVAILABLE = 0x28
+    SUBSCRIPTION_IDENTIFIER_AVAILABLE = 0x29
+    SHARED_SUBSCRIPTION_AVAILABLE = 0x2A
+
+
+class _Type(IntEnum):
+    BYTE = 1
+    TWO_BYTE_INTEGER = 2
+    FOUR_BYTE_INTEGER = 4
+    VARIABLE_BYTE_INTEGER = 5
+    STRING = 6
+    BINARY = 7
+    STRING_PAIR = 8
+
+
+_TYPES: dict[PropertyId, _Type] = {
+    PropertyId.PAYLOAD_FORMAT_INDICATOR: _Type.BYTE,
+    PropertyId.MESSAGE_EXPIRY_INTERVAL: _Type.FOUR_BYTE_INTEGER,
+    PropertyId.CONTENT_TYPE: _Type.STRING,
+    PropertyId.RESPONSE_TOPIC: _Type.STRING,
+    PropertyId.CORRELATION_DATA: _Type.BINARY,
+    PropertyId.SUBSCRIPTION_IDENTIFIER: _Type.VARIABLE_BYTE_INTEGER,
+    PropertyId.SESSION_EXPIRY_INTERVAL: _Type.FOUR_BYTE_INTEGER,
+    PropertyId.ASSIGNED_CLIENT_IDENTIFIER: _Type.STRING,
+    PropertyId.SERVER_KEEP_ALIVE: _Type.TWO_BYTE_INTEGER,
+    PropertyId.AUTHENTICATION_METHOD: _Type.STRING,
+    PropertyId.AUTHENTICATION_DATA: _Type.BINARY,
+    PropertyId.REQUEST_PROBLEM_INFORMATION: _Type.BYTE,
+    PropertyId.WILL_DELAY_INTERVAL: _Type.FOUR_BYTE_INTEGER,
+    PropertyId.REQUEST_RESPONSE_INFORMATION: _Type.BYTE,
+    PropertyId.RESPONSE_INFORMATION: _Type.STRING,
+    PropertyId.SERVER_REFERENCE: _Type.STRING,
+    PropertyId.REASON_STRING: _Type.STRING,
+    PropertyId.RECEIVE_MAXIMUM: _Type.TWO_BYTE_INTEGER,
+    PropertyId.TOPIC_ALIAS_MAXIMUM: _Type.TWO_BYTE_INTEGER,
+    PropertyId.TOPIC_ALIAS: _Type.TWO_BYTE_INTEGER,
+    PropertyId.MAXIMUM_QOS: _Type.BYTE,
+    PropertyId.RETAIN_AVAILABLE: _Type.BYTE,
+    PropertyId.USER_PROPERTY: _Type.STRING_PAIR,
+    PropertyId.MAXIMUM_PACKET_SIZE: _Type.FOUR_BYTE_INTEGER,
+    PropertyId.WILDCARD_SUBSCRIPTION_AVAILABLE: _Type.BYTE,
+    PropertyId.SUBSCRIPTION_IDENTIFIER_AVAILABLE: _Type.BYTE,
+    PropertyId.SHARED_SUBSCRIPTION_AVAILABLE: _Type.BYTE
+}
+
+# Properties that may appear more than once, their value is a list
+_REPEATABLE = {PropertyId.USER_PROPERTY, PropertyId.SUBSCRIPTION_IDENTIFIER}
+
+# Property id -> value, a list of values for the repeatable ones, user properties are (name, value) pairs
+Properties = dict[PropertyId, Any]
+
+
+def unpack_variable_byte_integer(data: BytesIO) -> int:
+    """Unpacks an integer encoded like the remaining length from the BytesIO object."""
+
+    value = 0
+    multiplier = 1
+    for _ in range(4):
+        byte = data.read(1)
+        if not byte:
+            raise MalformedPacketError('Variable byte integer incomplete')
+
+        value += (byte[0] & 127) * multiplier
+        if not byte[0] & 128:
+            return value
+        multiplier *= 128
+
+    raise MalformedPacketError('Malformed variable byte integer')
+
+
+def _unpack_string(data: BytesIO) -> str:
+    try:
+        return unpack_bytes(data).decode()
+    except UnicodeDecodeError:
+        raise MalformedPacketError('Invalid UTF-8 encoded string.')
+
+
+def unpack_properties(data: BytesIO) -> Properties:
+    """Unpacks the properties of an MQTT 5 packet, preceded by their length, from the BytesIO object."""
+
+    length = unpack_variable_byte_integer(data)
+    end = data.tell() + length
+    if end > len(data.getbuffer()):
+        raise MalformedPacketError('Properties exceed the packet')
+
+    properties: Properties = dict()
+    while data.tell() < end:
+        try:
+            property_id = PropertyId(unpack_variable_byte_integer(data))
+        except ValueError:
+            raise MalformedPacketError('Invalid property identifier')
+
+        property_type = _TYPES[property_id]
+        if property_type in (_Type.BYTE, _Type.TWO_BYTE_INTEGER, _Type.FOUR_BYTE_INTEGER):
+            size = 1 if property_type == _Type.BYTE else property_type
+            packed = data.read(size)
+            if len(packed) != size:
+                raise MalformedPacketError(f'Property {property_id.name} incomplete')
+            value = int.from_bytes(packed, BYTE_ORDER)
+        elif property_type == _Type.VARIABLE_BYTE_INTEGER:
+            value = unpack_variable_byte_integer(data)
+        elif property_type == _Type.STRING:
+            value = _unpack_string(data)
+        elif property_type == _Type.BINARY:
+            value = unpack_bytes(data)
+        else:
+            value = (_unpack_string(data), _unpack_string(data))
+
+        if property_id in _REPEATABLE:
+            properties.setdefault(property_id, []).append(value)
+        elif property_id in properties:
+            raise MalformedPacketError(f'Property {property_id.name} included more than once')
+        else:
+            properties[property_id] = value
+
+    if data.tell() != end:
+        raise MalformedPacketError('Property exceeds the properties length')
+
+    return properties
+
+
+# Size of the value of the integer types, the others depend on the value
+_FIXED_SIZES = {_Type.BYTE: 1, _Type.TWO_BYTE_INTEGER: 2, _Type.FOUR_BYTE_INTEGER: 4}
+
+
+def _value_size(property_type: _Type, value) -> int:
+    size = _FIXED_SIZES.get(property_type)
+    if size is not None:
+        return size
+    if property_type == _Type.VARIABLE_BYTE_INTEGER:
+        return remaining_length_size(value)
+    if property_type == _Type.STRING:
+        return 2 + len(value.encode())
+    if property_type == _Type.BINARY:
+        return 2 + len(value)
+
+    return 4 + len(value[0].encode()) + len(value[1].encode())
+
+
+def _values(property_id: PropertyId, value) -> list:
+    return value if property_id in _REPEATABLE else [value]
+
+
+def properties_length(properties: Properties) -> int:
+    """Gets the length of the packed properties, without their length."""
+
+    length = 0
+    for property_id, value in properties.items():
+        property_type = _TYPES[property_id]
+        if property_id in _REPEATABLE:
+            for item in value:
+                length += 1 + _value_size(property_type, item)
+        else:
+            # Every identifier used here fits in a single byte
+            length += 1 + _value_size(property_type, value)
+
+    return length
+
+
+def packed_properties_size(properties: Properties) -> int:
+    """Gets the size of the packed properties including their length."""
+
+    if not properties:
+        return 1
+
+    length = properties_length(properties)
+
+    return remaining_length_size(length) + length
+
+
+def pack_properties_into(buffer: bytearray, offset: int, properties: Properties) -> int:
+    """
+    Packs the properties, preceded by their length, into the buffer at the given offset.
+    :return: offset right after the packed properties
+    """
+
+    if not properties:
+        buffer[offset] = 0
+        return offset + 1
+
+    offset = pack_remaining_length_into(buffer, offset, properties_length(properties))
+
+    for property_id, value in properties.items():
+        property_type = _TYPES[property_id]
+        for item in _values(property_id, value):
+            buffer[offset] = property_id
+            offset += 1
+
+            if property_type == _Type.BYTE:
+                buffer[offset] = item
+                offset += 1
+            elif property_type in (_Type.TWO_BYTE_INTEGER, _Type.FOUR_BYTE_INTEGER):
+                buffer[offset:offset + property_type] = item.to_bytes(property_type, BYTE_ORDER)
+                offset += property_type
+            elif property_type == _Type.VARIABLE_BYTE_INTEGER:
+                offset = pack_remaining_length_into(buffer, offset, item)
+            elif property_type == _Type.STRING:
+                offset = pack_string_into(buffer, offset, item.encode())
+            elif property_type == _Type.BINARY:
+                offset = pack_string_into(buffer, offset, item)
+            else:
+                offset = pack_string_into(buffer, offset, item[0].encode())
+                offset = pack_string_into(buffer, offset, item[1].encode())
+
+    return offset
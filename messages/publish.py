@@ -1,9 +1,20 @@
+import math
 from dataclasses import dataclass
 from io import BytesIO
 
+from connection.constants import MQTT5_PROTOCOL_VERSION, PROTOCOL_VERSION
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER, pack_remaining_length, pack_string, unpack_string
+from .properties import Properties, pack_properties_into, packed_properties_size, unpack_properties
+from .stream import PayloadStream
+from .structs import (
+    BYTE_ORDER,
+    pack_remaining_length_into,
+    pack_string_into,
+    remaining_length_size,
+    split_topic_name,
+    unpack_bytes
+)
 
 
 @dataclass
@@ -11,40 +22,104 @@ class PublishMessage(Message):
     """Publish message."""
 
     header: Header
-    topic_name: str
+    # UTF-8 encoded, decoded only when topic_name is needed
+    topic: bytes
     message_id: int | None
     payload: bytes
+    # Set instead of the payload when a large payload is forwarded while it is being read
+    payload_stream: PayloadStream | None = None
+    # MQTT 5 properties, the message is packed in the MQTT 5 format when they are set, even if empty
+    properties: Properties | None = None
+    # time.monotonic() after which the broker drops the message instead of delivering it, None to keep it
+    expires_at: float | None = None
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'PublishMessage':
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'PublishMessage':
         """Creates the PUBLISH message object from the given header and data."""
 
-        topic_name = unpack_string(data)
+        topic = unpack_bytes(data)
+        split_topic_name(topic)  # validates the encoding
 
         message_id = None
         if header.qos > 0:
             message_id = int.from_bytes(data.read(2), BYTE_ORDER)
 
+        properties = None
+        if protocol_version == MQTT5_PROTOCOL_VERSION:
+            properties = unpack_properties(data)
+
         payload = data.read()
 
-        return cls(header, topic_name, message_id, payload)
+        return cls(header, topic, message_id, payload, properties=properties)
+
+    @property
+    def topic_name(self) -> str:
+        return self.topic.decode()
+
+    @property
+    def topic_levels(self) -> tuple[bytes, ...] | None:
+        """Levels of the topic name, None if it is not a valid topic name."""
+
+        return split_topic_name(self.topic)
 
-    def pack(self) -> bytes:
-        """Packs the message into a bytes object."""
+    def is_expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
 
-        packed = self.header.pack()
+    def remaining_expiry(self, now: float) -> int:
+        """Gets the expiry interval to forward with the message: the seconds it has left, rounded up."""
 
+        return max(math.ceil(self.expires_at - now), 0)
+
+    @property
+    def payload_length(self) -> int:
+        if self.payload_stream is not None:
+            return self.payload_stream.length
+
+        return len(self.payload)
+
+    def remaining_length(self) -> int:
         # every string is 2 + its length
-        remaining_length = 2 + len(self.topic_name) + len(self.payload)
+        remaining_length = 2 + len(self.topic) + self.payload_length
         if self.header.qos > 0:
             remaining_length += 2  # message id has length 2
+        if self.properties is not None:
+            remaining_length += packed_properties_size(self.properties)
+
+        return remaining_length
+
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the topic name, message id and payload into the buffer."""
+
+        offset = self._pack_variable_header_into(buffer, offset)
+
+        # Slice assignment of bytes to a bytearray makes a temporary copy, a memoryview does not
+        end = offset + len(self.payload)
+        memoryview(buffer)[offset:end] = self.payload
+
+        return end
+
+    def pack_prefix(self) -> bytes:
+        """Packs everything but the payload into a bytes object."""
+
+        remaining_length = self.remaining_length()
+        prefix_size = 1 + remaining_length_size(remaining_length) + remaining_length - self.payload_length
+
+        packed = bytearray(prefix_size)
+        packed[0] = self.header.to_int()
+        offset = pack_remaining_length_into(packed, 1, remaining_length)
+        self._pack_variable_header_into(packed, offset)
+
+        return bytes(packed)
 
-        packed += pack_remaining_length(remaining_length)
+    def _pack_variable_header_into(self, buffer: bytearray, offset: int) -> int:
+        offset = pack_string_into(buffer, offset, self.topic)
 
-        packed += pack_string(self.topic_name)
         if self.header.qos > 0:
-            packed += self.message_id.to_bytes(2, BYTE_ORDER)
+            buffer[offset] = self.message_id >> 8
+            buffer[offset + 1] = self.message_id & 255
+            offset += 2
 
-        packed += self.payload
+        if self.properties is not None:
+            offset = pack_properties_into(buffer, offset, self.properties)
 
-        return packed
+        return offset
@@ -1,9 +1,10 @@
 from dataclasses import dataclass
 from io import BytesIO
 
+from connection.constants import PROTOCOL_VERSION
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER, pack_remaining_length
+from .structs import BYTE_ORDER
 
 
 @dataclass
@@ -14,21 +15,20 @@ class PubRecMessage(Message):
     message_id: int
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'PubRecMessage':
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'PubRecMessage':
         """Creates the PUBREC message object from the given header and data."""
 
         message_id = int.from_bytes(data.read(2), BYTE_ORDER)
 
         return cls(header, message_id)
 
-    def pack(self) -> bytes:
-        """Packs the message into a bytes object."""
+    def remaining_length(self) -> int:
+        return 2
 
-        packed = self.header.pack()
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the message id into the buffer."""
 
-        remaining_length = 2
-        packed += pack_remaining_length(remaining_length)
+        buffer[offset] = self.message_id >> 8
+        buffer[offset + 1] = self.message_id & 255
 
-        packed += self.message_id.to_bytes(2, BYTE_ORDER)
-
-        return packed
+        return offset + 2
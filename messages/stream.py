@@ -0,0 +1,65 @@
+import asyncio
+from typing import AsyncIterator, Callable
+
+from exceptions.connection import MalformedPacketError
+
+
+class PayloadStream:
+    """
+    Payload of a PUBLISH message that is read from the connection in chunks while it is being delivered,
+    instead of being buffered as a whole.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        length: int,
+        chunk_size: int,
+        on_chunk: Callable[[bytes], None] | None = None
+    ):
+        """:param on_chunk: called with every chunk read from the connection, e.g. to capture the traffic"""
+
+        self.length = length
+        self._reader = reader
+        self._remaining = length
+        self._chunk_size = chunk_size
+        self._on_chunk = on_chunk
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._chunks()
+
+    async def _chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await self.read_chunk()
+            if not chunk:
+                return
+
+            yield chunk
+
+    @property
+    def exhausted(self) -> bool:
+        return self._remaining == 0
+
+    async def read_chunk(self) -> bytes:
+        """Reads the next chunk of the payload. Returns an empty bytes object once the payload has been read."""
+
+        size = min(self._chunk_size, self._remaining)
+        if size == 0:
+            return b''
+
+        try:
+            chunk = await self._reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise MalformedPacketError('Data incomplete')
+
+        self._remaining -= size
+        if self._on_chunk is not None:
+            self._on_chunk(chunk)
+
+        return chunk
+
+    async def discard(self):
+        """Reads and drops the rest of the payload, so the next packet can be read from the connection."""
+
+        while await self.read_chunk():
+            pass
@@ -1,9 +1,11 @@
 import asyncio
+from functools import lru_cache
 from io import BytesIO
 from typing import Literal
 
 import bitstruct
 
+import config
 from exceptions.connection import MalformedPacketError
 
 FIXED_HEADER = bitstruct.compile('u4u1u2u1')
@@ -22,11 +24,67 @@ def unpack_string(data: BytesIO) -> str:
         raise MalformedPacketError('Invalid UTF-8 encoded string.')
 
 
+def unpack_bytes(data: BytesIO) -> bytes:
+    """Unpacks a length prefixed string from the BytesIO object without decoding it."""
+
+    length = int.from_bytes(data.read(2), BYTE_ORDER)
+
+    return data.read(length)
+
+
+@lru_cache(maxsize=config.TOPIC_NAME_CACHE_SIZE)
+def split_topic_name(topic_name: bytes) -> tuple[bytes, ...] | None:
+    """
+    Validates an UTF-8 encoded topic name and splits it into levels.
+    Results are cached, so repeated topic names are neither decoded nor split again and share the same levels.
+    Only the bounded cache keeps levels alive, topic names chosen by clients cannot grow it without limit.
+
+    Raises:
+        MalformedPacketError: when the topic name is not valid UTF-8
+
+    Returns:
+        tuple[bytes, ...] | None: topic levels, or None if the topic name is empty, contains wildcards or empty levels
+    """
+
+    try:
+        topic_name.decode()
+    except UnicodeDecodeError:
+        raise MalformedPacketError('Invalid UTF-8 encoded string.')
+
+    if not topic_name or b'#' in topic_name or b'+' in topic_name:
+        return None
+
+    levels = topic_name.split(b'/')
+    if b'' in levels:
+        return None
+
+    return tuple(levels)
+
+
 def pack_string(data: str) -> bytes:
     """Packs a string into a bytes object."""
 
-    packed = len(data).to_bytes(2, BYTE_ORDER)
-    return packed + data.encode()
+    encoded = data.encode()
+    packed = bytearray(2 + len(encoded))
+    pack_string_into(packed, 0, encoded)
+
+    return bytes(packed)
+
+
+def pack_string_into(buffer: bytearray, offset: int, data: bytes) -> int:
+    """
+    Packs an already encoded string into the buffer at the given offset.
+    :return: offset right after the packed string
+    """
+
+    length = len(data)
+    buffer[offset] = length >> 8
+    buffer[offset + 1] = length & 255
+
+    offset += 2
+    buffer[offset:offset + length] = data
+
+    return offset + length
 
 
 async def read_remaining_length(reader: asyncio.StreamReader) -> int:
@@ -37,6 +95,10 @@ async def read_remaining_length(reader: asyncio.StreamReader) -> int:
     digit = 128
 
     while digit & 128:
+        # The remaining length is encoded in at most 4 bytes
+        if multiplier > 128 ** 3:
+            raise MalformedPacketError('Malformed remaining length')
+
         try:
             digit = (await reader.readexactly(1))[0]
         except asyncio.IncompleteReadError:
@@ -48,21 +110,40 @@ async def read_remaining_length(reader: asyncio.StreamReader) -> int:
     return remaining_length
 
 
+def remaining_length_size(remaining_length: int) -> int:
+    """Returns the number of bytes needed to encode the remaining length."""
+
+    if remaining_length < 128:
+        return 1
+    if remaining_length < 16384:
+        return 2
+    if remaining_length < 2097152:
+        return 3
+    return 4
+
+
 def pack_remaining_length(remaining_length: int) -> bytes:
     """Packs the remaining length into a bytes object."""
 
-    if remaining_length == 0:
-        return b'\x00'
+    packed = bytearray(remaining_length_size(remaining_length))
+    pack_remaining_length_into(packed, 0, remaining_length)
+
+    return bytes(packed)
 
-    packed = b''
 
-    while remaining_length > 0:
+def pack_remaining_length_into(buffer: bytearray, offset: int, remaining_length: int) -> int:
+    """
+    Packs the remaining length into the buffer at the given offset.
+    :return: offset right after the packed remaining length
+    """
+
+    while True:
         digit = remaining_length & 127
         remaining_length >>= 7
 
         if remaining_length > 0:
-            digit |= 128
-
-        packed += digit.to_bytes(1, BYTE_ORDER)
-
-    return packed
+            buffer[offset] = digit | 128
+            offset += 1
+        else:
+            buffer[offset] = digit
+            return offset + 1
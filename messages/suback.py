@@ -1,9 +1,11 @@
 from dataclasses import dataclass
 from io import BytesIO
 
+from connection.constants import MQTT5_PROTOCOL_VERSION, PROTOCOL_VERSION
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER, pack_remaining_length
+from .properties import Properties, pack_properties_into, packed_properties_size, unpack_properties
+from .structs import BYTE_ORDER
 
 
 @dataclass
@@ -13,22 +15,39 @@ class SubAckMessage(Message):
     header: Header
     message_id: int
     granted_qos: list[int]
+    # MQTT 5 properties, the message is packed in the MQTT 5 format when they are set
+    properties: Properties | None = None
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'SubAckMessage':
-        pass  # Not required for the server implementation
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'SubAckMessage':
+        """Creates the SUBACK message object from the given header and data."""
 
-    def pack(self) -> bytes:
-        """Packs the message into a bytes object."""
+        message_id = int.from_bytes(data.read(2), BYTE_ORDER)
+        properties = None
+        if protocol_version == MQTT5_PROTOCOL_VERSION:
+            properties = unpack_properties(data)
+        granted_qos = list(data.read())
 
-        packed = self.header.pack()
+        return cls(header, message_id, granted_qos, properties)
 
+    def remaining_length(self) -> int:
         remaining_length = 2 + len(self.granted_qos)
-        packed += pack_remaining_length(remaining_length)
+        if self.properties is not None:
+            remaining_length += packed_properties_size(self.properties)
 
-        packed += self.message_id.to_bytes(2, BYTE_ORDER)
+        return remaining_length
 
-        for qos in self.granted_qos:
-            packed += qos.to_bytes(1, BYTE_ORDER)
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the message id and the granted QoS levels into the buffer."""
 
-        return packed
+        buffer[offset] = self.message_id >> 8
+        buffer[offset + 1] = self.message_id & 255
+        offset += 2
+
+        if self.properties is not None:
+            offset = pack_properties_into(buffer, offset, self.properties)
+
+        end = offset + len(self.granted_qos)
+        buffer[offset:end] = bytes(self.granted_qos)
+
+        return end
@@ -1,9 +1,11 @@
 from dataclasses import dataclass
 from io import BytesIO
 
+from connection.constants import MQTT5_PROTOCOL_VERSION, PROTOCOL_VERSION
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER, unpack_string
+from .properties import Properties, pack_properties_into, packed_properties_size, unpack_properties
+from .structs import BYTE_ORDER, pack_string_into, unpack_string
 
 
 @dataclass
@@ -19,21 +21,49 @@ class SubscribeMessage(Message):
     header: Header
     message_id: int
     requested_topics: list[RequestedTopic]
+    # MQTT 5 properties, the message is packed in the MQTT 5 format when they are set
+    properties: Properties | None = None
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'SubscribeMessage':
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'SubscribeMessage':
         """Creates the SUBSCRIBE message object from the given header and data."""
 
         message_id = int.from_bytes(data.read(2), BYTE_ORDER)
+        properties = None
+        if protocol_version == MQTT5_PROTOCOL_VERSION:
+            properties = unpack_properties(data)
 
         topics = []
         data_length = len(data.getbuffer())
         while data.tell() < data_length:
             topic_name = unpack_string(data)
-            qos = int.from_bytes(data.read(1), BYTE_ORDER)
+            # The other subscription options of MQTT 5 are not supported, they share the byte with the QoS
+            qos = int.from_bytes(data.read(1), BYTE_ORDER) & 3
             topics.append(RequestedTopic(topic_name, qos))
 
-        return cls(header, message_id, topics)
+        return cls(header, message_id, topics, properties)
 
-    def pack(self) -> bytes:
-        pass  # Not required for the server implementation
+    def remaining_length(self) -> int:
+        # message id, then every topic as a string followed by its QoS
+        remaining_length = 2 + sum(3 + len(topic.topic_name.encode()) for topic in self.requested_topics)
+        if self.properties is not None:
+            remaining_length += packed_properties_size(self.properties)
+
+        return remaining_length
+
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the message id and the requested topics with their QoS into the buffer."""
+
+        buffer[offset] = self.message_id >> 8
+        buffer[offset + 1] = self.message_id & 255
+        offset += 2
+
+        if self.properties is not None:
+            offset = pack_properties_into(buffer, offset, self.properties)
+
+        for topic in self.requested_topics:
+            offset = pack_string_into(buffer, offset, topic.topic_name.encode())
+            buffer[offset] = topic.qos
+            offset += 1
+
+        return offset
@@ -1,9 +1,11 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from io import BytesIO
 
+from connection.constants import MQTT5_PROTOCOL_VERSION, PROTOCOL_VERSION
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER, pack_remaining_length
+from .properties import Properties, pack_properties_into, packed_properties_size, unpack_properties
+from .structs import BYTE_ORDER
 
 
 @dataclass
@@ -12,17 +14,38 @@ class UnsubAckMessage(Message):
 
     header: Header
     message_id: int
+    # MQTT 5 properties and a reason code per topic, the message is packed in the MQTT 5 format when they are set
+    properties: Properties | None = None
+    reason_codes: list[int] = field(default_factory=list)
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'UnsubAckMessage':
-        pass  # Not required for the server implementation
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'UnsubAckMessage':
+        """Creates the UNSUBACK message object from the given header and data."""
 
-    def pack(self) -> bytes:
-        """Packs the message into a bytes object."""
+        message_id = int.from_bytes(data.read(2), BYTE_ORDER)
+        if protocol_version == MQTT5_PROTOCOL_VERSION:
+            properties = unpack_properties(data)
+            return cls(header, message_id, properties, list(data.read()))
 
-        packed = self.header.pack()
-        remaining_length = 2
-        packed += pack_remaining_length(remaining_length)
-        packed += self.message_id.to_bytes(2, BYTE_ORDER)
+        return cls(header, message_id)
 
-        return packed
+    def remaining_length(self) -> int:
+        if self.properties is not None:
+            return 2 + packed_properties_size(self.properties) + len(self.reason_codes)
+
+        return 2
+
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the message id into the buffer."""
+
+        buffer[offset] = self.message_id >> 8
+        buffer[offset + 1] = self.message_id & 255
+        offset += 2
+
+        if self.properties is not None:
+            offset = pack_properties_into(buffer, offset, self.properties)
+            end = offset + len(self.reason_codes)
+            buffer[offset:end] = bytes(self.reason_codes)
+            return end
+
+        return offset
@@ -1,9 +1,11 @@
 from dataclasses import dataclass
 from io import BytesIO
 
+from connection.constants import MQTT5_PROTOCOL_VERSION, PROTOCOL_VERSION
 from .header import Header
 from .message import Message
-from .structs import BYTE_ORDER, unpack_string
+from .properties import Properties, pack_properties_into, packed_properties_size, unpack_properties
+from .structs import BYTE_ORDER, pack_string_into, unpack_string
 
 
 @dataclass
@@ -13,17 +15,43 @@ class UnsubscribeMessage(Message):
     header: Header
     message_id: int
     topics: list[str]
+    # MQTT 5 properties, the message is packed in the MQTT 5 format when they are set
+    properties: Properties | None = None
 
     @classmethod
-    def from_data(cls, header: Header, data: BytesIO) -> 'UnsubscribeMessage':
+    def from_data(cls, header: Header, data: BytesIO, protocol_version: int = PROTOCOL_VERSION) -> 'UnsubscribeMessage':
         message_id = int.from_bytes(data.read(2), BYTE_ORDER)
+        properties = None
+        if protocol_version == MQTT5_PROTOCOL_VERSION:
+            properties = unpack_properties(data)
+
         topics = []
         data_length = len(data.getbuffer())
         while data.tell() < data_length:
             topic_name = unpack_string(data)
             topics.append(topic_name)
 
-        return cls(header, message_id, topics)
+        return cls(header, message_id, topics, properties)
+
+    def remaining_length(self) -> int:
+        # message id, then every topic as a string
+        remaining_length = 2 + sum(2 + len(topic.encode()) for topic in self.topics)
+        if self.properties is not None:
+            remaining_length += packed_properties_size(self.properties)
+
+        return remaining_length
+
+    def pack_body_into(self, buffer: bytearray, offset: int) -> int:
+        """Packs the message id and the topics into the buffer."""
+
+        buffer[offset] = self.message_id >> 8
+        buffer[offset + 1] = self.message_id & 255
+        offset += 2
+
+        if self.properties is not None:
+            offset = pack_properties_into(buffer, offset, self.properties)
+
+        for topic in self.topics:
+            offset = pack_string_into(buffer, offset, topic.encode())
 
-    def pack(self) -> bytes:
-        pass  # Not required for the server implementation
+        return offset
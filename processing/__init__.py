@@ -1,2 +1,3 @@
 from .topic import Topic
 from .topic_manager import TopicManager
+from .concurrent_topic_manager import ConcurrentTopicManager
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import config
+from connection import Client
+from connection.expiry import ExpirySweeper
+from connection.heavy_hitters import TrafficBuffer, TrafficStats
+from messages import PublishMessage
+from processing.history import HistoryRequest
+from processing.topic import Topic
+from processing.topic_manager import TopicManager
+
+
+class ConcurrentTopicManager(TopicManager):
+    """
+    TopicManager shared by the event loops of a server running several of them, see Server(loops=...). \\
+    Topics, subscriptions, retained messages and histories are changed under a lock. Routing reads the recipients
+    of a topic from a snapshot that is replaced whenever its subscriptions change, so delivering a message
+    to an existing topic takes no lock unless the message is retained or kept in a history. \\
+    Received messages are counted by the traffic stats of the event loop they were received on.
+    """
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        # Traffic stats of the event loop of the current thread
+        self._loop_state = threading.local()
+        # Retained messages are reclaimed by a sweeper of their own, the one of the server belongs to its loop
+        self.expiry = ExpirySweeper(config.EXPIRY_SWEEP_INTERVAL)
+
+    def register_loop(self, traffic: TrafficStats | TrafficBuffer | None):
+        """Sets the traffic stats received messages are counted by, called from the thread of every event loop"""
+        self._loop_state.traffic = traffic
+
+    def _create_topic(self, topic: bytes, levels: tuple[bytes, ...]) -> Topic:
+        created = super()._create_topic(topic, levels)
+        created.recipients = tuple(created.subscribed_clients.items())
+
+        return created
+
+    def _route(self, topic: Topic) -> tuple[tuple[Client, int], ...]:
+        return topic.recipients
+
+    def _invalidate_routes(self):
+        self.route_cache_invalidations += 1
+
+    def route_cache_stats(self) -> dict[str, int]:
+        """Gets the number of subscription changes, each replaced the snapshots of the topics it changed"""
+        return {'invalidations': self.route_cache_invalidations, 'topics': len(self._topics)}
+
+    def _prepare(self, message: PublishMessage, owner: str | None) -> Topic | None:
+        traffic = getattr(self._loop_state, 'traffic', None)
+        if traffic is not None:
+            traffic.record_in(message.topic, owner, message.payload_length)
+
+        topic = self._topics.get(message.topic)
+        if topic is None or topic.history is not None or message.header.retain:
+            with self._lock:
+                return super()._prepare(message, owner)
+
+        # The expiry is set on the message only, nothing shared is changed
+        if message.properties or topic.default_expiry is not None:
+            TopicManager._set_expiry(topic, message)
+
+        return topic
+
+    def _subscribe(
+        self,
+        topic_structure: str,
+        client: Client,
+        qos: int,
+        replay: HistoryRequest | None = None
+    ) -> list[PublishMessage]:
+        with self._lock:
+            return super()._subscribe(topic_structure, client, qos, replay)
+
+    def unsubscribe_from_topic(self, topic_structure: str, client: Client):
+        with self._lock:
+            super().unsubscribe_from_topic(topic_structure, client)
+
+    def clear_session(self, client: Client):
+        with self._lock:
+            super().clear_session(client)
+
+    def transfer_session(self, previous: Client, client: Client):
+        with self._lock:
+            super().transfer_session(previous, client)
+
+    def export_state(self, clients: set[Client]) -> dict:
+        with self._lock:
+            return super().export_state(clients)
+
+    def restore_state(self, state: dict, clients: dict[str, Client]):
+        with self._lock:
+            super().restore_state(state, clients)
+
+            for topic in self._topics.values():
+                topic.recipients = tuple(topic.subscribed_clients.items())
+
+    async def sweep_expired_periodically(self):
+        """Reclaims expired retained messages, runs on one of the event loops"""
+        while True:
+            await asyncio.sleep(config.EXPIRY_SWEEP_INTERVAL)
+            with self._lock:
+                self.expiry.sweep(time.monotonic())
@@ -0,0 +1,148 @@
+import re
+from array import array
+from dataclasses import dataclass
+
+from messages import PublishMessage
+from messages.payload_store import PayloadStore
+
+
+HISTORY_PREFIX = '$history/'
+# all, a number of messages or a number of seconds, e.g. 10 or 300s
+_HISTORY_SPEC = re.compile(r'(all)|(\d+)|(\d+(?:\.\d+)?)s')
+
+
+@dataclass
+class HistoryRequest:
+    """Messages of a topic history a subscriber asked for, None for no limit"""
+    last: int | None = None
+    seconds: float | None = None
+
+
+def parse_history_request(topic_structure: str) -> tuple[HistoryRequest | None, str]:
+    """
+    Splits a subscription to $history/<all | N | Ts>/<filter> into the replay it asks for and the filter. \\
+    Any other structure, including a $history/ prefix with an invalid spec, is returned as it is with no request
+    """
+    if not topic_structure.startswith(HISTORY_PREFIX):
+        return None, topic_structure
+
+    spec, _, topic_filter = topic_structure[len(HISTORY_PREFIX):].partition('/')
+    match = _HISTORY_SPEC.fullmatch(spec)
+    if match is None or not topic_filter:
+        return None, topic_structure
+
+    _, last, seconds = match.groups()
+    return HistoryRequest(int(last) if last else None, float(seconds) if seconds else None), topic_filter
+
+
+class MessageHistory:
+    """
+    Ring of the last messages of a topic with the time they were published. \\
+    The messages are the ones delivered to live subscribers, so their payloads are shared, not copied
+    """
+    def __init__(self, capacity: int, max_age: float | None, payload_store: PayloadStore | None = None):
+        """
+        :param capacity: messages kept, the oldest one is dropped when a message is added to a full ring
+        :param max_age: seconds a message is kept, None to keep it until it is pushed out
+        :param payload_store: store the payloads of the kept messages are shared through, None to keep them as they are
+        """
+        self.max_age = max_age
+        self._payload_store = payload_store
+        self._messages: list[PublishMessage | None] = [None] * capacity
+        self._times = array('d', bytes(8 * capacity))
+        self._sizes = array('Q', bytes(8 * capacity))
+        self._first = 0
+        self.length = 0
+        # Bytes of the frames of the kept messages
+        self.size = 0
+
+    def append(self, message: PublishMessage, now: float) -> int:
+        """Adds a message published at now, returns the change of size in bytes"""
+        freed = self.drop_oldest() if self.length == len(self._messages) else 0
+
+        index = (self._first + self.length) % len(self._messages)
+        size = message.frame_size()
+        if self._payload_store is not None:
+            message.payload = self._payload_store.acquire(message.payload)
+        self._messages[index] = message
+        self._times[index] = now
+        self._sizes[index] = size
+        self.length += 1
+        self.size += size
+
+        return size - freed
+
+    def drop_oldest(self) -> int:
+        """Drops the oldest message, returns its size"""
+        size = self._sizes[self._first]
+        if self._payload_store is not None:
+            self._payload_store.release(self._messages[self._first].payload)
+        self._messages[self._first] = None
+        self._first = (self._first + 1) % len(self._messages)
+        self.length -= 1
+        self.size -= size
+
+        return size
+
+    def expire(self, now: float) -> int:
+        """Drops the messages older than max_age, returns the bytes freed"""
+        freed = 0
+        if self.max_age is not None:
+            while self.length and self._times[self._first] < now - self.max_age:
+                freed += self.drop_oldest()
+
+        return freed
+
+    def replay(self, request: HistoryRequest, now: float) -> list[PublishMessage]:
+        """Gets the requested messages, oldest first"""
+        oldest = None
+        for seconds in (request.seconds, self.max_age):
+            if seconds is not None:
+                oldest = max(oldest or 0.0, now - seconds)
+
+        capacity = len(self._messages)
+        indexes = [(self._first + offset) % capacity for offset in range(self.length)]
+        if oldest is not None:
+            indexes = [index for index in indexes if self._times[index] >= oldest]
+        if request.last is not None:
+            indexes = indexes[-request.last:] if request.last else []
+
+        return [self._messages[index] for index in indexes]
+
+
+class HistoryStore:
+    """
+    Keeps the histories of topics within a memory limit. Above the limit the oldest messages of the largest
+    histories are dropped, until the usage is below limit * shed_ratio
+    """
+    def __init__(self, memory_limit: int, shed_ratio: float = 0.9):
+        self._limit = memory_limit
+        self._shed_target = int(memory_limit * shed_ratio)
+        self._histories: list[MessageHistory] = []
+        self.size = 0
+        self.shed_messages = 0
+
+    def create(self, capacity: int, max_age: float | None, payload_store: PayloadStore | None = None) -> MessageHistory:
+        history = MessageHistory(capacity, max_age, payload_store)
+        self._histories.append(history)
+        return history
+
+    def record(self, history: MessageHistory, message: PublishMessage, now: float):
+        self.size += history.append(message, now)
+        self.size -= history.expire(now)
+
+        if self.size > self._limit:
+            self._shed()
+
+    def _shed(self):
+        for history in sorted(self._histories, key=lambda history: history.size, reverse=True):
+            while history.length and self.size > self._shed_target:
+                self.size -= history.drop_oldest()
+                self.shed_messages += 1
+
+            if self.size <= self._shed_target:
+                break
+
+    def __str__(self) -> str:
+        return (f'{len(self._histories)} topics, {self.size} bytes, '
+                f'{self.shed_messages} messages dropped over the memory limit')
@@ -1,29 +1,204 @@
+import time
+
 from connection import Client
-from messages import PublishMessage
+from connection.bridge import is_bridge
+from connection.constants import MessageType, PROTOCOL_VERSION
+from messages import Header, PublishMessage
+from processing.history import HistoryRequest, MessageHistory
 
 
 class Topic:
-    def __init__(self, topic_name: str):
-        self.topic_name: str = topic_name
-        self.subscribed_clients: set[Client] = set()
-        # self.messages: list[Message] = []
+    def __init__(self, topic: bytes, levels: tuple[bytes, ...]):
+        self.topic: bytes = topic
+        self.levels: tuple[bytes, ...] = levels
+        # Subscribed clients with their granted QoS
+        self.subscribed_clients: dict[Client, int] = dict()
+        # Copy of subscribed_clients replaced on every change, when the topic manager routes from snapshots
+        self.recipients: tuple[tuple[Client, int], ...] | None = None
+        # Recent messages, when the topic matches a TOPIC_HISTORY filter
+        self.history: MessageHistory | None = None
         self.retained_message: PublishMessage | None = None
+        # Identifier of the client the retained message is charged to
+        self.retained_owner: str | None = None
+        # Seconds the messages of the topic expire after, unless the publisher set an expiry
+        self.default_expiry: float | None = None
+        # Expiry of the retained message the expiry sweeper is scheduled for
+        self.expiry_scheduled: float | None = None
 
-    async def publish(self, message: PublishMessage):
-        if message.header.retain:
-            self.retained_message = message if message.payload else None
-        else:
-            for client in self.subscribed_clients:
-                await client.notify(message)
+    @property
+    def topic_name(self) -> str:
+        return self.topic.decode()
+
+    async def publish(self, message: PublishMessage, recipients: tuple[tuple[Client, int], ...]):
+        """
+        Publishes the message to the recipients, each gets it with at most its granted QoS
+        :param recipients: clients with their granted QoS, as resolved by the TopicManager
+        """
+        if message.payload_stream is not None:
+            await self._publish_stream(message, recipients)
+            return
+
+        variants = {message.header.qos: message}
+        for client, qos in recipients:
+            qos = min(qos, message.header.qos)
+            variant = variants.get(qos)
+            if variant is None:
+                variant = variants[qos] = Topic._downgrade(message, qos)
+            await client.notify(variant)
+
+    def retain(self, message: PublishMessage):
+        """Keeps the message for new subscribers, an empty payload clears the retained message"""
+        self.retained_message = message if message.payload else None
+
+    def collect(
+        self,
+        messages: list[PublishMessage],
+        recipients: tuple[tuple[Client, int], ...],
+        deliveries: dict[Client, list[PublishMessage]]
+    ):
+        """
+        Adds messages to the deliveries of every recipient, each gets them with at most its granted QoS
+        :param deliveries: messages to deliver by client, in the order they have to be delivered
+        """
+        variants: dict[int, list[PublishMessage]] = dict()
+        for client, qos in recipients:
+            downgraded = variants.get(qos)
+            if downgraded is None:
+                downgraded = variants[qos] = [Topic._downgrade(message, qos) for message in messages]
+            deliveries.setdefault(client, []).extend(downgraded)
+
+    async def _publish_stream(self, message: PublishMessage, recipients: tuple[tuple[Client, int], ...]):
+        """
+        Forwards every chunk of a streamed payload to the network subscribers as soon as it is read.
+        In-process subscribers, and network subscribers with a backlog or another message being streamed to them,
+        get the whole message once the payload has been read, after the messages they are waiting for.
+        """
+
+        buffered_recipients = [(client, qos) for client, qos in recipients if not isinstance(client, Client)]
+        clients = []
+
+        # MQTT 3.1 clients without properties share a prefix per QoS, the prefix of others depends on the client
+        shared = message.properties is None
+        prefixes = dict()
+        for client, qos in recipients:
+            if not isinstance(client, Client):
+                continue
+
+            qos = min(qos, message.header.qos)
+            variant = Topic._downgrade(message, qos)
+            if not client.can_stream(variant):
+                buffered_recipients.append((client, qos))
+                continue
+
+            if shared and client.protocol_version == PROTOCOL_VERSION:
+                prefix = prefixes.get(qos)
+                if prefix is None:
+                    prefix = prefixes[qos] = variant.pack_prefix()
+            else:
+                prefix = client.stream_prefix(variant)
+                if prefix is None:
+                    continue
+
+            client.begin_stream(prefix)
+            clients.append(client)
 
-    async def subscribe(self, client: Client):
-        self.subscribed_clients.add(client)
+        payload = bytearray() if buffered_recipients else None
+        try:
+            async for chunk in message.payload_stream:
+                for client in clients:
+                    client.write_stream(chunk)
+                if payload is not None:
+                    payload += chunk
 
-        if self.retained_message:
-            await client.notify(self.retained_message)
+                # Waiting for the slowest subscriber keeps at most a chunk per subscriber in memory
+                for client in clients:
+                    await client.drain()
+        except BaseException:
+            # The subscribers got part of a frame, their connections can't be used anymore
+            for client in clients:
+                await client.abort_stream()
+            raise
+
+        for client in clients:
+            client.end_stream()
+
+        if payload is not None:
+            message = PublishMessage(
+                message.header,
+                message.topic,
+                message.message_id,
+                bytes(payload),
+                properties=message.properties,
+                expires_at=message.expires_at
+            )
+            for client, qos in buffered_recipients:
+                await client.notify(Topic._downgrade(message, qos))
+
+    @staticmethod
+    def _downgrade(message: PublishMessage, qos: int, retain: bool | None = None) -> PublishMessage:
+        """
+        Gets a copy of the message with a lower QoS, the payload is shared
+        :param retain: retain flag of the copy, the one of the message if None
+        """
+        if retain is None or retain == message.header.retain:
+            if qos >= message.header.qos:
+                return message
+            retain = message.header.retain
+
+        qos = min(qos, message.header.qos)
+        header = Header(MessageType.PUBLISH, message.header.dup, qos, retain)
+        return PublishMessage(
+            header,
+            message.topic,
+            message.message_id if qos else None,
+            message.payload,
+            message.payload_stream,
+            message.properties,
+            message.expires_at
+        )
+
+    def subscribe(self, client: Client, qos: int, replay: HistoryRequest | None = None) -> list[PublishMessage]:
+        """
+        Subscribes the client, returns the retained message to send it
+        :param replay: messages of the history to send instead of the retained message, flagged as retained
+        """
+        self.add_subscriber(client, qos)
+
+        now = time.monotonic()
+        if replay is not None and self.history is not None:
+            return [Topic._downgrade(message, qos, retain=True)
+                    for message in self.history.replay(replay, now) if not message.is_expired(now)]
+
+        # An expired retained message is not delivered even if the expiry sweeper has not reclaimed it yet
+        retained = self.retained_message
+        if retained is None or retained.is_expired(now):
+            return []
+
+        # A retained message received from a bridge is not sent on to another bridge
+        if is_bridge(self.retained_owner) and is_bridge(client.client_id):
+            return []
+
+        return [Topic._downgrade(retained, qos)]
+
+    def add_subscriber(self, client: Client, qos: int):
+        """Subscribes the client without sending it anything"""
+        self.subscribed_clients[client] = qos
+        self._subscribers_changed()
+
+    def replace_subscriber(self, previous: Client, client: Client):
+        """Moves the subscription of a previous connection to a new connection of the same client, if any"""
+        if previous in self.subscribed_clients:
+            self.subscribed_clients[client] = self.subscribed_clients.pop(previous)
+            self._subscribers_changed()
 
     def unsubscribe(self, client: Client):
         if client in self.subscribed_clients:
-            self.subscribed_clients.remove(client)
+            del self.subscribed_clients[client]
+            self._subscribers_changed()
         else:
             raise Warning(f"Warning: Client {client._address} not subscribed to topic {self.topic_name}")
+
+    def _subscribers_changed(self):
+        # The snapshot is replaced, never changed, so it can be iterated while the subscriptions change
+        if self.recipients is not None:
+            self.recipients = tuple(self.subscribed_clients.items())
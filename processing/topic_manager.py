@@ -1,7 +1,19 @@
-import re
+import time
+from collections import OrderedDict
+from functools import lru_cache, partial
 
+import config
 from connection import Client
-from messages import PublishMessage
+from connection.bridge import is_bridge
+from connection.expiry import ExpirySweeper
+from connection.heavy_hitters import TrafficStats
+from connection.memory import MemoryAccountant
+from connection.constants import MessageType
+from messages import Header, PublishMessage
+from messages.payload_store import PayloadStore
+from messages.properties import PropertyId
+from messages.structs import split_topic_name
+from processing.history import HistoryRequest, HistoryStore, parse_history_request
 from processing.topic import Topic
 from utils.singleton import Singleton
 
@@ -9,68 +21,312 @@ from utils.singleton import Singleton
 class TopicManager(metaclass=Singleton):
     """
     Class used to manage access to topics. Use it as a wrapper for Topic methods.
+    Topics are routed by their UTF-8 encoded names and levels, strings are decoded only for logging. \\
+    The recipients of a topic are cached until the subscriptions change, so a repeated publish
+    to a hot topic costs a dictionary lookup plus the fan-out.
     """
     def __init__(self):
-        self._topics: dict[str, Topic] = dict()
-        self._wildcards_subscriptions: set[tuple[Client, str]] = set()
+        self._topics: dict[bytes, Topic] = dict()
+        # Granted QoS by client and wildcard topic structure
+        self._wildcards_subscriptions: dict[tuple[Client, str], int] = dict()
+        # Charged for retained messages when set
+        self.memory: MemoryAccountant | None = None
+        # Counts received messages by topic and publishing client when set
+        self.traffic: TrafficStats | None = None
+        # Reclaims expired retained messages when set
+        self.expiry: ExpirySweeper | None = None
+        # Shares identical payloads of retained messages and histories when set
+        self.payload_store: PayloadStore | None = None
+        # Topic filter levels with the default expiry of the matching topics
+        self._expiry_filters = [
+            (TopicManager._split_topic_structure(topic_filter), seconds)
+            for topic_filter, seconds in config.MESSAGE_EXPIRY.items()
+        ]
+        # Topic filter levels with the messages and seconds kept for the matching topics
+        self._history_filters = [
+            (TopicManager._split_topic_structure(topic_filter), capacity, max_age)
+            for topic_filter, (capacity, max_age) in config.TOPIC_HISTORY.items()
+        ]
+        self.history = HistoryStore(config.TOPIC_HISTORY_MEMORY_LIMIT)
 
-    def _create_topic(self, topic_name: str):
-        if topic_name in self._topics.keys():
-            raise RuntimeWarning(f"Warning: Topic: {topic_name} already exists")  # Probably shouldn't get here?
-        else:
-            self._topics[topic_name] = Topic(topic_name)
+        # Topic name -> (generation, recipients), entries of an older generation are stale
+        self._route_cache: OrderedDict[bytes, tuple[int, tuple[tuple[Client, int], ...]]] = OrderedDict()
+        self._route_cache_size = config.ROUTE_CACHE_SIZE
+        self._generation = 0
+        self.route_cache_hits = 0
+        self.route_cache_misses = 0
+        self.route_cache_invalidations = 0
 
-    async def publish(self, message: PublishMessage):
+    def _create_topic(self, topic: bytes, levels: tuple[bytes, ...]) -> Topic:
+        """Creates a topic and subscribes the matching wildcard subscriptions to it"""
+        if topic in self._topics:
+            raise RuntimeWarning(f"Warning: Topic: {topic.decode()} already exists")  # Probably shouldn't get here?
+
+        created = self._topics[topic] = Topic(topic, levels)
+        self._attach_history(created)
+        self._attach_expiry(created)
+
+        # A new topic has no retained message yet, so nothing has to be sent to the subscribers
+        for (client, topic_structure), qos in self._wildcards_subscriptions.items():
+            if TopicManager._matches_levels(levels, TopicManager._split_topic_structure(topic_structure)):
+                created.subscribed_clients[client] = qos
+
+        return created
+
+    def _attach_history(self, topic: Topic):
+        """Gives the topic a history if it matches a TOPIC_HISTORY filter, the first matching filter applies"""
+        for structure_levels, capacity, max_age in self._history_filters:
+            if TopicManager._matches_levels(topic.levels, structure_levels):
+                topic.history = self.history.create(capacity, max_age, self.payload_store)
+                return
+
+    def _attach_expiry(self, topic: Topic):
+        """Gives the topic a default expiry if it matches a MESSAGE_EXPIRY filter, the first matching filter applies"""
+        for structure_levels, seconds in self._expiry_filters:
+            if TopicManager._matches_levels(topic.levels, structure_levels):
+                topic.default_expiry = seconds
+                return
+
+    def _invalidate_routes(self):
+        """Makes every cached route stale, called whenever subscriptions change"""
+        self._generation += 1
+        self.route_cache_invalidations += 1
+
+    def _route(self, topic: Topic) -> tuple[tuple[Client, int], ...]:
+        """Gets the recipients of a topic with their granted QoS"""
+        cached = self._route_cache.get(topic.topic)
+        if cached is not None and cached[0] == self._generation:
+            self.route_cache_hits += 1
+            self._route_cache.move_to_end(topic.topic)
+            return cached[1]
+
+        self.route_cache_misses += 1
+        recipients = tuple(topic.subscribed_clients.items())
+
+        self._route_cache[topic.topic] = (self._generation, recipients)
+        self._route_cache.move_to_end(topic.topic)
+        if len(self._route_cache) > self._route_cache_size:
+            self._route_cache.popitem(last=False)
+
+        return recipients
+
+    def _recipients(self, topic: Topic, bridged: bool) -> tuple[tuple[Client, int], ...]:
+        """Gets the recipients of a message, a message received from a bridge is not sent to other bridges"""
+        recipients = self._route(topic)
+        if not bridged:
+            return recipients
+
+        return tuple((client, qos) for client, qos in recipients if not is_bridge(client.client_id))
+
+    def route_cache_stats(self) -> dict[str, int]:
+        """Gets the hits, misses and invalidations of the route cache"""
+        return {
+            'hits': self.route_cache_hits,
+            'misses': self.route_cache_misses,
+            'invalidations': self.route_cache_invalidations,
+            'size': len(self._route_cache)
+        }
+
+    async def publish(self, message: PublishMessage, owner: str | None = None):
         """
         Publishes message to given topic, creates on if such doesn't exist
+        :param owner: identifier of the publishing client, a retained message is charged to it
         """
-        topic_name = message.topic_name
-        topic_matched = False
-        if TopicManager._is_valid_topic_name(topic_name):
-            if topic_name in self._topics.keys():
-                for client, topic_structure in self._wildcards_subscriptions:
-                    await self.subscribe_to_topic(topic_structure, client)
-                await self._topics[topic_name].publish(message)
-                topic_matched = True
+        topic = self._prepare(message, owner)
+        if topic is None:
+            return
+
+        await topic.publish(message, self._recipients(topic, is_bridge(owner)))
+
+    def _prepare(self, message: PublishMessage, owner: str | None) -> Topic | None:
+        """
+        Does the bookkeeping of a received message before it is delivered: creates its topic, counts it,
+        sets its expiry, records it in the history and retains it
+        :return: topic of the message, None if the topic name is not valid
+        """
+        topic = self._topics.get(message.topic)
+        if topic is None:
+            levels = message.topic_levels
+            if levels is None:
+                return None
+            topic = self._create_topic(message.topic, levels)
+
+        if self.traffic is not None:
+            self.traffic.record_in(message.topic, owner, message.payload_length)
+
+        if message.properties or topic.default_expiry is not None:
+            TopicManager._set_expiry(topic, message)
+
+        # A streamed payload is not held in memory, so it can't be kept
+        if topic.history is not None and message.payload_stream is None:
+            self.history.record(topic.history, message, time.monotonic())
+
+        if message.header.retain:
+            self._charge_retained(topic, message, owner)
+            self._watch_retained(topic, message)
+            self._retain(topic, message)
+
+        return topic
+
+    def _charge_retained(self, topic: Topic, message: PublishMessage, owner: str | None):
+        """Moves the memory charged for the retained message of a topic to the message replacing it"""
+        if self.memory is None:
+            return
+
+        previous = topic.retained_message
+        if previous is not None:
+            self.memory.release(topic.retained_owner, topic.topic, previous.frame_size())
+
+        if message.payload:
+            self.memory.charge(owner, topic.topic, message.frame_size())
+        topic.retained_owner = owner
+
+    def _retain(self, topic: Topic, message: PublishMessage):
+        """Retains the message of a topic, its payload is shared through the payload store when set"""
+        if self.payload_store is not None:
+            previous = topic.retained_message
+            message.payload = self.payload_store.acquire(message.payload)
+            if previous is not None:
+                self.payload_store.release(previous.payload)
+
+        topic.retain(message)
+
+    @staticmethod
+    def _set_expiry(topic: Topic, message: PublishMessage):
+        """Sets when a received message expires: after its MQTT 5 expiry interval, or the default of its topic"""
+        interval = message.properties.get(PropertyId.MESSAGE_EXPIRY_INTERVAL) if message.properties else None
+        if interval is None:
+            interval = topic.default_expiry
+        if interval is not None:
+            message.expires_at = time.monotonic() + interval
+
+    def _watch_retained(self, topic: Topic, message: PublishMessage):
+        """Schedules the expiry sweeper for a retained message, unless it is already scheduled earlier"""
+        if self.expiry is None or message.expires_at is None or not message.payload:
+            return
+
+        if topic.expiry_scheduled is None or message.expires_at < topic.expiry_scheduled:
+            topic.expiry_scheduled = message.expires_at
+            self.expiry.schedule(message.expires_at, partial(self._reclaim_retained, topic))
+
+    def _reclaim_retained(self, topic: Topic, now: float) -> tuple[int, int]:
+        """
+        Drops the retained message of a topic if it expired, called by the expiry sweeper
+        :return: number of dropped messages and their size
+        """
+        # Superseded by an earlier schedule, which already handled the retained message
+        if topic.expiry_scheduled is None or topic.expiry_scheduled > now:
+            return 0, 0
+
+        topic.expiry_scheduled = None
+        message = topic.retained_message
+        if message is None or message.expires_at is None:
+            return 0, 0
+
+        # Replaced by a message expiring later
+        if not message.is_expired(now):
+            self._watch_retained(topic, message)
+            return 0, 0
+
+        size = message.frame_size()
+        if self.memory is not None:
+            self.memory.release(topic.retained_owner, topic.topic, size)
+        if self.payload_store is not None:
+            self.payload_store.release(message.payload)
+        topic.retained_message = None
+        topic.retained_owner = None
+
+        return 1, size
+
+    async def publish_batch(self, batch: list[tuple[PublishMessage, str | None]]):
+        """
+        Publishes messages grouped by topic: the recipients of a topic are resolved once per batch
+        and every recipient gets all of its messages at once. The order of the messages of a topic is kept
+        :param batch: messages with the identifier of their publishing client, see publish
+        """
+        # Messages received from bridges are grouped apart, they have fewer recipients
+        groups: dict[tuple[bytes, bool], list[PublishMessage]] = dict()
+        for message, owner in batch:
+            if self._prepare(message, owner) is None:
+                continue
+
+            groups.setdefault((message.topic, is_bridge(owner)), []).append(message)
 
-            if not topic_matched:
-                self._create_topic(topic_name)
-                for client, topic_structure in self._wildcards_subscriptions:
-                    await self.subscribe_to_topic(topic_structure, client)
-                await self.publish(message)
+        deliveries: dict[Client, list[PublishMessage]] = dict()
+        for (topic_name, bridged), messages in groups.items():
+            topic = self._topics[topic_name]
+            topic.collect(messages, self._recipients(topic, bridged), deliveries)
 
-    async def subscribe_to_topic(self, topic_structure: str, client: Client):
+        for client, messages in deliveries.items():
+            await client.notify_many(messages)
+
+    async def subscribe_to_topic(
+        self,
+        topic_structure: str,
+        client: Client,
+        qos: int,
+        replay: HistoryRequest | None = None
+    ):
         """
         Subscribes client to every topic matching given topic_structure. \\
         If no topic is found, and topic_structure is a valid topic name - it creates and subscribes to a new topic
-        :param topic_structure: string containing structure e.g. - "abc3/def" or "abc/#/xyz" or "a0" etc.
+        :param topic_structure: string containing structure e.g. - "abc3/def" or "abc/#/xyz" or "a0" etc.,
+            $history/<all | N | Ts>/<structure> replays the history of the matching topics
         :param client: subscribing client
+        :param qos: granted QoS, messages are delivered to the client with at most this QoS
+        :param replay: messages of the topics' histories to send instead of their retained messages
         :return:
         """
+        for message in self._subscribe(topic_structure, client, qos, replay):
+            await client.notify(message)
+
+    def _subscribe(
+        self,
+        topic_structure: str,
+        client: Client,
+        qos: int,
+        replay: HistoryRequest | None = None
+    ) -> list[PublishMessage]:
+        """
+        Subscribes client like subscribe_to_topic, without sending it anything
+        :return: retained messages, or messages of the histories, to send to the client
+        """
+        request, topic_structure = parse_history_request(topic_structure)
+        replay = replay or request
+
+        self._invalidate_routes()
+        structure_levels = TopicManager._split_topic_structure(topic_structure)
         topic_matched = False
-        for topic_name in self._topics.keys():
-            if TopicManager._matches_name_with_structure(topic_name, topic_structure):
-                await self._topics[topic_name].subscribe(client)
+        messages = []
+        for topic in self._topics.values():
+            if TopicManager._matches_levels(topic.levels, structure_levels):
+                messages += topic.subscribe(client, qos, replay)
                 topic_matched = True
 
         if not topic_matched and TopicManager._is_valid_topic_name(topic_structure):
-            self._create_topic(topic_structure)
-            await self.subscribe_to_topic(topic_structure, client)
+            topic = topic_structure.encode()
+            self._create_topic(topic, split_topic_name(topic))
+            return self._subscribe(topic_structure, client, qos, replay)
 
         elif not TopicManager._is_valid_topic_name(topic_structure):
             if "#" in topic_structure:
-                self._wildcards_subscriptions.add((client, topic_structure.split("#")[0]+"#"))
+                self._wildcards_subscriptions[(client, topic_structure.split("#")[0]+"#")] = qos
             else:
-                self._wildcards_subscriptions.add((client, topic_structure))
+                self._wildcards_subscriptions[(client, topic_structure)] = qos
+
+        return messages
 
     def unsubscribe_from_topic(self, topic_structure: str, client: Client):
         """
         Unsubscribes client from every topic matching topic_structure. Raises Warning when no topic matched
         """
+        _, topic_structure = parse_history_request(topic_structure)
+        self._invalidate_routes()
+        structure_levels = TopicManager._split_topic_structure(topic_structure)
         topic_matched = False
-        for topic_name in self._topics.keys():
-            if TopicManager._matches_name_with_structure(topic_name, topic_structure):
-                self._topics[topic_name].unsubscribe(client)
+        for topic in self._topics.values():
+            if TopicManager._matches_levels(topic.levels, structure_levels):
+                topic.unsubscribe(client)
                 topic_matched = True
 
         to_remove: set[(Client, str)] = set()
@@ -79,40 +335,139 @@ class TopicManager(metaclass=Singleton):
                 to_remove.add((client, wildcard_name))
                 topic_matched = True
         for element in to_remove:
-            self._wildcards_subscriptions.remove(element)
+            del self._wildcards_subscriptions[element]
 
         if not topic_matched:
             raise Warning(f"Warning: No topic matching structure {topic_structure} exists")
 
     def clear_session(self, client: Client):
         """Unsubscribe client from all topics. Used with clean_session flag"""
-        for topic_name in self._topics.keys():
+        self._invalidate_routes()
+        for topic in self._topics.values():
             try:
-                self._topics[topic_name].unsubscribe(client)
+                topic.unsubscribe(client)
             except Warning:
                 pass
-        self._wildcards_subscriptions = {(sub_client, topic) for sub_client, topic
-                                         in self._wildcards_subscriptions if sub_client != client}
+        self._wildcards_subscriptions = {(sub_client, topic): qos for (sub_client, topic), qos
+                                         in self._wildcards_subscriptions.items() if sub_client != client}
         return
 
+    def transfer_session(self, previous: Client, client: Client):
+        """Moves all subscriptions of a previous connection to a new connection of the same client"""
+        self._invalidate_routes()
+        for topic in self._topics.values():
+            topic.replace_subscriber(previous, client)
+        self._wildcards_subscriptions = {(client if sub_client is previous else sub_client, topic): qos
+                                         for (sub_client, topic), qos in self._wildcards_subscriptions.items()}
+
+    def export_state(self, clients: set[Client]) -> dict:
+        """
+        Exports topics, retained messages and subscriptions of the given clients, so they can be
+        restored in another process with restore_state
+        """
+        topics = []
+        for topic in self._topics.values():
+            retained = None
+            if topic.retained_message is not None:
+                message = topic.retained_message
+                retained = {
+                    'dup': message.header.dup,
+                    'qos': message.header.qos,
+                    'retain': message.header.retain,
+                    'message_id': message.message_id,
+                    'payload': message.payload.hex(),
+                    'owner': topic.retained_owner,
+                    # Monotonic clocks are not guaranteed to agree across processes, the remaining seconds are exported
+                    'expires_in': message.expires_at - time.monotonic() if message.expires_at is not None else None
+                }
+
+            topics.append({
+                'topic_name': topic.topic_name,
+                'subscribers': [[client.address, qos] for client, qos
+                                in topic.subscribed_clients.items() if client in clients],
+                'retained': retained
+            })
+
+        wildcards = [[client.address, topic_structure, qos] for (client, topic_structure), qos
+                     in self._wildcards_subscriptions.items() if client in clients]
+
+        return {'topics': topics, 'wildcards': wildcards}
+
+    def restore_state(self, state: dict, clients: dict[str, Client]):
+        """
+        Restores topics and subscriptions exported by export_state. \\
+        Subscriptions of clients missing from the clients dictionary (address -> client) are dropped
+        """
+        self._invalidate_routes()
+        for topic_state in state['topics']:
+            topic_name = topic_state['topic_name'].encode()
+            topic = self._topics.get(topic_name)
+            if topic is None:
+                topic = self._topics[topic_name] = Topic(topic_name, split_topic_name(topic_name))
+                self._attach_history(topic)
+                self._attach_expiry(topic)
+
+            for address, qos in topic_state['subscribers']:
+                if address in clients:
+                    topic.add_subscriber(clients[address], qos)
+
+            retained = topic_state['retained']
+            if retained is not None:
+                message = PublishMessage(
+                    Header(MessageType.PUBLISH, retained['dup'], retained['qos'], retained['retain']),
+                    topic_name,
+                    retained['message_id'],
+                    bytes.fromhex(retained['payload'])
+                )
+                if retained.get('expires_in') is not None:
+                    message.expires_at = time.monotonic() + retained['expires_in']
+                self._charge_retained(topic, message, retained.get('owner'))
+                self._watch_retained(topic, message)
+                self._retain(topic, message)
+
+        for address, topic_structure, qos in state['wildcards']:
+            if address in clients:
+                self._wildcards_subscriptions[(clients[address], topic_structure)] = qos
+
     @staticmethod
     def _is_valid_topic_name(topic_name: str) -> bool:
         """
         Checks whether topic_name doesn't include wildcards, is not empty, \\
         contains at least on symbol after every '/' (if they're present).
         """
-        topic_regex = re.compile(r'^[^#+/]+(/[^#+/]+)*$')
-        return bool(topic_regex.match(topic_name)) and topic_name
+        return split_topic_name(topic_name.encode()) is not None
+
+    @staticmethod
+    @lru_cache(maxsize=config.TOPIC_NAME_CACHE_SIZE)
+    def _split_topic_structure(topic_structure: str) -> tuple[bytes, ...]:
+        """
+        Splits a structure (string which may include wildcards - '#', '+') into UTF-8 encoded levels. \\
+        Everything following a '#' is ignored
+        """
+        levels = topic_structure.encode().split(b'/')
+        if b'#' in levels:
+            levels = levels[:levels.index(b'#') + 1]
+        return tuple(levels)
+
+    @staticmethod
+    def _matches_levels(topic_levels: tuple[bytes, ...], structure_levels: tuple[bytes, ...]) -> bool:
+        """
+        Checks whether topic levels match with levels of a structure. \\
+        '+' matches exactly one level, '#' matches one or more remaining levels
+        """
+        for index, level in enumerate(structure_levels):
+            if level == b'#':
+                return len(topic_levels) > index
+            if index >= len(topic_levels) or (level != b'+' and level != topic_levels[index]):
+                return False
+        return len(topic_levels) == len(structure_levels)
 
     @staticmethod
     def _matches_name_with_structure(topic_name: str, topic_structure: str) -> bool:
         """
         Checks whether topic_name matches with given structure (string which may include wildcards - '#', '+')
         """
-        pattern = topic_structure.replace('+', '[^/]*')
-        if "#" in pattern:
-            pattern = pattern.split("#")[0]+"#"
-        pattern = pattern.replace('/#', '/.*')
-        pattern = pattern.replace('#', '.*')
-        pattern = '^' + pattern + '$'
-        return bool(re.compile(pattern).match(topic_name))
+        return TopicManager._matches_levels(
+            tuple(topic_name.encode().split(b'/')),
+            TopicManager._split_topic_structure(topic_structure)
+        )
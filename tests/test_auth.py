@@ -0,0 +1,56 @@
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import config
+from authentication.auth import Auth
+from authentication.user import User
+from exceptions.authentication import PasswdFileInvalidException
+from utils.singleton import Singleton
+
+
+class LegacyPasswdFileTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'passwd'
+
+        for name, value in (('PASSWD_FILE_PATH', str(self.path)), ('PASSWORD_KDF_PARAMS', {'iterations': 1000}),
+                            ('USERS', [User('admin', 'admin'), User('user-1', 'user-1')])):
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        Singleton._instances.pop(Auth, None)
+        self.addCleanup(Singleton._instances.pop, Auth, None)
+
+    def write_baseline_file(self, usernames: list[str]):
+        """Writes the passwd file as the previous format did, hashed with a salt that was thrown away."""
+
+        self.path.write_text(''.join(
+            f'{username}:{hashlib.sha256((username + "lost-salt").encode()).hexdigest()}\n' for username in usernames
+        ))
+
+    def test_baseline_file_is_rebuilt_from_users(self):
+        self.write_baseline_file(['admin', 'user-1'])
+
+        auth = Auth()
+        auth.load()
+
+        self.assertTrue(auth.authenticate('admin', 'admin'))
+        self.assertTrue(auth.authenticate('user-1', 'user-1'))
+        self.assertFalse(auth.authenticate('admin', 'user-1'))
+        self.assertTrue(all(line.startswith(('admin:pbkdf2_sha256$', 'user-1:pbkdf2_sha256$'))
+                            for line in self.path.read_text().splitlines()))
+
+    def test_file_without_valid_credentials_stops_loading(self):
+        self.write_baseline_file(['someone-else'])
+
+        with self.assertRaises(PasswdFileInvalidException):
+            Auth().load()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import asyncio
+import socket
+import unittest
+
+from connection import Server
+from connection.client import Client
+from connection.constants import MessageType
+from messages import Header, PublishMessage
+
+
+class QueuedMemoryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = Server(auth=False, batch_window=None, capture_path=None)
+
+        # The other end is never read from, so the subscriber's transport fills up and its messages get queued
+        self.socket, self.peer = socket.socketpair()
+        reader, writer = await asyncio.open_connection(sock=self.socket)
+        self.writer = writer
+        self.client = Client(self.server, reader, writer, False, 'test')
+
+    async def asyncTearDown(self):
+        self.writer.transport.abort()
+        self.peer.close()
+
+    async def test_queued_bytes_are_counted_once(self):
+        payload = b'x' * 1024
+        while self.client.queued_size < 256 * 1024:
+            await self.client.notify(PublishMessage(Header(MessageType.PUBLISH, 0, 0, 0), b'memory/test', None, payload))
+
+        transport_size = self.writer.transport.get_write_buffer_size()
+        self.assertEqual(self.server.memory.charged, self.client.queued_size)
+        self.assertEqual(self.server.memory.usage, self.client.queued_size + transport_size)
+
+
+if __name__ == '__main__':
+    unittest.main()